@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Simulated Ollama, TTS and Whisper backends
+
+Latency-configurable stand-ins for the services the orchestrator calls, so it
+can be benchmarked offline without GPUs or containers:
+
+- Ollama: /api/generate (streaming and non-streaming), /api/embeddings, /api/tags, /api/ps
+- MaryTTS-style TTS: /voices, /api/tts
+- Whisper ASR webservice: /asr
+
+Generation is simulated as time to first token plus a fixed interval per
+token, with at most --llm-parallel requests generating at once (like
+OLLAMA_NUM_PARALLEL); queued requests wait for a slot.
+
+Usage: python bench/backends.py [--llm-ttft 0.25] [--llm-token-interval 0.02] ...
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import signal
+import struct
+import wave
+
+import uvicorn
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+MODELS = ["tinyllama:latest", "phi3:mini"]
+
+REPLY_WORDS = ("That sounds great! I am happy to help you with that. Let's take it one step "
+               "at a time, and tell me if anything is unclear.").split()
+
+SAMPLE_RATE = 16000
+
+EMBEDDING_DIMENSIONS = 64
+
+
+def silent_wav(seconds: float) -> bytes:
+    """16 kHz mono 16-bit WAV of silence."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(b"\x00\x00" * int(SAMPLE_RATE * seconds))
+    return buffer.getvalue()
+
+
+def wav_duration(data: bytes) -> float:
+    """Duration of a PCM WAV file, estimated from its size if the header is unusual."""
+    if len(data) >= 44 and data[:4] == b"RIFF" and data[8:12] == b"WAVE":
+        channels, rate = struct.unpack("<HI", data[22:28])
+        bits = struct.unpack("<H", data[34:36])[0]
+        if channels and rate and bits:
+            return (len(data) - 44) / (channels * rate * bits / 8)
+    return len(data) / (SAMPLE_RATE * 2)
+
+
+def create_ollama_app(args) -> FastAPI:
+    app = FastAPI(title="Ollama stand-in")
+    slots = asyncio.Semaphore(args.llm_parallel)
+
+    def stats(prompt: str, tokens: int) -> dict:
+        return {
+            "done": True,
+            "load_duration": 0,
+            "prompt_eval_count": len(prompt.split()),
+            "prompt_eval_duration": int(args.llm_ttft * 1e9),
+            "eval_count": tokens,
+            "eval_duration": int(tokens * args.llm_token_interval * 1e9),
+        }
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": [
+            {"name": name, "size": 1_000_000_000,
+             "details": {"family": "llama", "parameter_size": "1B", "quantization_level": "Q4_0"}}
+            for name in MODELS
+        ]}
+
+    @app.get("/api/ps")
+    async def ps():
+        return {"models": [{"name": MODELS[0], "model": MODELS[0], "size_vram": 0}]}
+
+    @app.post("/api/generate")
+    async def generate(request: Request):
+        body = await request.json()
+        prompt = body.get("prompt", "")
+        tokens = min(args.llm_tokens, body.get("options", {}).get("num_predict") or args.llm_tokens)
+        words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(tokens)]
+
+        if not body.get("stream", True):
+            async with slots:
+                await asyncio.sleep(args.llm_ttft + tokens * args.llm_token_interval)
+            return dict(stats(prompt, tokens), model=body.get("model"), response=" ".join(words))
+
+        async def stream():
+            async with slots:
+                await asyncio.sleep(args.llm_ttft)
+                for i, word in enumerate(words):
+                    if i:
+                        await asyncio.sleep(args.llm_token_interval)
+                    fragment = word if i == 0 else " " + word
+                    yield json.dumps({"model": body.get("model"), "response": fragment, "done": False}) + "\n"
+            yield json.dumps(dict(stats(prompt, tokens), model=body.get("model"), response="")) + "\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    @app.post("/api/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await asyncio.sleep(args.embed_latency)
+        # Hashed bag of words, so texts sharing words come out similar
+        vector = [0.0] * EMBEDDING_DIMENSIONS
+        for word in body.get("prompt", "").lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += 1.0
+        return {"embedding": vector}
+
+    return app
+
+
+def create_tts_app(args) -> FastAPI:
+    app = FastAPI(title="TTS stand-in")
+
+    @app.get("/voices")
+    async def voices():
+        return PlainTextResponse("cmu-bdl-hsmm en_US male hmm\nupmc-pierre-hsmm fr male hmm\n")
+
+    @app.get("/api/tts")
+    async def tts(text: str = "", voice: str = ""):
+        await asyncio.sleep(args.tts_base + len(text) * args.tts_per_char)
+        # Roughly 15 characters of speech per second
+        return Response(silent_wav(max(len(text) / 15, 0.2)), media_type="audio/wav")
+
+    return app
+
+
+def create_whisper_app(args) -> FastAPI:
+    app = FastAPI(title="Whisper stand-in")
+
+    @app.post("/asr")
+    async def asr(audio_file: UploadFile = File(...), task: str = Form("transcribe"),
+                  language: str = Form(None)):
+        data = await audio_file.read()
+        await asyncio.sleep(args.stt_base + wav_duration(data) * args.stt_per_second)
+        return JSONResponse({"text": "Hello, how are you doing today?", "language": language or "en"})
+
+    return app
+
+
+def add_latency_arguments(parser: argparse.ArgumentParser) -> None:
+    """Latency options shared with the load test, which passes them through."""
+    parser.add_argument("--llm-ttft", type=float, default=0.25, help="Seconds until the first token")
+    parser.add_argument("--llm-token-interval", type=float, default=0.02, help="Seconds per generated token")
+    parser.add_argument("--llm-tokens", type=int, default=40, help="Tokens per reply")
+    parser.add_argument("--llm-parallel", type=int, default=4, help="Requests generating at once")
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per embedding")
+    parser.add_argument("--tts-base", type=float, default=0.05, help="Seconds per TTS request")
+    parser.add_argument("--tts-per-char", type=float, default=0.002, help="Extra TTS seconds per character")
+    parser.add_argument("--stt-base", type=float, default=0.1, help="Seconds per transcription")
+    parser.add_argument("--stt-per-second", type=float, default=0.05, help="Extra STT seconds per second of audio")
+
+
+class _Server(uvicorn.Server):
+    # Each server would install its own handlers, leaving only the last one to stop on SIGTERM
+    def install_signal_handlers(self) -> None:
+        pass
+
+
+async def serve(args) -> None:
+    """Run all three stand-ins until cancelled, SIGINT or SIGTERM."""
+    servers = [
+        _Server(uvicorn.Config(create_ollama_app(args), host=args.host, port=args.ollama_port,
+                               log_level="warning", access_log=False)),
+        _Server(uvicorn.Config(create_tts_app(args), host=args.host, port=args.tts_port,
+                               log_level="warning", access_log=False)),
+        _Server(uvicorn.Config(create_whisper_app(args), host=args.host, port=args.whisper_port,
+                               log_level="warning", access_log=False)),
+    ]
+
+    def stop() -> None:
+        for server in servers:
+            server.should_exit = True
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop)
+    print(f"Backends on {args.host}: Ollama :{args.ollama_port}, TTS :{args.tts_port}, "
+          f"Whisper :{args.whisper_port}", flush=True)
+    await asyncio.gather(*(server.serve() for server in servers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated Ollama, TTS and Whisper backends")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--ollama-port", type=int, default=18434)
+    parser.add_argument("--tts-port", type=int, default=18502)
+    parser.add_argument("--whisper-port", type=int, default=18900)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Orchestrator load test
+
+Starts the simulated backends (bench/backends.py) and an orchestrator
+pointing at them, then drives concurrent /chat, /voice and websocket load and
+reports throughput and p50/p95/p99 latency per endpoint. The ws_voice
+scenario sends recordings over the binary websocket subprotocol and waits
+for the reply's audio frames. Everything runs
+locally, so the numbers reflect the orchestrator itself.
+
+Results can be saved as a named baseline (bench/baselines/<name>.json) and
+later runs compared against it, so a change shows up as a diff:
+
+    python bench/load_test.py --save-baseline main
+    python bench/load_test.py --compare main
+
+Websocket scenarios need the `websockets` package (also needed by uvicorn to
+serve the orchestrator's /ws endpoint); they are skipped without it.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from typing import Dict, List, Optional
+
+import httpx
+
+from backends import add_latency_arguments
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ORCHESTRATOR_DIR = os.path.join(os.path.dirname(BENCH_DIR), "companion-orchestrator")
+BASELINE_DIR = os.path.join(BENCH_DIR, "baselines")
+
+ENDPOINTS = ("chat", "chat_audio", "voice", "ws", "ws_stream", "ws_voice")
+
+PROMPTS = [
+    "How was your day?",
+    "Can you help me plan a workout for this week?",
+    "Tell me something interesting about the ocean.",
+    "I feel a bit tired today, any advice?",
+]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float("nan")
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def speech_wav(seconds: float = 2.0) -> bytes:
+    """16 kHz mono WAV of a tone, standing in for a recorded question."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        frames = bytearray()
+        for i in range(int(16000 * seconds)):
+            frames += int(8000 * math.sin(2 * math.pi * 220 * i / 16000)).to_bytes(2, "little", signed=True)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+class Recorder:
+    """Latencies and errors for one endpoint."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.first_token: List[float] = []
+
+    def summary(self, elapsed: float) -> Dict[str, float]:
+        values = sorted(self.latencies)
+        result = {
+            "requests": len(values),
+            "errors": self.errors,
+            "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1),
+            "max_ms": round(values[-1] * 1000, 1) if values else float("nan"),
+        }
+        if self.first_token:
+            first = sorted(self.first_token)
+            result["ttft_p50_ms"] = round(percentile(first, 50) * 1000, 1)
+            result["ttft_p95_ms"] = round(percentile(first, 95) * 1000, 1)
+        return result
+
+
+async def run_http_worker(client: httpx.AsyncClient, endpoint: str, recorder: Recorder,
+                          deadline: float, worker: int, audio: bytes) -> None:
+    i = 0
+    while time.perf_counter() < deadline:
+        prompt = PROMPTS[(worker + i) % len(PROMPTS)]
+        user_id = f"bench-{endpoint}-{worker}"
+        started = time.perf_counter()
+        try:
+            if endpoint == "voice":
+                response = await client.post(
+                    "/voice",
+                    files={"audio_data": ("question.wav", audio, "audio/wav")},
+                    data={"user_id": user_id, "generate_audio": "true"}
+                )
+            else:
+                response = await client.post("/chat", json={
+                    "text": prompt,
+                    "user_id": user_id,
+                    "generate_audio": endpoint == "chat_audio",
+                })
+            response.raise_for_status()
+            recorder.latencies.append(time.perf_counter() - started)
+        except Exception:
+            recorder.errors += 1
+        i += 1
+
+
+async def run_ws_worker(url: str, endpoint: str, recorder: Recorder, deadline: float, worker: int) -> None:
+    import websockets
+
+    stream = endpoint == "ws_stream"
+    async with websockets.connect(f"{url}/ws/bench-{endpoint}-{worker}", max_size=None) as websocket:
+        i = 0
+        while time.perf_counter() < deadline:
+            request_id = f"{worker}-{i}"
+            started = time.perf_counter()
+            await websocket.send(json.dumps({
+                "type": "text",
+                "text": PROMPTS[(worker + i) % len(PROMPTS)],
+                "generate_audio": False,
+                "stream": stream,
+                "request_id": request_id,
+            }))
+            first_token = True
+            while True:
+                message = json.loads(await websocket.recv())
+                if message.get("request_id") != request_id:
+                    continue
+                if message.get("type") == "token":
+                    if first_token:
+                        recorder.first_token.append(time.perf_counter() - started)
+                        first_token = False
+                    continue
+                if "error" in message:
+                    recorder.errors += 1
+                    break
+                if message.get("type") is None:
+                    recorder.latencies.append(time.perf_counter() - started)
+                    break
+            i += 1
+
+
+async def run_ws_voice_worker(url: str, recorder: Recorder, deadline: float, worker: int, audio: bytes) -> None:
+    import websockets
+
+    sys.path.insert(0, ORCHESTRATOR_DIR)
+    from services.ws_protocol import AUDIO, BINARY_SUBPROTOCOL, CODEC_IDS, END, MESSAGE, decode_frame, encode_frame
+
+    async with websockets.connect(f"{url}/ws/bench-ws_voice-{worker}", max_size=None,
+                                  subprotocols=[BINARY_SUBPROTOCOL]) as websocket:
+        i = 0
+        while time.perf_counter() < deadline:
+            request_id = f"{worker}-{i}"
+            stream = i + 1
+            started = time.perf_counter()
+            await websocket.send(encode_frame(MESSAGE, json.dumps({
+                "type": "voice", "stream": stream, "codec": "wav", "request_id": request_id,
+            }).encode("utf-8")))
+            for offset in range(0, len(audio), 16384):
+                flags = END if offset + 16384 >= len(audio) else 0
+                await websocket.send(encode_frame(AUDIO, audio[offset:offset + 16384], CODEC_IDS["wav"], flags, stream))
+            # The final response, then the end of its audio stream
+            reply_stream = None
+            while True:
+                frame = decode_frame(await websocket.recv())
+                if frame.kind == AUDIO:
+                    if frame.end and frame.stream == reply_stream:
+                        recorder.latencies.append(time.perf_counter() - started)
+                        break
+                    continue
+                message = json.loads(frame.payload)
+                if message.get("request_id") != request_id:
+                    continue
+                if "error" in message:
+                    recorder.errors += 1
+                    break
+                if message.get("type") is None:
+                    reply_stream = message.get("audio_stream")
+                    if reply_stream is None:
+                        recorder.latencies.append(time.perf_counter() - started)
+                        break
+            i += 1
+
+
+async def run_endpoint(url: str, endpoint: str, concurrency: int, duration: float, audio: bytes) -> Dict:
+    recorder = Recorder()
+    started = time.perf_counter()
+    deadline = started + duration
+    if endpoint.startswith("ws"):
+        ws_url = "ws" + url[len("http"):]
+        if endpoint == "ws_voice":
+            workers = (run_ws_voice_worker(ws_url, recorder, deadline, worker, audio) for worker in range(concurrency))
+        else:
+            workers = (run_ws_worker(ws_url, endpoint, recorder, deadline, worker) for worker in range(concurrency))
+        results = await asyncio.gather(*workers, return_exceptions=True)
+        recorder.errors += sum(1 for result in results if isinstance(result, Exception))
+    else:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=120.0, limits=limits) as client:
+            await asyncio.gather(*(run_http_worker(client, endpoint, recorder, deadline, worker, audio)
+                                   for worker in range(concurrency)))
+    return recorder.summary(time.perf_counter() - started)
+
+
+async def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+            await asyncio.sleep(0.2)
+
+
+def start_processes(args) -> List[subprocess.Popen]:
+    host = "127.0.0.1"
+    backend_cmd = [sys.executable, os.path.join(BENCH_DIR, "backends.py"),
+                   "--ollama-port", str(args.ollama_port), "--tts-port", str(args.tts_port),
+                   "--whisper-port", str(args.whisper_port)]
+    for name in ("llm_ttft", "llm_token_interval", "llm_tokens", "llm_parallel", "embed_latency",
+                 "tts_base", "tts_per_char", "stt_base", "stt_per_second"):
+        backend_cmd += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+
+    # Fresh audio, history and memory per run, so runs (and baselines) don't
+    # inherit each other's accumulated state
+    state_dir = tempfile.mkdtemp(prefix="companion-bench-")
+    env = dict(os.environ)
+    env.update({
+        "OLLAMA_URL": f"http://{host}:{args.ollama_port}",
+        "TTS_URL": f"http://{host}:{args.tts_port}",
+        "WHISPER_API_URL": f"http://{host}:{args.whisper_port}",
+        "DEFAULT_MODEL": "tinyllama:latest",
+        "AVAILABLE_MODELS": "tinyllama:latest,phi3:mini",
+        "AUDIO_STORE_DIR": os.path.join(state_dir, "audio"),
+        "CONVERSATION_DB": os.path.join(state_dir, "conversations.sqlite3"),
+        "MEMORY_DIR": os.path.join(state_dir, "memory"),
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+    })
+    orchestrator_cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", host,
+                        "--port", str(args.port), "--workers", str(args.workers),
+                        "--log-level", "warning", "--no-access-log"]
+
+    processes = [subprocess.Popen(backend_cmd)]
+    processes.append(subprocess.Popen(orchestrator_cmd, cwd=ORCHESTRATOR_DIR, env=env))
+    return processes
+
+
+def print_report(results: Dict[str, Dict], baseline: Optional[Dict] = None, tolerance: float = 10.0) -> bool:
+    """Print the results table, with changes against a baseline. Returns True if anything regressed."""
+    regressed = False
+    header = f"{'endpoint':<11} {'reqs':>6} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, result in results.items():
+        print(f"{endpoint:<11} {result['requests']:>6} {result['errors']:>4} {result['rps']:>8} "
+              f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9} {result['max_ms']:>9}")
+        if "ttft_p50_ms" in result:
+            print(f"{'':<11} first token p50 {result['ttft_p50_ms']} ms, p95 {result['ttft_p95_ms']} ms")
+
+        previous = (baseline or {}).get(endpoint)
+        if not previous:
+            continue
+        changes = []
+        for key, higher_is_worse in (("rps", False), ("p50_ms", True), ("p95_ms", True), ("p99_ms", True)):
+            old, new = previous.get(key), result.get(key)
+            if not old or new is None or math.isnan(new):
+                continue
+            change = (new - old) / old * 100
+            worse = change > tolerance if higher_is_worse else change < -tolerance
+            regressed = regressed or worse
+            changes.append(f"{key} {change:+.1f}%{' !' if worse else ''}")
+        print(f"{'':<11} vs baseline: {', '.join(changes)}")
+    return regressed
+
+
+async def run(args) -> int:
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        print(f"Unknown endpoints: {', '.join(sorted(unknown))} (choose from {', '.join(ENDPOINTS)})")
+        return 2
+    if any(e.startswith("ws") for e in endpoints):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            print("websockets is not installed; skipping websocket scenarios")
+            endpoints = [e for e in endpoints if not e.startswith("ws")]
+
+    processes = [] if args.url else start_processes(args)
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    try:
+        if not args.url:
+            await wait_until_up(f"http://127.0.0.1:{args.ollama_port}/api/tags")
+        await wait_until_up(f"{url}/health")
+
+        audio = speech_wav()
+        results = {}
+        for endpoint in endpoints:
+            if args.warmup:
+                await run_endpoint(url, endpoint, args.concurrency, args.warmup, audio)
+            results[endpoint] = await run_endpoint(url, endpoint, args.concurrency, args.duration, audio)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    baseline = None
+    if args.compare:
+        path = os.path.join(BASELINE_DIR, f"{args.compare}.json")
+        with open(path) as f:
+            baseline = json.load(f)["results"]
+    regressed = print_report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "host": {"python": platform.python_version(), "machine": platform.machine(),
+                         "cpus": os.cpu_count()},
+                "config": {key: value for key, value in vars(args).items()
+                           if key not in ("compare", "save_baseline")},
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {path}")
+
+    return 1 if regressed and args.fail_on_regression else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the orchestrator against simulated backends")
+    parser.add_argument("--endpoints", default="chat,chat_audio,voice,ws,ws_stream,ws_voice",
+                        help=f"Comma-separated scenarios, run one after another ({', '.join(ENDPOINTS)})")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients per scenario")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds each scenario runs")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds before each scenario")
+    parser.add_argument("--workers", type=int, default=1, help="Orchestrator worker processes")
+    parser.add_argument("--port", type=int, default=18000, help="Port for the orchestrator under test")
+    parser.add_argument("--ollama-port", type=int, default=18434)
+    parser.add_argument("--tts-port", type=int, default=18502)
+    parser.add_argument("--whisper-port", type=int, default=18900)
+    parser.add_argument("--url", help="Test an already running orchestrator instead of starting one")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save results as bench/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare results with bench/baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="Percent change counted as a regression when comparing (default 10)")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 if a compared metric regressed")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
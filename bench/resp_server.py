@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Redis-protocol stand-in
+
+A small in-process server speaking enough of the Redis protocol (RESP) for the
+orchestrator's shared state store: GET, SET (with EX/PX), DEL, EXPIRE, PEXPIRE, PUBLISH,
+SUBSCRIBE, UNSUBSCRIBE, SELECT, AUTH and PING. Lets several orchestrator
+workers share state on a laptop without installing Redis.
+
+Usage: python bench/resp_server.py [--host 127.0.0.1] [--port 6379]
+"""
+
+import argparse
+import asyncio
+import time
+
+
+class RESPServer:
+    """Single-database, in-memory server for the RESP commands the orchestrator uses."""
+
+    def __init__(self):
+        self.values = {}
+        self.subscribers = {}
+
+    async def handle_client(self, reader, writer):
+        channels = set()
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                name = command[0].upper()
+
+                if name == b"SUBSCRIBE":
+                    for channel in command[1:]:
+                        self.subscribers.setdefault(channel, set()).add(writer)
+                        channels.add(channel)
+                        writer.write(self._array([b"subscribe", channel, len(channels)]))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in command[1:] or list(channels):
+                        self.subscribers.get(channel, set()).discard(writer)
+                        channels.discard(channel)
+                        writer.write(self._array([b"unsubscribe", channel, len(channels)]))
+                else:
+                    writer.write(self._execute(name, command[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in channels:
+                self.subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+    def _execute(self, name, args):
+        if name in (b"PING", b"SELECT", b"AUTH"):
+            return b"+PONG\r\n" if name == b"PING" else b"+OK\r\n"
+        if name == b"GET":
+            value = self._get(args[0])
+            return self._bulk(value)
+        if name == b"SET":
+            expires_at = None
+            options = [a.upper() for a in args[2:]]
+            if b"EX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(b"EX") + 1])
+            if b"PX" in options:
+                expires_at = time.monotonic() + int(args[2 + options.index(b"PX") + 1]) / 1000
+            self.values[args[0]] = (args[1], expires_at)
+            return b"+OK\r\n"
+        if name in (b"EXPIRE", b"PEXPIRE"):
+            value = self._get(args[0])
+            if value is None:
+                return b":0\r\n"
+            seconds = int(args[1]) / (1000 if name == b"PEXPIRE" else 1)
+            self.values[args[0]] = (value, time.monotonic() + seconds)
+            return b":1\r\n"
+        if name == b"DEL":
+            removed = sum(1 for key in args if self.values.pop(key, None) is not None)
+            return b":%d\r\n" % removed
+        if name == b"PUBLISH":
+            channel, message = args
+            receivers = list(self.subscribers.get(channel, ()))
+            for subscriber in receivers:
+                subscriber.write(self._array([b"message", channel, message]))
+            return b":%d\r\n" % len(receivers)
+        return b"-ERR unknown command '%s'\r\n" % name
+
+    def _get(self, key):
+        item = self.values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, as sent by telnet or redis-cli --no-raw
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _array(self, items):
+        parts = [b"*%d\r\n" % len(items)]
+        for item in items:
+            parts.append(b":%d\r\n" % item if isinstance(item, int) else self._bulk(item))
+        return b"".join(parts)
+
+
+async def serve(host="127.0.0.1", port=6379):
+    """Start the stand-in and return the asyncio server."""
+    server = RESPServer()
+    return await asyncio.start_server(server.handle_client, host, port)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Redis-protocol stand-in for local runs")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=6379, help="Port to listen on")
+    args = parser.parse_args()
+
+    server = await serve(args.host, args.port)
+    print(f"RESP stand-in listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+STT preprocessing benchmark
+
+Runs a corpus of recordings through several audio preprocessing pipelines
+(filter chain, sample rate, silence trimming, codec) and sends each result to
+a Whisper ASR webservice, reporting per pipeline:
+
+- FFmpeg conversion time
+- bytes uploaded to Whisper
+- Whisper latency
+- word error rate (WER) against reference transcripts
+
+The corpus is a directory of audio files, each with its reference transcript
+next to it as <name>.txt. Without --whisper-url the simulated Whisper from
+bench/backends.py is started; it always returns the same sentence, so only
+the timings and sizes are meaningful then.
+
+    python bench/stt_benchmark.py --corpus recordings/ --whisper-url http://localhost:9000
+    python bench/stt_benchmark.py --corpus recordings/ --variants current,no_filters,opus --output stt.json
+
+The winning pipeline is shipped through the orchestrator's STT_SAMPLE_RATE,
+STT_FILTERS, STT_TRIM_SILENCE and STT_CODEC settings.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from load_test import BENCH_DIR, ORCHESTRATOR_DIR, percentile, wait_until_up
+
+sys.path.insert(0, ORCHESTRATOR_DIR)
+
+from services.stt_service import AudioPreprocessing, STTService  # noqa: E402
+
+AUDIO_EXTENSIONS = (".wav", ".webm", ".ogg", ".opus", ".mp3", ".m4a", ".flac")
+
+# Pipelines compared by default; None uploads the recording unchanged
+VARIANTS: Dict[str, Optional[AudioPreprocessing]] = {
+    "raw": None,
+    "current": AudioPreprocessing("current", convert_wav=True),
+    "no_filters": AudioPreprocessing("no_filters", filters=None, convert_wav=True),
+    "trim": AudioPreprocessing("trim", trim_silence=True, convert_wav=True),
+    "trim_no_filters": AudioPreprocessing("trim_no_filters", filters=None, trim_silence=True, convert_wav=True),
+    "8khz": AudioPreprocessing("8khz", sample_rate=8000, filters=None, convert_wav=True),
+    "flac": AudioPreprocessing("flac", codec="flac", convert_wav=True),
+    "opus": AudioPreprocessing("opus", filters=None, codec="libopus", convert_wav=True),
+}
+
+
+def normalize_words(text: str) -> List[str]:
+    """Lowercase words without punctuation, so WER counts only word differences."""
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+
+def word_errors(reference: List[str], hypothesis: List[str]) -> int:
+    """Substitutions, deletions and insertions turning the reference into the hypothesis."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+
+def load_corpus(directory: str) -> List[Tuple[str, bytes, str]]:
+    """(name, audio, reference transcript) for every audio file that has a transcript."""
+    corpus = []
+    for root, _, files in os.walk(directory):
+        for filename in sorted(files):
+            stem, extension = os.path.splitext(filename)
+            if extension.lower() not in AUDIO_EXTENSIONS:
+                continue
+            path = os.path.join(root, filename)
+            reference_path = os.path.join(root, stem + ".txt")
+            if not os.path.exists(reference_path):
+                print(f"Skipping {path}: no reference transcript {reference_path}")
+                continue
+            with open(path, "rb") as f:
+                audio = f.read()
+            with open(reference_path, encoding="utf-8") as f:
+                reference = f.read().strip()
+            corpus.append((os.path.relpath(path, directory), audio, reference))
+    return corpus
+
+
+def load_variants(names: str, variants_file: Optional[str]) -> Dict[str, Optional[AudioPreprocessing]]:
+    """
+    Pick the pipelines to compare.
+
+    A variants file is a JSON object mapping names to AudioPreprocessing
+    arguments, e.g. {"loud": {"filters": "volume=2.0", "sample_rate": 16000}};
+    its variants are added to the built-in ones.
+    """
+    available = dict(VARIANTS)
+    if variants_file:
+        with open(variants_file) as f:
+            for name, options in json.load(f).items():
+                options.setdefault("convert_wav", True)
+                available[name] = AudioPreprocessing(name, **options)
+    selected = [name.strip() for name in names.split(",") if name.strip()] if names else list(available)
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown variants: {', '.join(unknown)} (choose from {', '.join(available)})")
+    return {name: available[name] for name in selected}
+
+
+async def transcribe(client: httpx.AsyncClient, whisper_url: str, audio: bytes, filename: str,
+                     content_type: str, language: Optional[str]) -> str:
+    """Send audio to Whisper the way STTService.speech_to_text does."""
+    data = {"task": "transcribe"}
+    if language:
+        data["language"] = language
+    response = await client.post(f"{whisper_url}/asr", files={"audio_file": (filename, audio, content_type)},
+                                 data=data)
+    response.raise_for_status()
+    try:
+        return response.json().get("text", "")
+    except ValueError:
+        return response.text.strip()
+
+
+async def run_variant(service: STTService, client: httpx.AsyncClient, whisper_url: str,
+                      preprocessing: Optional[AudioPreprocessing], corpus: List[Tuple[str, bytes, str]],
+                      repeat: int, language: Optional[str]) -> Dict:
+    convert_times: List[float] = []
+    asr_times: List[float] = []
+    upload_bytes: List[int] = []
+    errors = 0
+    edits = 0
+    reference_words = 0
+    for name, audio, reference in corpus:
+        try:
+            started = time.perf_counter()
+            if preprocessing is None:
+                upload = audio
+                filename = os.path.basename(name)
+                content_type = "application/octet-stream"
+            else:
+                upload = await asyncio.to_thread(service.preprocess, audio, preprocessing)
+                filename, content_type = preprocessing.filename, preprocessing.content_type
+            convert_times.append(time.perf_counter() - started)
+            upload_bytes.append(len(upload))
+
+            transcript = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                text = await transcribe(client, whisper_url, upload, filename, content_type, language)
+                asr_times.append(time.perf_counter() - started)
+                if transcript is None:
+                    transcript = text
+        except Exception as e:
+            errors += 1
+            print(f"  {name}: {type(e).__name__}: {str(e).strip().splitlines()[-1] if str(e).strip() else ''}")
+            continue
+        reference_tokens = normalize_words(reference)
+        edits += word_errors(reference_tokens, normalize_words(transcript))
+        reference_words += len(reference_tokens)
+
+    convert_times.sort()
+    asr_times.sort()
+    return {
+        "files": len(corpus),
+        "errors": errors,
+        "convert_ms_mean": round(sum(convert_times) / len(convert_times) * 1000, 1) if convert_times else None,
+        "convert_ms_p95": round(percentile(convert_times, 95) * 1000, 1) if convert_times else None,
+        "upload_kb_mean": round(sum(upload_bytes) / len(upload_bytes) / 1024, 1) if upload_bytes else None,
+        "asr_ms_p50": round(percentile(asr_times, 50) * 1000, 1) if asr_times else None,
+        "asr_ms_p95": round(percentile(asr_times, 95) * 1000, 1) if asr_times else None,
+        "total_ms_mean": round((sum(convert_times) / len(convert_times) + sum(asr_times) / len(asr_times)) * 1000, 1)
+        if convert_times and asr_times else None,
+        "wer": round(edits / reference_words, 4) if reference_words else None,
+    }
+
+
+def print_report(results: Dict[str, Dict], wer_meaningful: bool) -> None:
+    header = (f"{'variant':<16} {'files':>5} {'err':>4} {'convert ms':>11} {'upload KB':>10} "
+              f"{'asr p50 ms':>11} {'asr p95 ms':>11} {'total ms':>9} {'WER':>7}")
+    print(header)
+    print("-" * len(header))
+
+    def cell(value, width: int) -> str:
+        return f"{'-' if value is None else value:>{width}}"
+
+    for name, result in results.items():
+        wer = f"{result['wer']:.1%}" if result["wer"] is not None and wer_meaningful else None
+        print(f"{name:<16} {result['files']:>5} {result['errors']:>4} {cell(result['convert_ms_mean'], 11)} "
+              f"{cell(result['upload_kb_mean'], 10)} {cell(result['asr_ms_p50'], 11)} "
+              f"{cell(result['asr_ms_p95'], 11)} {cell(result['total_ms_mean'], 9)} {cell(wer, 7)}")
+
+    complete = {name: result for name, result in results.items()
+                if not result["errors"] and result["total_ms_mean"] is not None}
+    if not complete:
+        return
+    fastest = min(complete, key=lambda name: complete[name]["total_ms_mean"])
+    print(f"\nFastest: {fastest} ({complete[fastest]['total_ms_mean']} ms per recording)")
+    if wer_meaningful:
+        accurate = min(complete, key=lambda name: (complete[name]["wer"], complete[name]["total_ms_mean"]))
+        print(f"Most accurate: {accurate} (WER {complete[accurate]['wer']:.1%})")
+
+
+def start_whisper_stand_in(args) -> subprocess.Popen:
+    # backends.py serves all three stand-ins; the unused ones get ports next to Whisper's
+    return subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "backends.py"),
+        "--whisper-port", str(args.whisper_port),
+        "--ollama-port", str(args.whisper_port + 1), "--tts-port", str(args.whisper_port + 2),
+    ])
+
+
+async def run(args) -> int:
+    try:
+        variants = load_variants(args.variants, args.variants_file)
+    except (ValueError, TypeError) as e:
+        print(e)
+        return 2
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"No audio files with reference transcripts found in {args.corpus}")
+        return 2
+
+    process = None if args.whisper_url else start_whisper_stand_in(args)
+    whisper_url = (args.whisper_url or f"http://127.0.0.1:{args.whisper_port}").rstrip("/")
+    service = STTService(whisper_url)
+    results = {}
+    try:
+        await wait_until_up(f"{whisper_url}/docs")
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            for _ in range(args.warmup):
+                # Load the model before timing anything
+                await transcribe(client, whisper_url, corpus[0][1], os.path.basename(corpus[0][0]),
+                                 "application/octet-stream", args.language)
+            for name, preprocessing in variants.items():
+                print(f"Running {name} on {len(corpus)} recordings...", flush=True)
+                results[name] = await run_variant(service, client, whisper_url, preprocessing, corpus,
+                                                  args.repeat, args.language)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print()
+    if process is not None:
+        print("Simulated Whisper: WER is not measured, only conversion time, upload size and latency\n")
+    print_report(results, wer_meaningful=process is None)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "whisper_url": args.whisper_url,
+                "corpus": {"directory": args.corpus, "recordings": len(corpus)},
+                "variants": {name: None if preprocessing is None else {
+                    "sample_rate": preprocessing.sample_rate,
+                    "filters": preprocessing.filter_chain(),
+                    "codec": preprocessing.codec,
+                } for name, preprocessing in variants.items()},
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"Saved results to {args.output}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare STT audio preprocessing pipelines by latency and WER")
+    parser.add_argument("--corpus", required=True,
+                        help="Directory of recordings, each with a <name>.txt reference transcript")
+    parser.add_argument("--whisper-url", help="Whisper ASR webservice to test (default: start the simulated one)")
+    parser.add_argument("--whisper-port", type=int, default=18910, help="Port for the simulated Whisper")
+    parser.add_argument("--variants", help=f"Comma-separated pipelines to compare (default: all of {', '.join(VARIANTS)})")
+    parser.add_argument("--variants-file", help="JSON file defining more pipelines")
+    parser.add_argument("--language", help="Language code sent with every request, e.g. en")
+    parser.add_argument("--repeat", type=int, default=1, help="Whisper requests per recording and pipeline (default 1)")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured requests before the first pipeline (default 1)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for each transcription")
+    parser.add_argument("--output", help="Save the results as JSON")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
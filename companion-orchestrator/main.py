@@ -1,21 +1,56 @@
 from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect, Depends, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, Response
 import io
 import urllib.parse
 from pydantic import BaseModel
 import httpx
 import os
 import json
-from typing import List, Dict, Optional, Any
+import logging
+import math
+from typing import Awaitable, Callable, List, Dict, Optional, Any
 import asyncio
+import contextvars
+import hmac
+import tempfile
 import time
+import uuid
+from contextlib import contextmanager
 
 from modes.mode_manager import ModeManager
 from services.tts_service import TTSService
-from services.stt_service import STTService
+from services.stt_service import AudioPreprocessing, STTService
 from services.llm_service import LLMService
 from services.emotion_service import EmotionService
+from services.session_store import SessionStore
+from services.conversation_store import ConversationStore, Message, USER, ASSISTANT
+from services.memory_index import Memory, MemoryIndex
+from services.audio_store import AudioStore
+from services.filler_clips import FillerLibrary, load_phrases
+from services.audio_jobs import AudioJobQueue, PENDING, FAILED
+from services.ws_outbox import WebSocketOutbox, merge_tokens, replace_same_type
+from services.ws_protocol import BINARY_SUBPROTOCOL, CODEC_IDS, AudioUpload, ProtocolError, audio_frames, negotiate
+from services.state_store import create_state_store
+from services.model_registry import ModelRegistry
+from services.metrics import REGISTRY, REQUEST_LATENCY, REQUESTS_TOTAL, LLM_DURATION, STAGE_LATENCY
+from services.logging_setup import configure_logging, shutdown_logging
+from services import tracing
+from services.profiler import SamplingProfiler, AllocationTracker
+from services.overload import OverloadController, LatencySignal, Overloaded, TurnPolicy
+from services.readiness import ReadinessTracker
+from services.scheduler import configure_scheduler, parse_priority, priority, VOICE, TEXT, BATCH
+from services.deadline import DeadlineExceeded, configure_deadlines, current_deadline, deadline, stage_timeout
+
+# Log through a background writer thread so request handlers never block on stdout
+configure_logging()
+logger = logging.getLogger("orchestrator")
+tracer = tracing.configure_tracing()
+# Backend calls are dispatched by priority: voice turns, then text turns, then batch work
+scheduler = configure_scheduler()
+# Each request gets a deadline, shared out between its STT, LLM and TTS calls
+request_timeouts = configure_deadlines()
+DEADLINE_HEADER = "X-Request-Timeout"
 
 # Initialize FastAPI app
 app = FastAPI(title="AI Companion Orchestrator")
@@ -27,7 +62,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[tracing.TRACE_HEADER],
 )
+# Root span per request; the trace ID is returned in the X-Trace-Id header
+app.add_middleware(tracing.TraceMiddleware)
 
 # Set environment variables for services
 os.environ["TTS_SERVICE_URL"] = os.environ.get("TTS_URL", "http://tts:5002")
@@ -36,55 +74,336 @@ os.environ["STT_SERVICE_URL"] = os.environ.get("STT_URL", "http://whisper:9000")
 # Initialize services
 llm_service = LLMService(os.environ.get("OLLAMA_URL", "http://ollama:11434"))
 tts_service = TTSService()
-stt_service = STTService(os.environ.get("WHISPER_API_URL", "http://whisper-stt:9000"))
+stt_service = STTService(os.environ.get("WHISPER_API_URL", "http://whisper-stt:9000"), AudioPreprocessing.from_env())
 emotion_service = EmotionService()
 
-# Available modes
-available_modes = ["general", "french_tutor", "coding_assistant"]
-default_mode = "general"
+# State shared by all workers; set STATE_STORE_URL=redis://host:6379/0 when running several
+state_store = create_state_store(os.getenv("STATE_STORE_URL"))
+EVENTS_CHANNEL = "companion:events"
+WORKER_ID = uuid.uuid4().hex[:8]
+
+# Per-user mode, model and language; the globals below are only defaults
+session_store = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX_ENTRIES", "10000")),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "3600")),
+    backend=state_store
+)
+
+# Message history per user and mode, kept across restarts; loaded on a user's first message
+CONVERSATION_DB = os.getenv("CONVERSATION_DB", os.path.join(tempfile.gettempdir(), "companion-conversations.sqlite3"))
+conversation_store = ConversationStore(
+    CONVERSATION_DB,
+    history_messages=int(os.getenv("CONVERSATION_HISTORY_MESSAGES", "10")),
+    max_conversations=int(os.getenv("CONVERSATION_MAX_ENTRIES", os.getenv("SESSION_MAX_ENTRIES", "10000"))),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", "3600")),
+    flush_interval=float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.5")),
+    # Other workers reload a conversation only once its new messages are in the database
+    on_written=lambda user_id, mode: publish_event("conversation", user_id=user_id, mode=mode)
+) if CONVERSATION_DB.lower() != "off" else None
+
+# Long-term memory: past messages found by similarity to the new one and added to the prompt
+MEMORY_DIR = os.getenv("MEMORY_DIR", os.path.join(tempfile.gettempdir(), "companion-memory"))
+MEMORY_EMBED_MODEL = os.getenv("MEMORY_EMBED_MODEL", "nomic-embed-text")
+MEMORY_MODES = {mode.strip() for mode in os.getenv("MEMORY_MODES", "all").split(",") if mode.strip()}
+MEMORY_TIMEOUT = float(os.getenv("MEMORY_TIMEOUT", "1.0"))
+memory_index = MemoryIndex(
+    MEMORY_DIR,
+    embed=lambda text: llm_service.embed(text, MEMORY_EMBED_MODEL),
+    model=MEMORY_EMBED_MODEL,
+    top_k=int(os.getenv("MEMORY_TOP_K", "3")),
+    min_score=float(os.getenv("MEMORY_MIN_SCORE", "0.5"))
+) if MEMORY_DIR.lower() != "off" else None
+
+# Generated replies, served from /audio/{filename}
+audio_store = AudioStore(
+    directory=os.getenv("AUDIO_STORE_DIR"),
+    memory_bytes=int(os.getenv("AUDIO_STORE_MEMORY_MB", "32")) * 1024 * 1024,
+    disk_bytes=int(os.getenv("AUDIO_STORE_DISK_MB", "512")) * 1024 * 1024,
+    ttl=float(os.getenv("AUDIO_STORE_TTL", "3600"))
+)
+
+# Acknowledgement clips played while a reply is generated, rendered once at startup
+filler_library = FillerLibrary(
+    tts_service,
+    phrases=load_phrases(os.getenv("FILLER_PHRASES_FILE")),
+    crossfade_ms=int(os.getenv("FILLER_CROSSFADE_MS", "250"))
+) if os.getenv("FILLER_CLIPS", "on").lower() != "off" else None
+
+async def store_speech(text: str, language: Optional[str] = None) -> Optional[str]:
+    """Synthesize speech and put it in the audio store, returning its key."""
+    with tracing.span("tts", chars=len(text), language=language):
+        audio_binary = await tts_service.text_to_speech(text, language=language)
+    if not audio_binary:
+        return None
+    return await audio_store.put(audio_binary)
+
+async def publish_event(kind: str, **data) -> None:
+    """Broadcast a state change to every worker, including this one."""
+    await state_store.publish(EVENTS_CHANNEL, json.dumps(dict(data, kind=kind, worker=WORKER_ID)))
+
+async def handle_event(message: str) -> None:
+    """Apply a state change published by any worker."""
+    event = json.loads(message)
+    kind = event["kind"]
+    
+    if kind == "deliver":
+        outbox = active_connections.get(event["user_id"])
+        if outbox is not None:
+            await outbox.put(event["message"], drop_if_full=True)
+    elif kind == "audio_job":
+        waiter = remote_job_waiters.pop(event["job_id"], None)
+        if waiter is not None:
+            waiter.set()
+    elif event.get("worker") == WORKER_ID:
+        return  # This worker already applied its own change
+    elif kind == "defaults":
+        mode_manager.active_mode = event["mode"]
+        llm_service.current_model = event["model"]
+    elif kind == "session":
+        # Reloaded from the state store on the user's next request
+        session_store.remove(event["user_id"])
+    elif kind == "conversation" and conversation_store is not None:
+        # Reloaded from the database on the user's next message
+        conversation_store.forget(event["user_id"], event.get("mode"))
+
+async def deliver_to_user(user_id: str, message: Dict[str, Any]) -> None:
+    """Send a message to a user's websocket, whichever worker holds the connection."""
+    outbox = active_connections.get(user_id)
+    if outbox is not None:
+        # Never block the caller on a slow client
+        await outbox.put(message, drop_if_full=True)
+    else:
+        await publish_event("deliver", user_id=user_id, message=message)
+
+async def save_defaults() -> None:
+    """Persist the default mode and model and tell the other workers."""
+    defaults = {"mode": mode_manager.active_mode, "model": llm_service.current_model}
+    await state_store.set_json("defaults", defaults)
+    await publish_event("defaults", **defaults)
+
+async def save_session(session) -> None:
+    await session_store.save(session)
+    await publish_event("session", user_id=session.user_id)
+
+async def load_history(user_id: str, mode: str) -> List[Message]:
+    """Recent messages of the user's conversation in this mode, if history is kept."""
+    if conversation_store is None:
+        return []
+    with tracing.stage("history_load"):
+        return await conversation_store.history(user_id, mode)
+
+def uses_memory(mode: str) -> bool:
+    return memory_index is not None and ("all" in MEMORY_MODES or mode in MEMORY_MODES)
+
+async def recall(user_id: str, mode: str, text: str, before: Optional[float] = None) -> List[Memory]:
+    """
+    Memories relevant to a new message, stored before `before`; none if
+    retrieval fails or takes longer than MEMORY_TIMEOUT.
+    """
+    if not uses_memory(mode):
+        return []
+    with tracing.stage("memory_recall") as recall_span:
+        try:
+            timeout = min(MEMORY_TIMEOUT, stage_timeout("memory", MEMORY_TIMEOUT))
+            memories = await asyncio.wait_for(memory_index.search(user_id, text, before=before), timeout)
+        except Exception as e:
+            logger.warning("Memory retrieval failed, answering without it: %r", e)
+            return []
+        recall_span.set(memories=len(memories))
+        return memories
+
+async def load_context(user_id: str, mode: str, text: str, system_prompt: str):
+    """
+    Load the recent history and the memories relevant to a turn.
+    
+    Returns:
+        Tuple of (system prompt with the memories added, history)
+    """
+    history = await load_history(user_id, mode)
+    # Messages still in the recent history are already in the prompt; the
+    # search skips them, so they don't crowd out older relevant memories
+    memories = await recall(user_id, mode, text, before=history[0].created_at if history else None)
+    if memories:
+        system_prompt += ("\n\nThings the user told you in earlier conversations:\n"
+                          + "\n".join(f"- {memory.text}" for memory in memories))
+    return system_prompt, history
+
+async def remember_turn(user_id: str, mode: str, text: str, reply: str) -> None:
+    """
+    Queue a finished turn for the conversation store and long-term memory;
+    written in the background. Other workers are told to reload the
+    conversation once its new messages are in the database.
+    """
+    # One timestamp for both, so a memory is recognized while its message is in the history
+    sent_at = time.time()
+    if uses_memory(mode):
+        memory_index.remember(user_id, mode, text, created_at=sent_at)
+    if conversation_store is None:
+        return
+    conversation_store.append(user_id, mode, USER, text, created_at=sent_at)
+    conversation_store.append(user_id, mode, ASSISTANT, reply)
 
-# Initialize mode manager after LLM service
+# Events for audio jobs running on other workers, by job_id
+remote_job_waiters: Dict[str, asyncio.Event] = {}
+
+async def save_audio_job(job) -> None:
+    await state_store.set_json(f"audio_job:{job.job_id}", audio_job_status(job), ttl=audio_jobs.job_ttl)
+
+async def on_audio_job_done(job) -> None:
+    """Record a finished audio job and tell the user's websocket client."""
+    await save_audio_job(job)
+    await publish_event("audio_job", job_id=job.job_id)
+    if job.user_id:
+        # Dropped for slow clients; they can still poll the job
+        await deliver_to_user(job.user_id, {
+            "type": "audio_ready",
+            "job_id": job.job_id,
+            "status": job.status,
+            "audio_url": f"/audio/{job.audio_key}" if job.audio_key else None
+        })
+
+# Background TTS for requests with async_audio set
+audio_jobs = AudioJobQueue(
+    store_speech,
+    workers=int(os.getenv("AUDIO_JOB_WORKERS", "2")),
+    max_pending=int(os.getenv("AUDIO_JOB_QUEUE_SIZE", "64")),
+    on_complete=on_audio_job_done
+)
+
+# Initialize mode manager
+available_modes = os.getenv("AVAILABLE_MODES", "general,french_tutor,motivator,chill_buddy").split(",")
+default_mode = os.getenv("DEFAULT_COMPANION_MODE", "general")
 mode_manager = ModeManager(available_modes, default_mode, llm_service)
 
-# Initialize available models list (will be populated on startup)
-available_models = []
+# Installed and loaded models, refreshed from Ollama in the background
+model_registry = ModelRegistry(
+    llm_service,
+    ttl=float(os.getenv("MODEL_REGISTRY_TTL", "30")),
+    fallback_models=os.getenv("AVAILABLE_MODELS", "llama2,tinyllama:latest,mistral").split(",")
+)
+
+# Degrade replies, then shed text turns, as LLM/TTS latency and load rise
+overload = OverloadController(
+    max_inflight=int(os.getenv("OVERLOAD_MAX_INFLIGHT", "32")),
+    latency_signals=[
+        LatencySignal(LLM_DURATION, float(os.getenv("OVERLOAD_LLM_TARGET", "10"))),
+        LatencySignal(STAGE_LATENCY, float(os.getenv("OVERLOAD_TTS_TARGET", "2")), {"stage": "tts_chunk"}),
+    ],
+    backlog=lambda: audio_jobs.pending() / audio_jobs.max_pending,
+    thresholds=[float(t) for t in os.getenv("OVERLOAD_THRESHOLDS", "0.7,1.0,1.5").split(",")],
+    max_tokens=int(os.getenv("LLM_MAX_TOKENS", "500")),
+    min_tokens=int(os.getenv("OVERLOAD_MIN_TOKENS", "96")),
+    fallback_model=lambda: os.getenv("OVERLOAD_FALLBACK_MODEL") or model_registry.smallest(),
+    retry_after=int(os.getenv("OVERLOAD_RETRY_AFTER", "5"))
+)
 default_model = os.getenv("DEFAULT_MODEL", "llama2")
 
 # Models will be dynamically loaded from Ollama on startup
-@app.on_event("startup")
-async def startup_event():
-    global available_models
+
+# Downstream checks and warm-ups run concurrently at startup; /ready reports them
+readiness = ReadinessTracker(retry_interval=float(os.getenv("READY_RETRY_INTERVAL", "5")))
+STARTUP_WARMUP = {name.strip() for name in os.getenv("STARTUP_WARMUP", "llm,tts").split(",") if name.strip()}
+
+async def check_ollama():
+    await model_registry.start()
+    if model_registry.refreshed_at is None:
+        raise ConnectionError("Could not list Ollama models")
+    logger.info("Loaded %d available models: %s", len(model_registry.names()), model_registry.names())
+    return {"models": len(model_registry.names())}
+
+async def warm_up_llm():
+    if model_registry.refreshed_at is None:
+        # Runs alongside check_ollama; residency decides what is worth loading
+        await model_registry.refresh()
+    model = model_registry.resolve(llm_service.current_model)
+    if model != llm_service.current_model:
+        llm_service.current_model = model
+    if model_registry.is_loaded(model):
+        return {"model": model, "load_seconds": 0.0, "already_loaded": True}
+    load_seconds = await llm_service.warm_up(model)
+    return {"model": model, "load_seconds": round(load_seconds, 2)}
+
+# Background loads of models switched to, by model
+model_loads: Dict[str, asyncio.Task] = {}
+
+async def load_model(model: str) -> None:
+    """Load a model switched to in the background, so the next turn doesn't wait for it."""
     try:
-        # Fetch available models from Ollama
-        models = await llm_service.get_available_models()
-        print(f"Available models: {models}")
-        if models:
-            available_models = models
-            print(f"Loaded {len(models)} available models from Ollama: {models}")
-        else:
-            # Fallback if no models could be fetched
-            fallback_models = os.getenv("AVAILABLE_MODELS", "llama2,tinyllama:latest,mistral").split(",")
-            available_models = fallback_models
-            print(f"Using fallback model list: {fallback_models}")
+        load_seconds = await llm_service.warm_up(model)
+        logger.info("Loaded model %s in %.2fs", model, load_seconds)
+        await model_registry.refresh()
     except Exception as e:
-        print(f"Error loading models from Ollama: {e}")
-        # Fallback to environment variable
-        fallback_models = os.getenv("AVAILABLE_MODELS", "llama2,tinyllama:latest,mistral").split(",")
-        available_models = fallback_models
-        print(f"Using fallback model list: {fallback_models}")
+        logger.warning("Could not load model %s: %r", model, e)
+    finally:
+        model_loads.pop(model, None)
 
-# Initialize mode manager
-available_modes = os.getenv("AVAILABLE_MODES", "general,french_tutor,motivator,chill_buddy").split(",")
-default_mode = os.getenv("DEFAULT_COMPANION_MODE", "general")
-mode_manager = ModeManager(available_modes, default_mode, llm_service)
+async def check_tts():
+    if not await tts_service.check_connection(force=True):
+        raise ConnectionError("Could not connect to any TTS service URL")
+    return {"url": tts_service.tts_url}
+
+readiness.add("ollama", check_ollama)
+readiness.add("tts", tts_service.warm_up if "tts" in STARTUP_WARMUP else check_tts)
+readiness.add("whisper", stt_service.warm_up if "stt" in STARTUP_WARMUP else stt_service.check_connection)
+if "llm" in STARTUP_WARMUP:
+    readiness.add("llm_warmup", warm_up_llm)
+if filler_library is not None:
+    # Turns just go without a filler until the clips are rendered
+    readiness.add("fillers", filler_library.render, required=False)
+
+@app.on_event("startup")
+async def startup_event():
+    await asyncio.gather(tracer.start(), audio_store.start(), audio_jobs.start(),
+                         *([conversation_store.start()] if conversation_store is not None else []),
+                         *([memory_index.start()] if memory_index is not None else []))
+    await state_store.subscribe(EVENTS_CHANNEL, handle_event)
+    
+    # Pick up defaults chosen through another worker
+    defaults = await state_store.get_json("defaults")
+    if defaults:
+        mode_manager.active_mode = defaults["mode"]
+        llm_service.current_model = defaults["model"]
+    
+    await overload.start()
+    # Serve after the deadline even if something is still warming up; /ready tells
+    # the load balancer when this instance can take traffic
+    await readiness.start(deadline=float(os.getenv("STARTUP_DEADLINE", "20")))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await readiness.stop()
+    await audio_jobs.stop()
+    await audio_store.stop()
+    if conversation_store is not None:
+        await conversation_store.stop()
+    if memory_index is not None:
+        await memory_index.stop()
+    await model_registry.stop()
+    await overload.stop()
+    await state_store.close()
+    await tracer.stop()
+    shutdown_logging()
 
 # Data models
 class TextInput(BaseModel):
     text: str
     mode: Optional[str] = None
     model: Optional[str] = None
+    language: Optional[str] = None
     generate_audio: bool = True
+    # Return immediately and synthesize audio in the background
+    async_audio: bool = False
     user_id: Optional[str] = "default_user"
+    # "text" (default) or "batch" for bulk work that may wait behind interactive turns
+    priority: Optional[str] = None
+
+class GenerateInput(BaseModel):
+    prompt: str
+    system: str = ""
+    model: Optional[str] = None
+    temperature: float = 0.7
+    max_tokens: int = 2048
+    priority: str = "batch"
 
 class AudioInput(BaseModel):
     audio_data: bytes
@@ -97,6 +416,8 @@ class CompanionResponse(BaseModel):
     text: str
     audio_url: Optional[str] = None
     emotion: str = "neutral"
+    # True when the reply was shortened, used a smaller model or skipped audio because of load
+    degraded: bool = False
 
 class ModeInfo(BaseModel):
     name: str
@@ -108,9 +429,17 @@ class ModelInfo(BaseModel):
     id: str
     name: str
     active: bool = False
+    size: Optional[int] = None
+    parameter_size: Optional[str] = None
+    quantization: Optional[str] = None
+    family: Optional[str] = None
+    # Whether the model is resident in Ollama's memory, and until when
+    loaded: bool = False
+    size_vram: Optional[int] = None
+    expires_at: Optional[str] = None
 
-# Websocket clients
-active_connections: Dict[str, WebSocket] = {}
+# Outboxes of connected websocket clients, by user_id
+active_connections: Dict[str, WebSocketOutbox] = {}
 
 @app.get("/")
 async def root():
@@ -118,158 +447,662 @@ async def root():
 
 @app.get("/health")
 def health_check():
+    """Liveness: the process is up and serving requests."""
     return {"status": "ok"}
 
+@app.get("/ready")
+def readiness_check():
+    """Readiness: Ollama, TTS and Whisper answered and the configured warm-ups finished."""
+    report = readiness.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Pipeline metrics in the Prometheus text exposition format."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# Admin diagnostics, disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_MAX_SECONDS = float(os.getenv("ADMIN_PROFILE_MAX_SECONDS", "60"))
+profiler = SamplingProfiler()
+allocation_tracker = AllocationTracker()
+
+def require_admin(request: Request):
+    """Allow the request only with the admin token as a Bearer token or X-Admin-Token header."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("X-Admin-Token", "")
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        supplied = authorization[len("Bearer "):]
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_endpoint(seconds: float = 10.0, interval_ms: float = 10.0, idle: bool = False):
+    """
+    Sample the live process and return collapsed stacks for a flame graph.
+    
+    Feed the output to flamegraph.pl or load it into speedscope.
+    """
+    if not 0 < seconds <= ADMIN_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {ADMIN_MAX_SECONDS:g}")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    try:
+        result = await profiler.profile(seconds, interval_ms / 1000, include_idle=idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+    return Response(
+        content=result["collapsed"],
+        media_type="text/plain",
+        headers={
+            "X-Profile-Samples": str(result["samples"]),
+            "X-Profile-Duration": f"{result['duration']:.3f}",
+            "Content-Disposition": f'attachment; filename="profile-{WORKER_ID}.collapsed"',
+        }
+    )
+
+@app.get("/admin/allocations", dependencies=[Depends(require_admin)])
+async def allocations_endpoint(seconds: float = 10.0, limit: int = 25, frames: int = 1):
+    """Top allocation sites by size and by count, from tracemalloc."""
+    if not 0 < seconds <= ADMIN_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {ADMIN_MAX_SECONDS:g}")
+    if not 1 <= frames <= 50 or not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="frames must be 1-50 and limit 1-500")
+    try:
+        return await allocation_tracker.snapshot(seconds, limit=limit, frames=frames)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e)) from e
+
+# Mode and model of the turn being handled, used as metric labels
+turn_labels = contextvars.ContextVar("turn_labels", default=("unknown", "unknown"))
+
+@contextmanager
+def track_turn(endpoint: str, timeout: Optional[float]):
+    """
+    Record the duration and outcome of a /chat, /voice or websocket turn, as
+    metrics and a span, and give the turn `timeout` seconds to answer (None:
+    no deadline).
+    """
+    token = turn_labels.set(("unknown", "unknown"))
+    started = time.perf_counter()
+    status = "error"
+    try:
+        attributes = {"deadline_ms": round(timeout * 1000)} if timeout is not None else {}
+        with tracing.span(endpoint, **attributes) as turn_span, \
+                deadline(endpoint, timeout):
+            yield turn_span
+        status = "ok"
+    finally:
+        mode, model = turn_labels.get()
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint, mode=mode, model=model)
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+        turn_labels.reset(token)
+
+def request_timeout(endpoint: str, requested: Any = None) -> Optional[float]:
+    """
+    Deadline in seconds for a request: what the client asked for in the
+    X-Request-Timeout header (or a websocket message's "timeout"), or the
+    endpoint's default, None if it has none.
+    """
+    if requested is None or requested == "":
+        return request_timeouts[endpoint]
+    try:
+        seconds = float(requested)
+    except (TypeError, ValueError):
+        seconds = 0.0
+    if not (seconds > 0 and math.isfinite(seconds)):
+        raise HTTPException(status_code=400, detail="The request timeout must be a positive number of seconds")
+    return seconds
+
+def ran_out_of_time() -> bool:
+    """Whether a stage of the current turn was cut short by its deadline."""
+    active = current_deadline()
+    return active is not None and bool(active.exceeded)
+
+def request_priority(name: Optional[str], default: int = TEXT) -> int:
+    """Priority class named by a request, or `default` if it doesn't name one."""
+    if not name:
+        return default
+    try:
+        return parse_priority(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+def parse_range_header(range_header: str, size: int):
+    """
+    Parse a single-range "bytes=start-end" header.
+    
+    Returns:
+        (start, end) inclusive byte offsets, or None if the range can't be satisfied
+    """
+    units, _, spec = range_header.partition("=")
+    if units.strip() != "bytes" or "," in spec:
+        return None
+    start_text, _, end_text = spec.strip().partition("-")
+    try:
+        if start_text:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+        else:
+            # Suffix range: the last N bytes
+            length = int(end_text)
+            if length <= 0:
+                return None
+            start = max(size - length, 0)
+            end = size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        return None
+    return start, end
+
+def audio_response(request: Request, key: str, data: bytes) -> Response:
+    """Build a cacheable response for stored audio, honouring If-None-Match and Range."""
+    etag = f'"{key.split(".")[0]}"'
+    headers = {
+        "ETag": etag,
+        # Keys are content hashes, so a URL always refers to the same bytes
+        "Cache-Control": f"public, max-age={int(audio_store.ttl)}, immutable",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={key}",
+    }
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if range_header:
+        byte_range = parse_range_header(range_header, len(data))
+        if byte_range is None:
+            headers["Content-Range"] = f"bytes */{len(data)}"
+            return Response(status_code=416, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(content=data[start:end + 1], status_code=206, media_type="audio/wav", headers=headers)
+    
+    return Response(content=data, media_type="audio/wav", headers=headers)
+
 @app.get("/audio/{filename}")
-async def get_audio(filename: str):
+async def get_audio(filename: str, request: Request):
     """Serve audio files that were generated by the TTS service."""
+    if not audio_store.is_valid_key(filename):
+        raise HTTPException(status_code=404, detail=f"Audio file {filename} not found")
     try:
-        file_path = os.path.join("/app", filename)
-        if not os.path.exists(file_path):
-            raise HTTPException(status_code=404, detail=f"Audio file {filename} not found")
-            
-        return FileResponse(
-            file_path,
-            media_type="audio/wav",
-            headers={"Content-Disposition": f"attachment; filename={filename}"})
+        data = await audio_store.get(filename)
     except Exception as e:
-        print(f"Error serving audio file: {str(e)}")
+        logger.error("Error serving audio file: %s", e)
         raise HTTPException(status_code=500, detail=f"Error serving audio: {str(e)}") from e
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Audio file {filename} not found")
+    return audio_response(request, filename, data)
+
+def audio_job_status(job) -> Dict[str, Any]:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "audio_url": f"/audio/{job.audio_key}" if job.audio_key else None,
+        "error": job.error
+    }
+
+async def wait_for_audio_job(job_id: str, timeout: float) -> Dict[str, Any]:
+    """
+    Wait for an audio job, which may be running on another worker.
+    
+    Returns:
+        The job status dictionary
+    
+    Raises:
+        HTTPException: If the job is unknown
+    """
+    job = audio_jobs.get(job_id)
+    if job is not None:
+        if timeout > 0:
+            await job.wait(timeout)
+        return audio_job_status(job)
+    
+    waiter = remote_job_waiters.setdefault(job_id, asyncio.Event())
+    status = await state_store.get_json(f"audio_job:{job_id}")
+    if status is None:
+        remote_job_waiters.pop(job_id, None)
+        raise HTTPException(status_code=404, detail=f"Audio job {job_id} not found")
+    if status["status"] == PENDING and timeout > 0:
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+            status = await state_store.get_json(f"audio_job:{job_id}") or status
+        except asyncio.TimeoutError:
+            pass
+    remote_job_waiters.pop(job_id, None)
+    return status
+
+@app.get("/audio/jobs/{job_id}/status")
+async def get_audio_job_status(job_id: str, wait: float = 0):
+    """Report an audio job's status, long-polling for up to `wait` seconds."""
+    return await wait_for_audio_job(job_id, min(wait, 60.0))
+
+@app.get("/audio/jobs/{job_id}")
+async def get_audio_job(job_id: str, request: Request):
+    """Serve an audio job's result, waiting for it to finish if needed."""
+    status = await wait_for_audio_job(job_id, float(os.getenv("AUDIO_JOB_WAIT_TIMEOUT", "60")))
+    if status["status"] == PENDING:
+        raise HTTPException(status_code=504, detail="Audio is still being generated",
+                            headers={"Retry-After": "1"})
+    if status["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=f"Error generating audio: {status['error']}")
+    
+    audio_key = status["audio_url"].rsplit("/", 1)[-1]
+    data = await audio_store.get(audio_key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Audio for this job has expired")
+    return audio_response(request, audio_key, data)
+
+@app.get("/fillers")
+async def get_fillers(mode: Optional[str] = None, language: Optional[str] = None, user_id: Optional[str] = None):
+    """
+    Acknowledgement clips for a mode and language, for clients to play while
+    a reply is generated. Defaults to the user's mode and language.
+    """
+    if mode is None or language is None:
+        session_mode, _, session_language = await resolve_session_config(user_id)
+        mode = mode or session_mode
+        language = language or session_language or "en"
+    if filler_library is None:
+        return {"crossfade_ms": 0, "clips": []}
+    return {
+        "crossfade_ms": filler_library.crossfade_ms,
+        "clips": [clip.to_dict() for clip in filler_library.clips(mode, language)]
+    }
+
+@app.get("/audio/fillers/{filename}")
+async def get_filler_audio(filename: str, request: Request):
+    """Serve an acknowledgement clip from memory."""
+    clip = filler_library.get(filename) if filler_library is not None else None
+    if clip is None:
+        raise HTTPException(status_code=404, detail=f"Filler clip {filename} not found")
+    return audio_response(request, clip.filename, clip.audio)
+
+async def send_with_audio(outbox: WebSocketOutbox, message: Dict[str, Any], audio: Optional[bytes]) -> None:
+    """
+    Queue a message that refers to audio. Binary-protocol clients get the
+    audio itself right after it, as a numbered stream of frames, instead of
+    fetching the URL.
+    """
+    if audio is None or not outbox.protocol.binary:
+        await outbox.put(message)
+        return
+    stream = outbox.protocol.open_stream()
+    await outbox.put(dict(message, audio_stream=stream, audio_codec="wav"))
+    for frame in audio_frames(stream, audio):
+        await outbox.put(frame)
+
+async def send_filler(outbox: WebSocketOutbox, request_id: str, mode: str, language: Optional[str]) -> None:
+    """Queue an acknowledgement clip for a websocket turn, to play until the reply's audio arrives."""
+    clip = filler_library.pick(mode, language) if filler_library is not None else None
+    if clip is not None:
+        await send_with_audio(outbox, dict(clip.to_dict(), type="filler", request_id=request_id,
+                                           crossfade_ms=filler_library.crossfade_ms), clip.audio)
+
+async def send_response(outbox: WebSocketOutbox, response: CompanionResponse, request_id: str) -> None:
+    """Queue the final response of a websocket turn, with its audio for binary-protocol clients."""
+    message = dict(response.dict(), request_id=request_id, trace_id=tracing.current_trace_id())
+    audio = None
+    # Audio still being generated in the background is announced by audio_ready, by URL
+    if outbox.protocol.binary and response.audio_url and not response.audio_url.startswith("/audio/jobs/"):
+        audio = await audio_store.get(response.audio_url.rsplit("/", 1)[-1])
+    await send_with_audio(outbox, message, audio)
 
 @app.get("/modes", response_model=List[ModeInfo])
-async def get_available_modes():
-    print("Available modes AMRO:", mode_manager.get_available_modes())
-    return mode_manager.get_available_modes()
+async def get_available_modes(user_id: Optional[str] = None):
+    active_mode, _, _ = await resolve_session_config(user_id)
+    modes = mode_manager.get_available_modes(active_mode)
+    return modes
 
 @app.post("/mode/{mode_name}")
-async def set_active_mode(mode_name: str):
+async def set_active_mode(mode_name: str, user_id: Optional[str] = None):
     try:
-        mode_manager.set_active_mode(mode_name)
+        if user_id:
+            # Only this user's session changes
+            session = await session_store.load(user_id)
+            session.mode = mode_manager.resolve_mode(mode_name)
+            await save_session(session)
+        else:
+            mode_manager.set_active_mode(mode_name)
+            await save_defaults()
         return {"message": f"Mode set to {mode_name}"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/models", response_model=List[ModelInfo])
-async def get_available_models():
-    # Create model info objects
-    models = []
-    print(available_models)
-    for model_id in available_models:
-        # Format display name (capitalize and remove special chars)
-        display_name = model_id.split(":")[0].replace("_", " ").title()
-        if ":" in model_id:
-            # Add version info if present
-            version = model_id.split(":")[1]
-            display_name += f" ({version})"
-            
-        models.append(ModelInfo(
-            id=model_id,
-            name=display_name,
-            active=(model_id == llm_service.current_model)
-        ))
-    return models
+async def get_available_models(user_id: Optional[str] = None):
+    _, active_model, _ = await resolve_session_config(user_id)
+    # Served from the registry cache; Ollama is not queried here
+    return [
+        ModelInfo(
+            id=record.name,
+            name=record.display_name,
+            active=(record.name == active_model),
+            size=record.size,
+            parameter_size=record.parameter_size,
+            quantization=record.quantization,
+            family=record.family,
+            loaded=record.loaded,
+            size_vram=record.size_vram,
+            expires_at=record.expires_at
+        )
+        for record in model_registry.records()
+    ]
 
 @app.post("/model/{model_id}")
-async def set_active_model(model_id: str):
+async def set_active_model(model_id: str, user_id: Optional[str] = None):
     try:
-        if model_id not in available_models:
+        if model_registry.get(model_id) is None:
             raise ValueError(f"Model {model_id} not available")
+        
+        loaded = model_registry.is_loaded(model_id)
+        if not loaded and model_id not in model_loads:
+            model_loads[model_id] = asyncio.create_task(load_model(model_id))
             
-        # Set the model in the LLM service
-        llm_service.current_model = model_id
+        if user_id:
+            # Only this user's session changes
+            session = await session_store.load(user_id)
+            session.model = model_id
+            await save_session(session)
+        else:
+            # Set the default model in the LLM service
+            llm_service.current_model = model_id
+            await save_defaults()
         
-        return {"message": f"Model set to {model_id}"}
+        return {"message": f"Model set to {model_id}", "loaded": loaded}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/conversations/{user_id}")
+async def get_conversation(user_id: str, mode: Optional[str] = None):
+    """Recent messages of a user's conversation in a mode (default: the user's current mode)."""
+    if conversation_store is None:
+        raise HTTPException(status_code=404, detail="Conversation history is disabled")
+    if mode:
+        try:
+            mode = mode_manager.resolve_mode(mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        mode, _, _ = await resolve_session_config(user_id)
+    messages = await conversation_store.history(user_id, mode)
+    return {"user_id": user_id, "mode": mode, "messages": [message.to_dict() for message in messages]}
+
+@app.delete("/conversations/{user_id}")
+async def delete_conversation(user_id: str, mode: Optional[str] = None):
+    """Delete a user's stored messages, in one mode or in all of them."""
+    if conversation_store is None:
+        raise HTTPException(status_code=404, detail="Conversation history is disabled")
+    if mode:
+        try:
+            mode = mode_manager.resolve_mode(mode)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    deleted = await conversation_store.delete(user_id, mode)
+    if memory_index is not None and mode is None:
+        await memory_index.forget(user_id)
+    await publish_event("conversation", user_id=user_id, mode=mode)
+    return {"deleted": deleted}
+
+async def resolve_session_config(user_id: Optional[str]):
+    """
+    Resolve the mode, model and language for a user.
+    
+    Session values win over the orchestrator defaults. The result is a
+    snapshot, so later changes by other requests don't affect a running turn.
+    
+    Returns:
+        Tuple of (mode, model, language)
+    """
+    if not user_id:
+        return mode_manager.active_mode, llm_service.current_model, None
+    session = await session_store.load(user_id)
+    return (
+        session.mode or mode_manager.active_mode,
+        model_registry.resolve(session.model, llm_service.current_model),
+        session.language
+    )
+
+async def resolve_request_config(input_data: TextInput):
+    """
+    Apply a request's mode and language to the user's session and resolve
+    the configuration for this turn.
+    
+    Returns:
+        Tuple of (mode, model, language)
+    """
+    session = await session_store.load(input_data.user_id or "default_user")
+    changed = False
+    
+    # Set mode if specified
+    if input_data.mode:
+        try:
+            mode = mode_manager.resolve_mode(input_data.mode)
+            changed = changed or mode != session.mode
+            session.mode = mode
+        except ValueError:
+            pass  # Ignore invalid mode
+    if input_data.language and input_data.language != session.language:
+        session.language = input_data.language
+        changed = True
+    if changed:
+        await save_session(session)
+    
+    mode, model, language = await resolve_session_config(session.user_id)
+    
+    # Use specified model if provided, otherwise the session or default model
+    if input_data.model:
+        model = input_data.model
+    turn_labels.set((mode, llm_service.model_label(model)))
+    turn_span = tracing.current_span()
+    if turn_span is not None:
+        turn_span.set(mode=mode, model=model, language=language)
+    return mode, model, language
+
+async def synthesize_audio_url(text: str,
+                               language: Optional[str] = None,
+                               background: bool = False,
+                               user_id: Optional[str] = None) -> Optional[str]:
+    """
+    Synthesize speech for a reply and return the URL it can be fetched from.
+    
+    With background set, the audio is queued and the URL points at the pending
+    job; fetching it waits for the audio. A full queue falls back to
+    synthesizing inline.
+    """
+    if background:
+        try:
+            job = audio_jobs.submit(text, language, user_id)
+            # Lets any worker answer status requests for the job
+            await save_audio_job(job)
+            return f"/audio/jobs/{job.job_id}"
+        except asyncio.QueueFull:
+            logger.warning("Audio job queue is full, generating audio inline")
+    
+    try:
+        # For API responses, we need a URL, not binary data
+        filename = await store_speech(text, language)
+        if filename:
+            # Return URL that can be accessed from outside the container
+            return f"/audio/{filename}"
+    except Exception as tts_error:
+        logger.error("Error generating audio: %s", tts_error)
+    return None
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
 @app.post("/chat", response_model=CompanionResponse)
-async def chat_endpoint(input_data: TextInput):
+async def chat_endpoint(input_data: TextInput, request: Request):
+    timeout = request_timeout("chat", request.headers.get(DEADLINE_HEADER))
+    with priority(request_priority(input_data.priority)), \
+            overload.turn("chat") as policy, track_turn("chat", timeout):
+        return await process_chat(input_data, policy)
+
+async def process_chat(input_data: TextInput, policy: TurnPolicy,
+                       on_start: Optional[Callable[[str, Optional[str]], Awaitable[None]]] = None
+                       ) -> CompanionResponse:
+    """
+    Generate the reply, audio and emotion for one chat turn.
+    
+    on_start, if given, is called with the turn's mode and language before
+    the reply is generated, when the reply will have audio.
+    """
     try:
-        # Set mode if specified
-        if input_data.mode:
-            try:
-                mode_manager.set_active_mode(input_data.mode)
-            except ValueError:
-                pass  # Ignore invalid mode
-        
-        # Get system prompt based on active mode
-        system_prompt = mode_manager.get_active_system_prompt()
+        mode, model, language = await resolve_request_config(input_data)
+        model = policy.model or model
+        if on_start is not None and input_data.generate_audio and policy.allow_audio:
+            await on_start(mode, language)
         
-        # Use specified model if provided, otherwise use current_model from service
-        model = input_data.model if input_data.model else llm_service.current_model
+        # Get system prompt based on the session's mode
+        system_prompt = mode_manager.get_system_prompt(mode)
+        user_id = input_data.user_id or "default_user"
+        system_prompt, history = await load_context(user_id, mode, input_data.text, system_prompt)
         
         # Generate LLM response
         text_response = await llm_service.generate_response(
             prompt=input_data.text,
             system_prompt=system_prompt,
-            model=model
+            model=model,
+            max_tokens=policy.max_tokens,
+            history=history
         )
+        await remember_turn(user_id, mode, input_data.text, text_response)
         
         # Convert text to audio if requested
         audio_url = None
-        audio_binary = None
-        if input_data.generate_audio:
-            try:
-                # Get binary audio data
-                audio_binary = await tts_service.text_to_speech(text_response)
-                
-                # For API responses, we need a URL, not binary data
-                # Save binary data to a temporary file and return the URL
-                if audio_binary:
-                    import tempfile
-                    import uuid
-                    import os
-                    
-                    # Create a unique filename
-                    filename = f"response_{int(time.time())}.wav"
-                    filepath = os.path.join("/app", filename)  # Save in container
-                    
-                    # Write binary data to file
-                    with open(filepath, "wb") as f:
-                        f.write(audio_binary)
-                    
-                    # Return URL that can be accessed from outside the container
-                    audio_url = f"/audio/{filename}"
-            except Exception as tts_error:
-                print(f"Error generating audio: {str(tts_error)}")
-                audio_url = None
+        if input_data.generate_audio and policy.allow_audio:
+            audio_url = await synthesize_audio_url(
+                text_response, language, input_data.async_audio, input_data.user_id
+            )
+        
+        with tracing.stage("emotion"):
+            emotion = emotion_service.detect_emotion(text_response)
         
         return CompanionResponse(
             text=text_response,
             audio_url=audio_url,
-            emotion=emotion_service.detect_emotion(text_response)
+            emotion=emotion,
+            degraded=policy.degraded or ran_out_of_time()
         )
     except Exception as e:
-        print(f"Error in chat endpoint: {str(e)}")
+        logger.exception("Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing chat: {str(e)}")
 
 
+async def stream_chat(outbox: WebSocketOutbox, input_data: TextInput, request_id: str,
+                      policy: TurnPolicy) -> None:
+    """
+    Stream a chat reply over a websocket.
+    
+    Sends a "filler" clip to play if the reply will have audio, "token" events
+    as text is generated and an "emotion" event whenever the leading emotion
+    of the reply so far changes, then the full response.
+    Events still queued for a slow client are coalesced.
+    """
+    mode, model, language = await resolve_request_config(input_data)
+    model = policy.model or model
+    if input_data.generate_audio and policy.allow_audio:
+        await send_filler(outbox, request_id, mode, language)
+    system_prompt = mode_manager.get_system_prompt(mode)
+    user_id = input_data.user_id or "default_user"
+    system_prompt, history = await load_context(user_id, mode, input_data.text, system_prompt)
+    
+    emotion_stream = emotion_service.create_stream()
+    fragments = []
+    async for fragment in llm_service.stream_response(
+        prompt=input_data.text,
+        system_prompt=system_prompt,
+        model=model,
+        max_tokens=policy.max_tokens,
+        history=history
+    ):
+        fragments.append(fragment)
+        await outbox.put({"type": "token", "request_id": request_id, "text": fragment},
+                         coalesce=merge_tokens)
+        
+        new_emotion = emotion_stream.feed(fragment)
+        if new_emotion:
+            await outbox.put({"type": "emotion", "request_id": request_id, "emotion": new_emotion},
+                             coalesce=replace_same_type)
+    
+    text_response = "".join(fragments)
+    await remember_turn(user_id, mode, input_data.text, text_response)
+    audio_url = None
+    if input_data.generate_audio and policy.allow_audio:
+        audio_url = await synthesize_audio_url(
+            text_response, language, input_data.async_audio, input_data.user_id
+        )
+    
+    response = CompanionResponse(
+        text=text_response,
+        audio_url=audio_url,
+        emotion=emotion_stream.emotion,
+        degraded=policy.degraded or ran_out_of_time()
+    )
+    await send_response(outbox, response, request_id)
+
+
 @app.post("/voice", response_model=CompanionResponse)
-async def voice_endpoint(audio_data: UploadFile = File(...), 
+async def voice_endpoint(request: Request,
+                       audio_data: UploadFile = File(...), 
                        model: Optional[str] = Form(None),
                        mode: Optional[str] = Form(None),
                        generate_audio: bool = Form(True),
+                       async_audio: bool = Form(False),
                        user_id: str = Form("default_user")):
+    timeout = request_timeout("voice", request.headers.get(DEADLINE_HEADER))
+    with priority(VOICE), overload.turn("voice", voice=True) as policy, track_turn("voice", timeout):
+        return await process_voice(audio_data, model, mode, generate_audio, async_audio, user_id, policy)
+
+async def transcribe(audio: bytes) -> str:
+    """
+    Transcribe a recording for a voice turn.
+    
+    Raises:
+        HTTPException: If the recording couldn't be transcribed (400), the STT
+            service failed (500) or the turn's deadline ran out (504)
+    """
+    try:
+        with tracing.span("stt", bytes=len(audio)):
+            text = await stt_service.speech_to_text(audio)
+        logger.debug("STT result: '%s'", text)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail="Ran out of time transcribing the audio") from e
+    except Exception as stt_error:
+        logger.exception("STT service error: %s", stt_error)
+        raise HTTPException(status_code=500, detail=f"STT service error: {str(stt_error)}") from stt_error
+    
+    if not text:
+        raise HTTPException(status_code=400, detail="Could not transcribe audio")
+    return text
+
+async def process_voice(audio_data: UploadFile,
+                        model: Optional[str],
+                        mode: Optional[str],
+                        generate_audio: bool,
+                        async_audio: bool,
+                        user_id: str,
+                        policy: TurnPolicy) -> CompanionResponse:
+    """Transcribe an uploaded recording and run it as a chat turn."""
     try:
-        # Print debugging info
-        print(f"Voice endpoint called with: audio_file={audio_data.filename}, model={model}, mode={mode}")
+        logger.debug("Voice endpoint called with: audio_file=%s, model=%s, mode=%s",
+                     audio_data.filename, model, mode)
         
         # Read the uploaded file content
-        file_content = await audio_data.read()
-        print(f"Read {len(file_content)} bytes from uploaded audio file")
+        with tracing.stage("upload_read"):
+            file_content = await audio_data.read()
+        logger.debug("Read %d bytes from uploaded audio file", len(file_content))
         
         # Convert speech to text using STT service
-        try:
-            text = await stt_service.speech_to_text(file_content)
-            print(f"STT result: '{text}'")
-        except Exception as stt_error:
-            print(f"STT service error: {str(stt_error)}")
-            import traceback
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail=f"STT service error: {str(stt_error)}") from stt_error
-        
-        if not text:
-            raise HTTPException(status_code=400, detail="Could not transcribe audio")
+        text = await transcribe(file_content)
         
         # Create TextInput with the parameters from form data
         text_input = TextInput(
@@ -277,35 +1110,36 @@ async def voice_endpoint(audio_data: UploadFile = File(...),
             mode=mode, 
             model=model,
             generate_audio=generate_audio,
+            async_audio=async_audio,
             user_id=user_id
         )
         
         # Use the chat endpoint to process
         try:
-            return await chat_endpoint(text_input)
+            return await process_chat(text_input, policy)
         except Exception as chat_error:
-            print(f"Chat endpoint error: {str(chat_error)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Chat endpoint error: %s", chat_error)
             raise HTTPException(status_code=500, detail=f"Chat processing error: {str(chat_error)}") from chat_error
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in voice endpoint: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.error("Error in voice endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing voice: {str(e)}") from e
     finally:
         # Make sure to close the file
         await audio_data.close()
 
 @app.post("/text-to-speech")
-async def text_to_speech_endpoint(input_data: TextInput):
+async def text_to_speech_endpoint(input_data: TextInput, request: Request):
+    timeout = request_timeout("text_to_speech", request.headers.get(DEADLINE_HEADER))
     try:
         # Generate speech audio for the input text
-        audio_data = await tts_service.text_to_speech(input_data.text)
+        with priority(request_priority(input_data.priority)), deadline("text_to_speech", timeout):
+            audio_data = await tts_service.text_to_speech(input_data.text)
         
         # If we couldn't generate audio, return an error
         if audio_data is None:
-            raise HTTPException(status_code=500, detail="Failed to generate speech")
+            raise HTTPException(status_code=504, detail="Ran out of time generating speech")
         
         # Return the binary audio data as a streaming response
         return StreamingResponse(
@@ -313,51 +1147,263 @@ async def text_to_speech_endpoint(input_data: TextInput):
             media_type="audio/wav",
             headers={"Content-Disposition": "attachment; filename=speech.wav"}
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating speech: {str(e)}")
 
+@app.post("/llm/generate")
+async def llm_generate_endpoint(input_data: GenerateInput, request: Request):
+    """
+    Plain completion for bulk jobs such as markdown_translator.py.
+    
+    Runs at batch priority unless asked otherwise, so it only takes LLM slots
+    interactive turns aren't waiting for. The result is Ollama's, with the
+    text in "response".
+    """
+    model = input_data.model or llm_service.current_model
+    timeout = request_timeout("llm_generate", request.headers.get(DEADLINE_HEADER))
+    # Batch output is never shortened; under heavy load it is shed instead
+    with priority(request_priority(input_data.priority, BATCH)), \
+            overload.turn("llm_generate"), track_turn("llm_generate", timeout):
+        turn_labels.set(("none", llm_service.model_label(model)))
+        try:
+            result = await llm_service.generate(
+                prompt=input_data.prompt,
+                system_prompt=input_data.system,
+                model=model,
+                temperature=input_data.temperature,
+                max_tokens=input_data.max_tokens
+            )
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e)) from e
+        except httpx.HTTPStatusError as e:
+            raise HTTPException(status_code=502, detail=f"Ollama returned {e.response.status_code}: "
+                                                        f"{e.response.text}") from e
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=502, detail=f"Could not reach Ollama: {str(e)}") from e
+        # Nor cut short: a partial completion would pass for a whole one
+        if result.get("truncated"):
+            raise HTTPException(status_code=504, detail="The llm stage ran out of time")
+        return result
+
+async def process_ws_text(outbox: WebSocketOutbox,
+                          payload: Dict[str, Any],
+                          request_id: str,
+                          user_id: str,
+                          turn_slots: asyncio.Semaphore) -> None:
+    """Run one websocket chat turn and queue its response."""
+    try:
+        async with turn_slots:
+            input_data = TextInput(
+                text=payload.get("text", ""),
+                mode=payload.get("mode", None),
+                generate_audio=payload.get("generate_audio", True),
+                async_audio=payload.get("async_audio", False),
+                user_id=user_id,
+                priority=payload.get("priority")
+            )
+            timeout = request_timeout("ws_turn", payload.get("timeout"))
+            with priority(request_priority(input_data.priority)), \
+                    overload.turn("ws_turn") as policy, track_turn("ws_turn", timeout) as turn_span:
+                turn_span.set(request_id=request_id, user_id=user_id)
+                if payload.get("stream"):
+                    await stream_chat(outbox, input_data, request_id, policy)
+                else:
+                    response = await process_chat(
+                        input_data, policy,
+                        on_start=lambda mode, language: send_filler(outbox, request_id, mode, language)
+                    )
+                    await send_response(outbox, response, request_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await report_turn_error(outbox, request_id, e)
+
+async def process_ws_voice(outbox: WebSocketOutbox,
+                           upload: AudioUpload,
+                           request_id: str,
+                           user_id: str,
+                           turn_slots: asyncio.Semaphore) -> None:
+    """Transcribe an audio stream from a binary-protocol client and run it as a websocket turn."""
+    payload = upload.message
+    try:
+        async with turn_slots:
+            timeout = request_timeout("ws_voice", payload.get("timeout"))
+            with priority(VOICE), overload.turn("ws_voice", voice=True) as policy, \
+                    track_turn("ws_voice", timeout) as turn_span:
+                turn_span.set(request_id=request_id, user_id=user_id, codec=upload.codec)
+                text = await transcribe(upload.audio())
+                await outbox.put({"type": "transcript", "request_id": request_id, "text": text})
+                input_data = TextInput(
+                    text=text,
+                    mode=payload.get("mode", None),
+                    model=payload.get("model", None),
+                    generate_audio=payload.get("generate_audio", True),
+                    async_audio=payload.get("async_audio", False),
+                    user_id=user_id
+                )
+                response = await process_chat(
+                    input_data, policy,
+                    on_start=lambda mode, language: send_filler(outbox, request_id, mode, language)
+                )
+                await send_response(outbox, response, request_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await report_turn_error(outbox, request_id, e)
+
+async def report_turn_error(outbox: WebSocketOutbox, request_id: str, error: Exception) -> None:
+    """Tell a websocket client why one of its turns failed."""
+    if isinstance(error, Overloaded):
+        await outbox.put({"error": str(error), "retry_after": error.retry_after, "request_id": request_id},
+                         control=True)
+        return
+    detail = error.detail if isinstance(error, HTTPException) else str(error)
+    await outbox.put({"error": detail, "request_id": request_id}, control=True)
+
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await websocket.accept()
-    active_connections[user_id] = websocket
+    """
+    Conversation over a websocket.
+    
+    Reading, processing and sending run as separate tasks: each text message
+    becomes its own turn task, control messages ("mode", "cancel", "ping") are
+    handled as soon as they are read and answered ahead of queued output, and
+    a sender task drains the connection's bounded outbox.
+    
+    Clients offering the companion.binary.v1 subprotocol get binary frames:
+    the same messages, plus raw audio in both directions, so they can send
+    "voice" turns and receive reply audio without a separate download.
+    """
+    protocol = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=protocol.name)
+    outbox = WebSocketOutbox(websocket, max_messages=int(os.getenv("WS_OUTBOX_SIZE", "256")),
+                             protocol=protocol)
+    active_connections[user_id] = outbox
+    sender = asyncio.create_task(outbox.run_sender())
+    max_turns = int(os.getenv("WS_MAX_CONCURRENT_TURNS", "2"))
+    turn_slots = asyncio.Semaphore(max_turns)
+    turns: Dict[str, asyncio.Task] = {}
+    # Audio streams being received for voice turns, by stream number
+    uploads: Dict[int, AudioUpload] = {}
+    max_audio_bytes = int(os.getenv("WS_MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
     
     try:
         while True:
-            data = await websocket.receive_text()
-            payload = json.loads(data)
+            try:
+                payload, frame = await protocol.receive(websocket)
+            except ProtocolError as e:
+                await outbox.put({"error": str(e)}, control=True)
+                continue
+            
+            if frame is not None:
+                upload = uploads.get(frame.stream)
+                if upload is None:
+                    await outbox.put({"error": f"No open audio stream {frame.stream}"}, control=True)
+                    continue
+                request_id = upload.message["request_id"]
+                try:
+                    upload.add(frame, max_audio_bytes)
+                except ProtocolError as e:
+                    del uploads[frame.stream]
+                    await outbox.put({"error": str(e), "request_id": request_id}, control=True)
+                    continue
+                if frame.end:
+                    del uploads[frame.stream]
+                    task = asyncio.create_task(
+                        process_ws_voice(outbox, upload, request_id, user_id, turn_slots)
+                    )
+                    turns[request_id] = task
+                    task.add_done_callback(lambda _, rid=request_id: turns.pop(rid, None))
+                continue
             
             if "type" not in payload:
-                await websocket.send_json({"error": "Missing 'type' in request"})
+                await outbox.put({"error": "Missing 'type' in request"}, control=True)
                 continue
+            
+            # Responses carry the client's request_id so they can be correlated
+            request_id = str(payload.get("request_id") or uuid.uuid4().hex[:12])
                 
             if payload["type"] == "text":
-                input_data = TextInput(
-                    text=payload.get("text", ""),
-                    mode=payload.get("mode", None),
-                    user_id=user_id
+                if request_id in turns:
+                    await outbox.put({"error": f"Duplicate request_id: {request_id}",
+                                      "request_id": request_id}, control=True)
+                    continue
+                task = asyncio.create_task(
+                    process_ws_text(outbox, payload, request_id, user_id, turn_slots)
                 )
-                response = await chat_endpoint(input_data)
-                await websocket.send_json(response.dict())
+                turns[request_id] = task
+                task.add_done_callback(lambda _, rid=request_id: turns.pop(rid, None))
+            
+            elif payload["type"] == "voice":
+                # Opens an audio stream; the turn starts when its END frame arrives
+                stream, codec = payload.get("stream"), payload.get("codec", "wav")
+                if not protocol.binary:
+                    error = f"Voice messages need the {BINARY_SUBPROTOCOL} subprotocol"
+                elif not isinstance(stream, int) or stream in uploads or codec not in CODEC_IDS:
+                    error = f"Voice messages need a new integer stream and a codec: {', '.join(CODEC_IDS)}"
+                elif request_id in turns or any(u.message["request_id"] == request_id for u in uploads.values()):
+                    error = f"Duplicate request_id: {request_id}"
+                elif len(uploads) >= max_turns:
+                    error = f"At most {max_turns} audio streams can be open at once"
+                else:
+                    uploads[stream] = AudioUpload(dict(payload, request_id=request_id), codec)
+                    continue
+                await outbox.put({"error": error, "request_id": request_id}, control=True)
             
             elif payload["type"] == "mode":
                 try:
                     mode_name = payload.get("mode", default_mode)
-                    mode_manager.set_active_mode(mode_name)
-                    await websocket.send_json({"message": f"Mode set to {mode_name}"})
+                    session = await session_store.load(user_id)
+                    session.mode = mode_manager.resolve_mode(mode_name)
+                    await save_session(session)
+                    await outbox.put({"message": f"Mode set to {mode_name}", "request_id": request_id},
+                                     control=True)
                 except ValueError as e:
-                    await websocket.send_json({"error": str(e)})
+                    await outbox.put({"error": str(e), "request_id": request_id}, control=True)
+            
+            elif payload["type"] == "cancel":
+                task = turns.get(request_id)
+                stream = next((stream for stream, upload in uploads.items()
+                               if upload.message["request_id"] == request_id), None)
+                if stream is not None:
+                    # Still being uploaded
+                    del uploads[stream]
+                    await outbox.put({"type": "cancelled", "request_id": request_id}, control=True)
+                elif task is None:
+                    await outbox.put({"error": f"No running request {request_id}",
+                                      "request_id": request_id}, control=True)
+                else:
+                    task.cancel()
+                    await outbox.put({"type": "cancelled", "request_id": request_id}, control=True)
+            
+            elif payload["type"] == "ping":
+                await outbox.put({"type": "pong", "request_id": request_id}, control=True)
             
             else:
-                await websocket.send_json({"error": f"Unknown request type: {payload['type']}"})
+                await outbox.put({"error": f"Unknown request type: {payload['type']}",
+                                  "request_id": request_id}, control=True)
                 
     except WebSocketDisconnect:
-        if user_id in active_connections:
-            del active_connections[user_id]
+        pass
     except Exception as e:
-        if user_id in active_connections:
+        logger.exception("Error in websocket: %s", e)
+    finally:
+        for task in list(turns.values()):
+            task.cancel()
+        await outbox.close()
+        sender.cancel()
+        if active_connections.get(user_id) is outbox:
             del active_connections[user_id]
-        print(f"Error in websocket: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    workers = int(os.getenv("ORCHESTRATOR_WORKERS", "1"))
+    if workers > 1 and not os.getenv("STATE_STORE_URL"):
+        logger.warning("ORCHESTRATOR_WORKERS > 1 without STATE_STORE_URL; workers will not share state")
+    # Several workers need the app as an import string; a single one runs this
+    # module's app, rather than importing a second copy of every service as "main".
+    # Logging is already set up by configure_logging, so uvicorn leaves it alone.
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers,
+                log_config=None)
@@ -49,13 +49,18 @@ class ModeManager:
             }
         }
         
-    def get_available_modes(self) -> List[Dict[str, Any]]:
+    def get_available_modes(self, active_mode: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Get information about all available modes.
         
+        Args:
+            active_mode: Mode to flag as active (defaults to the global active mode)
+            
         Returns:
             List of mode information dictionaries
         """
+        if active_mode is None:
+            active_mode = self.active_mode
         modes = []
         for mode_id in self.available_modes:
             if mode_id in self.mode_configs:
@@ -63,7 +68,7 @@ class ModeManager:
                     "name": self.mode_configs[mode_id]["name"],
                     "description": self.mode_configs[mode_id]["description"],
                     "id": self.mode_configs[mode_id]["id"],
-                    "active": mode_id == self.active_mode,
+                    "active": mode_id == active_mode,
                     
                 }
                 modes.append(mode_info)
@@ -76,19 +81,32 @@ class ModeManager:
         Args:
             mode_id: ID of the mode to activate
             
+        Raises:
+            ValueError: If the mode is not available
+        """
+        self.active_mode = self.resolve_mode(mode_id)
+        
+    def resolve_mode(self, mode_id: str) -> str:
+        """
+        Resolve a mode name or ID to an available mode key.
+        
+        Args:
+            mode_id: Name or ID of the mode
+            
+        Returns:
+            The mode key as listed in available_modes
+            
         Raises:
             ValueError: If the mode is not available
         """
         # First try direct match with available_modes (for backward compatibility)
         if mode_id in self.available_modes:
-            self.active_mode = mode_id
-            return
+            return mode_id
             
         # Then try to find by id in mode configs
         for mode_key in self.available_modes:
             if mode_key in self.mode_configs and self.mode_configs[mode_key].get("id") == mode_id:
-                self.active_mode = mode_key
-                return
+                return mode_key
                 
         # Mode not found
         raise ValueError(f"Mode with ID '{mode_id}' is not available")
@@ -136,10 +154,22 @@ class ModeManager:
         Returns:
             The system prompt string for the active mode
         """
-        if self.active_mode in self.mode_configs:
-            return self.mode_configs[self.active_mode]["system_prompt"]
+        return self.get_system_prompt(self.active_mode)
+        
+    def get_system_prompt(self, mode: str) -> str:
+        """
+        Get the system prompt for a mode.
+        
+        Args:
+            mode: Mode key
+            
+        Returns:
+            The system prompt string for the mode
+        """
+        if mode in self.mode_configs:
+            return self.mode_configs[mode]["system_prompt"]
         else:
-            # Fallback to general mode if active mode is not found
+            # Fallback to general mode if the mode is not found
             return self.mode_configs["general"]["system_prompt"]
             
     async def _process_french_tutor_mode(self, text: str, system_prompt: str, temperature: float, model: str) -> str:
@@ -1,5 +1,23 @@
 # Services package initialization
 from .tts_service import TTSService
-from .stt_service import STTService
+from .stt_service import STTService, AudioPreprocessing
 from .llm_service import LLMService
 from .emotion_service import EmotionService
+from .session_store import SessionStore, SessionState
+from .conversation_store import ConversationStore
+from .memory_index import MemoryIndex
+from .audio_store import AudioStore
+from .audio_jobs import AudioJobQueue
+from .ws_outbox import WebSocketOutbox
+from .state_store import StateStore, InMemoryStateStore, RedisStateStore, create_state_store
+from .model_registry import ModelRegistry
+from .metrics import REGISTRY
+from .logging_setup import configure_logging, shutdown_logging
+from .tracing import configure_tracing, TraceMiddleware
+from .profiler import SamplingProfiler, AllocationTracker
+from .overload import OverloadController, Overloaded, TurnPolicy
+from .readiness import ReadinessTracker
+from .scheduler import PriorityScheduler, configure_scheduler
+from .deadline import DeadlineExceeded, configure_deadlines, deadline
+from .filler_clips import FillerLibrary
+from .ws_protocol import BinaryProtocol, JSONProtocol, ProtocolError, negotiate
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional
+
+from services.scheduler import current_priority, priority
+from services.tracing import attach, current_span, span
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+READY = "ready"
+FAILED = "failed"
+
+
+class AudioJob:
+    """A queued speech synthesis request for one reply."""
+
+    __slots__ = ("job_id", "text", "language", "user_id", "status",
+                 "audio_key", "error", "finished_at", "trace_parent", "priority", "_done")
+
+    def __init__(self, text: str, language: Optional[str], user_id: Optional[str]):
+        self.job_id = uuid.uuid4().hex
+        self.text = text
+        self.language = language
+        self.user_id = user_id
+        self.status = PENDING
+        self.audio_key: Optional[str] = None
+        self.error: Optional[str] = None
+        self.finished_at: Optional[float] = None
+        # Span of the request that queued the job, so synthesis shows up in its trace
+        self.trace_parent = current_span()
+        # Synthesis runs at the priority of the turn that queued it
+        self.priority = current_priority()
+        self._done = asyncio.Event()
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Wait until the job has finished.
+
+        Args:
+            timeout: Maximum seconds to wait
+
+        Returns:
+            True if the job finished (ready or failed) within the timeout
+        """
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self._done.is_set()
+
+
+class AudioJobQueue:
+    """
+    Bounded queue of speech synthesis jobs served by a fixed pool of workers.
+
+    Callers get a job handle back immediately and can wait on it later, so
+    replies are not held up by TTS and bursts are spread over the workers.
+    """
+
+    def __init__(self,
+                 synthesize: Callable[[str, Optional[str]], Awaitable[Optional[str]]],
+                 workers: int = 2,
+                 max_pending: int = 64,
+                 job_ttl: float = 600.0,
+                 on_complete: Optional[Callable[[AudioJob], Awaitable[None]]] = None):
+        """
+        Args:
+            synthesize: Coroutine turning (text, language) into a stored audio key
+            workers: Number of concurrent synthesis workers
+            max_pending: Maximum number of jobs waiting to be processed
+            job_ttl: Seconds a finished job stays queryable
+            on_complete: Optional coroutine called after each job finishes
+        """
+        self.synthesize = synthesize
+        self.workers = workers
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.on_complete = on_complete
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._jobs: "OrderedDict[str, AudioJob]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def submit(self, text: str, language: Optional[str] = None, user_id: Optional[str] = None) -> AudioJob:
+        """
+        Queue a synthesis job.
+
+        Args:
+            text: Text to synthesize
+            language: Optional language code for voice selection
+            user_id: User to notify when the audio is ready
+
+        Returns:
+            The queued job
+
+        Raises:
+            asyncio.QueueFull: If the queue is full or the workers are not running
+        """
+        if self._queue is None:
+            raise asyncio.QueueFull()
+        self._prune()
+        job = AudioJob(text, language, user_id)
+        self._queue.put_nowait(job)
+        self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[AudioJob]:
+        return self._jobs.get(job_id)
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                with attach(job.trace_parent), priority(job.priority), span("audio_job", job_id=job.job_id):
+                    job.audio_key = await self.synthesize(job.text, job.language)
+                if job.audio_key:
+                    job.status = READY
+                else:
+                    job.status = FAILED
+                    job.error = "No audio generated"
+            except Exception as e:
+                logger.error("Error in audio job %s: %s", job.job_id, e)
+                job.status = FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = time.monotonic()
+                job._done.set()
+                self._queue.task_done()
+
+            if self.on_complete is not None:
+                try:
+                    await self.on_complete(job)
+                except Exception as e:
+                    logger.warning("Audio job notification failed: %s", e)
+
+    def _prune(self) -> None:
+        # Jobs are kept in submission order; drop finished ones past their TTL
+        cutoff = time.monotonic() - self.job_ttl
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job.finished_at is None or job.finished_at > cutoff:
+                break
+            self._jobs.popitem(last=False)
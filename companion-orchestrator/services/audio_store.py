@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Keys are "<sha256 hex prefix>.<extension>", which also keeps paths inside the store
+KEY_PATTERN = re.compile(r"^[0-9a-f]{32}\.(wav|mp3|ogg|opus)$")
+
+
+class _DiskEntry:
+    __slots__ = ("size", "stored_at")
+
+    def __init__(self, size: int, stored_at: float):
+        self.size = size
+        self.stored_at = stored_at
+
+
+class AudioStore:
+    """
+    Content-addressed store for generated audio.
+
+    Recent clips are kept in a byte-capped in-memory (hot) tier; every clip is
+    also written to a byte-capped directory on disk. Entries expire after a TTL
+    and are removed by a background sweep. Disk I/O runs in worker threads so
+    the event loop never blocks on it.
+
+    Workers may share the directory. Each one caps what it wrote as it goes,
+    and the sweep scans the directory, so the TTL and the disk cap also hold
+    for the directory as a whole.
+    """
+
+    def __init__(self,
+                 directory: Optional[str] = None,
+                 memory_bytes: int = 32 * 1024 * 1024,
+                 disk_bytes: int = 512 * 1024 * 1024,
+                 ttl: float = 3600.0,
+                 sweep_interval: float = 60.0):
+        """
+        Args:
+            directory: Where the disk tier lives (defaults to a temp directory)
+            memory_bytes: Maximum bytes kept in the hot tier
+            disk_bytes: Maximum bytes kept on disk
+            ttl: Seconds an entry is kept after it was last stored
+            sweep_interval: Seconds between background expiry sweeps
+        """
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "companion-audio")
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+
+        self._hot: "OrderedDict[str, bytes]" = OrderedDict()
+        self._hot_size = 0
+        self._disk: "OrderedDict[str, _DiskEntry]" = OrderedDict()
+        self._disk_size = 0
+        self._writes: Dict[str, asyncio.Future] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def key_for(data: bytes, extension: str = "wav") -> str:
+        return f"{hashlib.sha256(data).hexdigest()[:32]}.{extension}"
+
+    @staticmethod
+    def is_valid_key(key: str) -> bool:
+        return bool(KEY_PATTERN.match(key))
+
+    async def start(self) -> None:
+        """Adopt files left by a previous run and start the expiry sweep."""
+        await asyncio.to_thread(self._load_index)
+        await self.sweep()
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def put(self, data: bytes, extension: str = "wav") -> str:
+        """
+        Store audio and return its key.
+
+        Storing the same content twice returns the same key and refreshes its TTL.
+
+        Args:
+            data: Encoded audio bytes
+            extension: File extension for the stored clip
+
+        Returns:
+            The content-addressed key, usable as a filename
+        """
+        key = self.key_for(data, extension)
+        now = time.time()
+
+        self._put_hot(key, data)
+
+        pending = self._writes.get(key)
+        if pending is not None:
+            # The same clip is already being written by another request
+            await pending
+            return key
+
+        write = asyncio.ensure_future(asyncio.to_thread(self._store_file, key, data, now))
+        self._writes[key] = write
+        try:
+            await write
+        finally:
+            del self._writes[key]
+        self._forget_disk(key)
+        self._disk[key] = _DiskEntry(len(data), now)
+        self._disk_size += len(data)
+        await self._enforce_disk_cap()
+        return key
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Fetch stored audio by key.
+
+        Args:
+            key: Key returned by put()
+
+        Returns:
+            The audio bytes, or None if unknown or expired
+        """
+        if not self.is_valid_key(key):
+            return None
+
+        data = self._hot.get(key)
+        if data is not None:
+            self._hot.move_to_end(key)
+            return data
+
+        pending = self._writes.get(key)
+        if pending is not None:
+            await pending
+        if key not in self._disk:
+            # Another worker sharing the directory may have written this clip.
+            # It is stamped as stored now, which keeps the index in store-time
+            # order for the sweep and the disk cap.
+            now = time.time()
+            size = await asyncio.to_thread(self._adopt_file, key, now)
+            if size is None:
+                return None
+            if key not in self._disk:
+                self._disk[key] = _DiskEntry(size, now)
+                self._disk_size += size
+                await self._enforce_disk_cap()
+        try:
+            data = await asyncio.to_thread(self._read_file, key)
+        except FileNotFoundError:
+            self._forget_disk(key)
+            return None
+        self._put_hot(key, data)
+        return data
+
+    def contains(self, key: str) -> bool:
+        return key in self._hot or key in self._disk
+
+    async def sweep(self) -> None:
+        """
+        Remove entries older than the TTL from both tiers, and the oldest files
+        while the directory, whoever wrote to it, is over the disk cap.
+        """
+        started = time.time()
+        cutoff = started - self.ttl
+        # File mtimes are store times, so the scan covers every worker's clips
+        files = await asyncio.to_thread(self._scan_files)
+        total = sum(size for _, _, size in files)
+        kept = set()
+        evicted = []
+        for stored_at, key, size in files:
+            if stored_at < cutoff or total > self.disk_bytes:
+                evicted.append(key)
+                total -= size
+            else:
+                kept.add(key)
+        # Also forgets clips other workers removed; later puts are kept
+        for key, entry in list(self._disk.items()):
+            if key not in kept and entry.stored_at < started:
+                self._drop_hot(key)
+                self._forget_disk(key)
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+            logger.info("Expired %d audio clips", len(evicted))
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error("Error sweeping audio store: %s", e)
+
+    async def _enforce_disk_cap(self) -> None:
+        evicted = []
+        while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+            key = next(iter(self._disk))
+            self._drop_hot(key)
+            self._forget_disk(key)
+            evicted.append(key)
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    def _put_hot(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._hot:
+            self._hot.move_to_end(key)
+            return
+        self._hot[key] = data
+        self._hot_size += len(data)
+        while self._hot_size > self.memory_bytes:
+            _, evicted = self._hot.popitem(last=False)
+            self._hot_size -= len(evicted)
+
+    def _drop_hot(self, key: str) -> None:
+        data = self._hot.pop(key, None)
+        if data is not None:
+            self._hot_size -= len(data)
+
+    def _forget_disk(self, key: str) -> None:
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_size -= entry.size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _write_file(self, key: str, data: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temp name first so readers never see a partial file; the
+        # name is unique, as another worker may be writing the same clip
+        temp_path = f"{self._path(key)}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._path(key))
+
+    def _store_file(self, key: str, data: bytes, now: float) -> None:
+        # A clip already on disk, possibly written by another worker, is only
+        # re-stamped; other workers' sweeps go by the file's mtime
+        if self._adopt_file(key, now) is None:
+            self._write_file(key, data)
+
+    def _read_file(self, key: str) -> bytes:
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def _remove_files(self, keys) -> None:
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning("Could not remove audio file %s: %s", key, e)
+
+    def _adopt_file(self, key: str, now: float) -> Optional[int]:
+        """Size of a clip already on disk, after re-stamping it with now; None if missing."""
+        try:
+            # The new mtime also orders the clip correctly for the next _load_index
+            os.utime(self._path(key), (now, now))
+            return os.stat(self._path(key)).st_size
+        except FileNotFoundError:
+            return None
+
+    def _scan_files(self) -> List[Tuple[float, str, int]]:
+        """(mtime, key, size) of every clip in the directory, oldest first."""
+        found = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and self.is_valid_key(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    found.append((stat.st_mtime, entry.name, stat.st_size))
+        return sorted(found)
+
+    def _load_index(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        for stored_at, key, size in self._scan_files():
+            if key not in self._disk:
+                self._disk[key] = _DiskEntry(size, stored_at)
+                self._disk_size += size
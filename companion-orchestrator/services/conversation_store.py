@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Deque, List, Optional, Set, Tuple
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+USER = "user"
+ASSISTANT = "assistant"
+
+CONVERSATIONS_LOADED = REGISTRY.gauge(
+    "companion_conversations_loaded", "Conversations whose recent messages are held in memory")
+CONVERSATION_WRITES = REGISTRY.histogram(
+    "companion_conversation_write_batch", "Messages written to the conversation store per transaction",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+
+# (user_id, mode, role, text, created_at)
+Row = Tuple[str, str, str, str, float]
+
+
+class Message:
+    """One stored message. Roles are shared strings, so a record costs little beyond its text."""
+
+    __slots__ = ("role", "text", "created_at")
+
+    def __init__(self, role: str, text: str, created_at: float):
+        self.role = sys.intern(role)
+        self.text = text
+        self.created_at = created_at
+
+    def to_dict(self):
+        return {"role": self.role, "text": self.text, "created_at": self.created_at}
+
+
+class _Conversation:
+    __slots__ = ("messages", "last_seen")
+
+    def __init__(self, messages: Deque[Message]):
+        self.messages = messages
+        self.last_seen = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Append-only message history per user and mode, in SQLite.
+
+    Only the last `history_messages` messages of recently active
+    conversations are kept in memory: a conversation is loaded from the
+    database on the user's first message and dropped again when idle or when
+    the cap on loaded conversations is reached, so memory doesn't grow with
+    the number of users ever seen.
+
+    Appends are queued and written in batches by a background task, one
+    transaction per batch, so replies never wait for the disk. All database
+    work runs on a single thread, in order, so a load queued after a write
+    sees it. The database is in WAL mode, so several worker processes on the
+    same host can share the file.
+    """
+
+    def __init__(self,
+                 path: str,
+                 history_messages: int = 10,
+                 max_conversations: int = 10000,
+                 idle_timeout: float = 3600.0,
+                 flush_interval: float = 0.5,
+                 batch_size: int = 500,
+                 max_pending: int = 50000,
+                 on_written: Optional[Callable[[str, str], Awaitable[None]]] = None):
+        """
+        Args:
+            path: SQLite database file
+            history_messages: Recent messages per conversation kept in memory and returned by history()
+            max_conversations: Maximum number of conversations kept in memory
+            idle_timeout: Seconds of inactivity after which a conversation is dropped from memory
+            flush_interval: Seconds between background writes
+            batch_size: Queued messages that trigger a write before the interval is up
+            max_pending: Queued messages kept while the database is failing; older ones are dropped
+            on_written: Optional coroutine called with (user_id, mode) for each
+                conversation once a batch with its new messages is in the database
+        """
+        self.path = path
+        self.history_messages = history_messages
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.on_written = on_written
+
+        self._conversations: "OrderedDict[Tuple[str, str], _Conversation]" = OrderedDict()
+        self._pending: List[Row] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._writer: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._notifications: Set[asyncio.Task] = set()
+
+    async def start(self) -> None:
+        await self._run(self._open)
+        if self._writer is None:
+            self._wake = asyncio.Event()
+            self._writer = asyncio.create_task(self._write_loop())
+
+    async def stop(self) -> None:
+        """Write the queued messages and close the database."""
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("Dropped %d unsaved messages: %s", len(self._pending), e)
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    async def history(self, user_id: str, mode: str) -> List[Message]:
+        """
+        Recent messages of a conversation, oldest first, loading them on first use.
+
+        Args:
+            user_id: Identifier for the user
+            mode: Companion mode the conversation belongs to
+
+        Returns:
+            Up to history_messages messages
+        """
+        key = (user_id, mode)
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            if any(row[0] == user_id and row[1] == mode for row in self._pending):
+                # Queue the write ahead of the load, so the load includes it
+                self._submit_pending()
+            rows = await self._run(self._load, user_id, mode, self.history_messages)
+            conversation = self._conversations.get(key)
+            if conversation is None:
+                messages = deque((Message(role, text, created_at) for role, text, created_at in rows),
+                                 maxlen=self.history_messages)
+                conversation = _Conversation(messages)
+                self._conversations[key] = conversation
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+                CONVERSATIONS_LOADED.set(len(self._conversations))
+        else:
+            self._conversations.move_to_end(key)
+
+        conversation.last_seen = now
+        return list(conversation.messages)
+
+    def append(self, user_id: str, mode: str, role: str, text: str, created_at: Optional[float] = None) -> None:
+        """Record a message, sent at created_at (default now). It is written to the database in the background."""
+        if created_at is None:
+            created_at = time.time()
+        conversation = self._conversations.get((user_id, mode))
+        if conversation is not None:
+            conversation.messages.append(Message(role, text, created_at))
+        self._pending.append((user_id, mode, role, text, created_at))
+        if len(self._pending) > self.max_pending:
+            logger.warning("Conversation store is falling behind, dropping %d messages",
+                           len(self._pending) - self.max_pending)
+            del self._pending[:len(self._pending) - self.max_pending]
+        if len(self._pending) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    def forget(self, user_id: str, mode: Optional[str] = None) -> None:
+        """Drop a user's loaded conversations, e.g. after another worker added to them."""
+        if mode is not None:
+            self._conversations.pop((user_id, mode), None)
+            CONVERSATIONS_LOADED.set(len(self._conversations))
+            return
+        for key in [key for key in self._conversations if key[0] == user_id]:
+            del self._conversations[key]
+        CONVERSATIONS_LOADED.set(len(self._conversations))
+
+    async def delete(self, user_id: str, mode: Optional[str] = None) -> int:
+        """
+        Delete a user's stored messages, in one mode or all of them.
+
+        Returns:
+            Number of messages deleted from the database
+        """
+        self._pending = [row for row in self._pending
+                         if not (row[0] == user_id and (mode is None or row[1] == mode))]
+        self.forget(user_id, mode)
+        return await self._run(self._delete, user_id, mode)
+
+    async def flush(self) -> None:
+        """Write the queued messages now."""
+        future = self._submit_pending()
+        if future is not None:
+            await future
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    async def _write_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error("Error writing conversations, retrying: %s", e)
+
+    def _submit_pending(self) -> Optional[asyncio.Future]:
+        if not self._pending:
+            return None
+        rows, self._pending = self._pending, []
+        future = self._run(self._write, rows)
+
+        def written(done: asyncio.Future) -> None:
+            if done.cancelled() or done.exception() is not None:
+                # Kept in order ahead of anything appended since
+                self._pending[:0] = rows
+            else:
+                CONVERSATION_WRITES.observe(len(rows))
+                if self.on_written is not None:
+                    conversations = list(dict.fromkeys((row[0], row[1]) for row in rows))
+                    task = asyncio.ensure_future(self._notify(conversations))
+                    self._notifications.add(task)
+                    task.add_done_callback(self._notifications.discard)
+        future.add_done_callback(written)
+        return future
+
+    async def _notify(self, conversations: List[Tuple[str, str]]) -> None:
+        for user_id, mode in conversations:
+            try:
+                await self.on_written(user_id, mode)
+            except Exception as e:
+                logger.warning("Conversation write notification failed: %s", e)
+
+    def _run(self, function, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _evict_idle(self, now: float) -> None:
+        # The oldest conversations are at the front; stop at the first active one
+        while self._conversations:
+            oldest = next(iter(self._conversations.values()))
+            if now - oldest.last_seen < self.idle_timeout:
+                break
+            self._conversations.popitem(last=False)
+        CONVERSATIONS_LOADED.set(len(self._conversations))
+
+    # The methods below run on the store's thread
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # Durable up to the last checkpointed transaction; a crash loses at most the latest batches
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS messages_conversation ON messages (user_id, mode, id)")
+        self._connection.commit()
+
+    def _close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _write(self, rows: List[Row]) -> None:
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO messages (user_id, mode, role, text, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _load(self, user_id: str, mode: str, limit: int) -> List[Tuple[str, str, float]]:
+        rows = self._connection.execute(
+            "SELECT role, text, created_at FROM messages WHERE user_id = ? AND mode = ?"
+            " ORDER BY id DESC LIMIT ?", (user_id, mode, limit)).fetchall()
+        rows.reverse()
+        return rows
+
+    def _delete(self, user_id: str, mode: Optional[str]) -> int:
+        with self._connection:
+            if mode is None:
+                cursor = self._connection.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+            else:
+                cursor = self._connection.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND mode = ?", (user_id, mode))
+        return cursor.rowcount
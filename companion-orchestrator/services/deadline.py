@@ -0,0 +1,136 @@
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from services.metrics import REGISTRY
+from services.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+DEADLINE_EXCEEDED = REGISTRY.counter(
+    "companion_deadline_exceeded_total", "Stages cut short because their share of the request deadline ran out",
+    ["endpoint", "stage"])
+
+# Seconds a request may take when the client doesn't say, by endpoint. Turns
+# have no deadline by default, so on CPU-only hosts the LLM, TTS and STT calls
+# keep their own timeouts; clients or DEADLINE_<ENDPOINT> opt in.
+DEFAULT_TIMEOUTS: Dict[str, Optional[float]] = {
+    "chat": None, "voice": None, "ws_turn": None, "ws_voice": None,
+    "llm_generate": 600.0, "text_to_speech": 60.0,
+}
+
+# Largest fraction of a request's deadline each stage may use
+DEFAULT_BUDGETS = {"stt": 0.67, "llm": 0.6, "tts": 0.4}
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage's budget ran out before it produced anything usable."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"The {stage} stage ran out of time")
+        self.stage = stage
+
+
+class Deadline:
+    """The time by which a request must be answered, and the stages that ran out of it."""
+
+    __slots__ = ("endpoint", "total", "expires_at", "budgets", "exceeded")
+
+    def __init__(self, endpoint: str, seconds: float, budgets: Dict[str, float]):
+        self.endpoint = endpoint
+        self.total = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.budgets = budgets
+        self.exceeded: List[str] = []
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def stage_timeout(self, stage: str) -> float:
+        """Seconds a stage starting now may take: its budget, or what is left if that is less."""
+        share = self.budgets.get(stage)
+        remaining = self.remaining()
+        return min(remaining, share * self.total) if share is not None else remaining
+
+
+_current_deadline: "contextvars.ContextVar[Optional[Deadline]]" = contextvars.ContextVar("deadline", default=None)
+_budgets: Dict[str, float] = dict(DEFAULT_BUDGETS)
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline(endpoint: str, seconds: Optional[float]) -> Iterator[Optional[Deadline]]:
+    """
+    Give the LLM, TTS and STT calls made inside the block `seconds` to finish
+    between them. With `seconds` None the calls keep their own timeouts.
+    """
+    if seconds is None:
+        yield None
+        return
+    active = Deadline(endpoint, seconds, _budgets)
+    token = _current_deadline.set(active)
+    try:
+        yield active
+    finally:
+        _current_deadline.reset(token)
+
+
+def stage_timeout(stage: str, default: Optional[float]) -> Optional[float]:
+    """
+    Timeout for a backend call of a stage.
+
+    Returns:
+        The stage's share of the current request's deadline, or `default`
+        outside of a request with a deadline
+    """
+    active = _current_deadline.get()
+    return active.stage_timeout(stage) if active is not None else default
+
+
+def record_exceeded(stage: str) -> None:
+    """Count a stage that was cut short by the deadline, on the metrics and the current span."""
+    active = _current_deadline.get()
+    endpoint = active.endpoint if active is not None else "none"
+    if active is not None and stage not in active.exceeded:
+        active.exceeded.append(stage)
+    DEADLINE_EXCEEDED.inc(endpoint=endpoint, stage=stage)
+    stage_span = current_span()
+    if stage_span is not None:
+        stage_span.set(deadline_exceeded=stage)
+    logger.warning("Deadline: %s stage of %s ran out of time", stage, endpoint)
+
+
+def configure_deadlines() -> Dict[str, Optional[float]]:
+    """
+    Set stage budgets and per-endpoint deadlines from the environment.
+
+    Configured from:
+        DEADLINE_BUDGETS: Largest fraction of the deadline per stage (default "stt=0.67,llm=0.6,tts=0.4")
+        DEADLINE_CHAT / DEADLINE_VOICE / DEADLINE_WS_TURN / DEADLINE_WS_VOICE /
+            DEADLINE_LLM_GENERATE / DEADLINE_TEXT_TO_SPEECH: Default deadline in seconds
+            per endpoint; "off" (or 0) for none
+
+    Returns:
+        Default deadline in seconds by endpoint, None where there is none
+    """
+    budgets = os.getenv("DEADLINE_BUDGETS")
+    if budgets:
+        _budgets.clear()
+        for item in budgets.split(","):
+            stage, _, share = item.partition("=")
+            if stage.strip():
+                _budgets[stage.strip()] = float(share)
+    timeouts: Dict[str, Optional[float]] = {}
+    for endpoint, seconds in DEFAULT_TIMEOUTS.items():
+        value = os.getenv(f"DEADLINE_{endpoint.upper()}")
+        if value is not None:
+            seconds = None if value.strip().lower() in ("", "off", "0") else float(value)
+        timeouts[endpoint] = seconds
+    logger.info("Request deadlines: %s, stage budgets: %s", timeouts, _budgets)
+    return timeouts
@@ -1,5 +1,66 @@
 import re
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+
+class EmotionStream:
+    """
+    Incremental emotion scorer for text that arrives in fragments.
+
+    Keeps one score per emotion plus a short tail of the previous fragment so
+    keywords split across fragment boundaries are still matched. Memory use is
+    bounded by the keyword table, not by the length of the streamed text.
+    """
+
+    def __init__(self, emotion_keywords: Dict[str, List[str]]):
+        # Keywords not matched yet; each one counts once, like analyze_emotion
+        self._pending = [
+            (emotion, keyword)
+            for emotion, keywords in emotion_keywords.items()
+            for keyword in keywords
+        ]
+        self._scores = {emotion: 0 for emotion in emotion_keywords}
+        self._tail_length = max((len(k) for _, k in self._pending), default=1) - 1
+        self._tail = ""
+        self.emotion = "neutral"
+
+    def feed(self, fragment: str) -> Optional[str]:
+        """
+        Score the next fragment of text.
+
+        Args:
+            fragment: The newly generated piece of text (token or sentence)
+
+        Returns:
+            The new leading emotion if it changed, otherwise None
+        """
+        if not fragment:
+            return None
+
+        window = self._tail + fragment.lower()
+        still_pending = []
+        for emotion, keyword in self._pending:
+            if keyword in window:
+                self._scores[emotion] += 1
+            else:
+                still_pending.append((emotion, keyword))
+        self._pending = still_pending
+        self._tail = window[-self._tail_length:] if self._tail_length else ""
+
+        leading = self._leading_emotion()
+        if leading != self.emotion:
+            self.emotion = leading
+            return leading
+        return None
+
+    def _leading_emotion(self) -> str:
+        max_score = max(self._scores.values()) if self._scores else 0
+        if max_score > 0:
+            # First emotion wins ties, same as the one-shot analysis
+            for emotion, score in self._scores.items():
+                if score == max_score:
+                    return emotion
+        return "neutral"
+
 
 class EmotionService:
     """Service for detecting and generating emotional expressions for the AI Companion."""
@@ -45,6 +106,15 @@ class EmotionService:
         # Default to neutral if no strong emotions detected
         return "neutral"
     
+    def create_stream(self) -> EmotionStream:
+        """
+        Create an incremental scorer for a response that is still being generated.
+        
+        Returns:
+            An EmotionStream using this service's emotion keywords
+        """
+        return EmotionStream(self.emotion_keywords)
+        
     def detect_emotion(self, text: str) -> str:
         """
         Alias for analyze_emotion to maintain API compatibility.
@@ -0,0 +1,189 @@
+import hashlib
+import io
+import json
+import logging
+import wave
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.metrics import REGISTRY
+from services.scheduler import BATCH, priority
+from services.tts_service import TTSService
+
+logger = logging.getLogger(__name__)
+
+FILLER_CLIPS = REGISTRY.gauge(
+    "companion_filler_clips", "Acknowledgement clips rendered and held in memory")
+FILLER_CLIPS_SENT = REGISTRY.counter(
+    "companion_filler_clips_sent_total", "Acknowledgement clips sent at the start of a turn", ["language"])
+
+DEFAULT_MODE = "default"
+
+# Phrases by language, then by companion mode; DEFAULT_MODE covers the other modes
+DEFAULT_PHRASES: Dict[str, Dict[str, List[str]]] = {
+    "en": {
+        DEFAULT_MODE: ["Let me think...", "Hmm, one moment.", "Good question, let me see."],
+        "french_tutor": ["Good question, let me think.", "Hmm, let me see...", "Alright, one moment."],
+        "motivator": ["Ooh, great question!", "Let's see!", "Okay, here's the thing..."],
+        "chill_buddy": ["Hmm...", "Oh, let me think...", "Yeah, hmm..."],
+    },
+    "fr": {
+        DEFAULT_MODE: ["Hmm, bonne question.", "Voyons voir...", "Laisse-moi réfléchir..."],
+    },
+}
+
+
+def _clip_id(voice: str, text: str) -> str:
+    # Stable across restarts and workers, so any worker can serve any clip's URL
+    return hashlib.sha256(f"{voice}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class FillerClip:
+    """A short acknowledgement phrase rendered in one voice."""
+
+    __slots__ = ("clip_id", "text", "language", "voice", "audio", "duration")
+
+    def __init__(self, text: str, language: str, voice: str, audio: bytes):
+        self.clip_id = _clip_id(voice, text)
+        self.text = text
+        self.language = language
+        self.voice = voice
+        self.audio = audio
+        self.duration = self._wav_duration(audio)
+
+    @property
+    def filename(self) -> str:
+        return f"{self.clip_id}.wav"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "clip_id": self.clip_id,
+            "text": self.text,
+            "language": self.language,
+            "audio_url": f"/audio/fillers/{self.filename}",
+            "duration_ms": round(self.duration * 1000) if self.duration is not None else None,
+        }
+
+    @staticmethod
+    def _wav_duration(audio: bytes) -> Optional[float]:
+        try:
+            with wave.open(io.BytesIO(audio)) as wav_file:
+                return wav_file.getnframes() / wav_file.getframerate()
+        except (wave.Error, EOFError, ZeroDivisionError):
+            return None
+
+
+class FillerLibrary:
+    """
+    Acknowledgement clips ("Let me think...") played while a reply is generated.
+
+    Every phrase is synthesized once, at startup, in the voice its language
+    is spoken with, and kept in memory; picking a clip for a turn costs no
+    backend work. Clips for a mode and language are handed out in rotation.
+    """
+
+    def __init__(self,
+                 tts_service: TTSService,
+                 phrases: Optional[Dict[str, Dict[str, List[str]]]] = None,
+                 crossfade_ms: int = 250):
+        """
+        Args:
+            tts_service: Service the clips are rendered with
+            phrases: Phrases by language, then by mode ("default" for the other modes)
+            crossfade_ms: Crossfade from a clip into the reply's audio suggested to clients
+        """
+        self.tts_service = tts_service
+        self.phrases = phrases or DEFAULT_PHRASES
+        self.crossfade_ms = crossfade_ms
+        self._clips: Dict[str, FillerClip] = {}
+        self._by_mode: Dict[Tuple[str, str], List[FillerClip]] = {}
+        self._turns: Dict[Tuple[str, str], int] = {}
+
+    async def render(self) -> Dict[str, int]:
+        """
+        Synthesize the phrases not rendered yet. Used as a startup check, so
+        it is retried in the background until every phrase has been rendered.
+
+        Returns:
+            Number of clips and their total size in bytes
+
+        Raises:
+            RuntimeError: If a phrase couldn't be synthesized
+        """
+        failed = []
+        # Startup work; yields the TTS slots to the first turns
+        with priority(BATCH):
+            for language, modes in self.phrases.items():
+                for mode, texts in modes.items():
+                    for text in texts:
+                        voice = self.tts_service.select_voice(text, language)
+                        if not self._add(mode, language, voice, text):
+                            audio = await self.tts_service.synthesize_clip(text, voice)
+                            if audio:
+                                self._add(mode, language, voice, text, audio)
+                            else:
+                                failed.append(text)
+        FILLER_CLIPS.set(len(self._clips))
+        if failed:
+            raise RuntimeError(f"Could not render {len(failed)} filler clips, e.g. {failed[0]!r}")
+        return {"clips": len(self._clips), "bytes": sum(len(clip.audio) for clip in self._clips.values())}
+
+    def pick(self, mode: str, language: Optional[str] = None) -> Optional[FillerClip]:
+        """
+        Next clip for a turn in a mode and language.
+
+        Falls back to the language's default phrases, then to English ones.
+
+        Returns:
+            A clip, or None if none has been rendered for the language
+        """
+        language = (language or "en").lower()[:2]
+        for key in ((language, mode), (language, DEFAULT_MODE), ("en", mode), ("en", DEFAULT_MODE)):
+            clips = self._by_mode.get(key)
+            if clips:
+                turn = self._turns.get(key, 0)
+                self._turns[key] = turn + 1
+                clip = clips[turn % len(clips)]
+                FILLER_CLIPS_SENT.inc(language=clip.language)
+                return clip
+        return None
+
+    def get(self, filename: str) -> Optional[FillerClip]:
+        return self._clips.get(filename.split(".")[0])
+
+    def clips(self, mode: Optional[str] = None, language: Optional[str] = None) -> List[FillerClip]:
+        """Rendered clips, optionally only those for a mode (with its defaults) and language."""
+        selected = []
+        for (clip_language, clip_mode), clips in self._by_mode.items():
+            if language is not None and clip_language != language.lower()[:2]:
+                continue
+            if mode is not None and clip_mode not in (mode, DEFAULT_MODE):
+                continue
+            selected.extend(clips)
+        return selected
+
+    def _add(self, mode: str, language: str, voice: str, text: str, audio: Optional[bytes] = None) -> bool:
+        """File a clip under a mode. Returns False if it isn't in memory and no audio was given."""
+        clip_id = _clip_id(voice, text)
+        clip = self._clips.get(clip_id)
+        if clip is None:
+            if audio is None:
+                return False
+            clip = FillerClip(text, language, voice, audio)
+            self._clips[clip_id] = clip
+        clips = self._by_mode.setdefault((language, mode), [])
+        if clip not in clips:
+            clips.append(clip)
+        return True
+
+
+def load_phrases(path: Optional[str]) -> Optional[Dict[str, Dict[str, List[str]]]]:
+    """
+    Read filler phrases from a JSON file shaped like DEFAULT_PHRASES.
+
+    Returns:
+        The phrases, or None (the defaults) if no path is given
+    """
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
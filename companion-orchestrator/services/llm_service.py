@@ -1,6 +1,17 @@
+import asyncio
 import httpx
 import json
-from typing import Dict, Any, List, Optional
+import logging
+import time
+from typing import AsyncIterator, Dict, Any, List, Optional, Sequence, Set
+
+from services.conversation_store import USER, Message
+from services.deadline import DeadlineExceeded, record_exceeded, stage_timeout
+from services.metrics import LLM_DURATION, LLM_TIME_TO_FIRST_TOKEN, LLM_TOKENS_PER_SECOND
+from services.scheduler import scheduler
+from services.tracing import Span, span, start_span
+
+logger = logging.getLogger(__name__)
 
 class LLMService:
     """Service for interacting with LLM models via Ollama."""
@@ -11,13 +22,17 @@ class LLMService:
         self.default_model = "tinyllama:latest"
         # Track the current model (can be changed via API)
         self.current_model = self.default_model
+        # Installed models, kept up to date by the model registry; other names
+        # are labelled "other" in metrics, so clients can't add time series
+        self.known_models: Set[str] = set()
         
     async def generate_response(self, 
                               prompt: str, 
                               system_prompt: str = "", 
                               model: Optional[str] = None,
                               temperature: float = 0.7,
-                              max_tokens: int = 500) -> str:
+                              max_tokens: int = 500,
+                              history: Optional[Sequence[Message]] = None) -> str:
         """
         Generate a response from the LLM.
         
@@ -27,60 +42,292 @@ class LLMService:
             model: Which Ollama model to use
             temperature: Creativity parameter (0.0-1.0)
             max_tokens: Maximum tokens to generate
+            history: Earlier messages of the conversation, oldest first
             
         Returns:
             Generated text response
         """
+        try:
+            result = await self.generate(prompt, system_prompt, model, temperature, max_tokens, history)
+            # generate endpoint returns 'response' field directly
+            content = result.get("response", "")
+            logger.debug("Got content of length: %d", len(content))
+            return content
+        except httpx.HTTPStatusError:
+            return "Sorry, I'm having trouble thinking right now."
+        except DeadlineExceeded:
+            return "Sorry, I'm taking too long to think right now."
+        except Exception as e:
+            logger.exception("Error in LLM service: %s", e)
+            return "Sorry, I encountered an error while processing your request."
+            
+    async def generate(self,
+                       prompt: str,
+                       system_prompt: str = "",
+                       model: Optional[str] = None,
+                       temperature: float = 0.7,
+                       max_tokens: int = 500,
+                       history: Optional[Sequence[Message]] = None) -> Dict[str, Any]:
+        """
+        Generate a completion, waiting for an LLM slot at the caller's priority.
+        
+        Args:
+            prompt: The user's message
+            system_prompt: Optional system prompt to guide the model's behavior
+            model: Which Ollama model to use
+            temperature: Creativity parameter (0.0-1.0)
+            max_tokens: Maximum tokens to generate
+            history: Earlier messages of the conversation, oldest first
+            
+        Returns:
+            Ollama's result, with the text in "response" and its timing statistics;
+            if the request's deadline cut the generation short, the text so far
+            with "truncated" set
+            
+        Raises:
+            httpx.HTTPError: If Ollama can't be reached or answers with an error status
+            DeadlineExceeded: If the deadline ran out before the first token
+        """
         if not model:
             model = self.default_model
             
-        try:
-            print(f"Starting LLM request to {self.ollama_url} with model {model}...")
+        with span("llm.generate", model=model, prompt_chars=len(prompt)) as llm_span:
+            logger.debug("Starting LLM request to %s with model %s", self.ollama_url, model)
             
             # Try using the completion endpoint instead of chat
             # See: https://github.com/ollama/ollama/blob/main/docs/api.md#generate-a-completion
-            full_prompt = ""
-            if system_prompt:
-                full_prompt = f"{system_prompt}\n\n"
-            full_prompt += prompt
+            full_prompt = self._build_prompt(prompt, system_prompt, history)
             
+            # Streamed, so a generation cut short by the deadline still returns what it has
             payload = {
                 "model": model,
                 "prompt": full_prompt,
-                "stream": False,
+                "stream": True,
                 "options": {
                     "temperature": temperature,
                     "num_predict": max_tokens,
                 }
             }
             
-            print(f"Payload: {json.dumps(payload, indent=2)}")
+            logger.debug("Payload: %s", payload)
+            
+            # Longer timeout to accommodate larger models; waiting for a slot counts against it
+            timeout = stage_timeout("llm", 60.0)
+            fragments: List[str] = []
+            result: Dict[str, Any] = {}
+            started = time.perf_counter()
             
-            # Longer timeout to accommodate larger models
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                print(f"Sending POST request to {self.ollama_url}/api/generate...")
+            async def complete() -> None:
+                async with scheduler.slot("llm"):
+                    # A little longer than the deadline, which cuts the stream short first
+                    async with httpx.AsyncClient(timeout=timeout + 1.0) as client:
+                        async with client.stream("POST", f"{self.ollama_url}/api/generate", json=payload) as response:
+                            if response.status_code != 200:
+                                body = await response.aread()
+                                logger.error("LLM Error: Status %s, Response: %s",
+                                             response.status_code, body.decode(errors='replace'))
+                                llm_span.set(status_code=response.status_code)
+                                response.raise_for_status()
+                            async for line in response.aiter_lines():
+                                if not line:
+                                    continue
+                                chunk = json.loads(line)
+                                if chunk.get("response"):
+                                    if not fragments:
+                                        LLM_TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started, model=self.model_label(model))
+                                    fragments.append(chunk["response"])
+                                if chunk.get("done"):
+                                    result.update(chunk)
+                                    break
+            
+            try:
+                await asyncio.wait_for(complete(), timeout)
+            except asyncio.TimeoutError:
+                record_exceeded("llm")
+                if not fragments:
+                    raise DeadlineExceeded("llm")
+                llm_span.set(truncated=True)
+                result.update(model=model, done=False, done_reason="deadline", truncated=True)
+            
+            result["response"] = "".join(fragments)
+            LLM_DURATION.observe(time.perf_counter() - started, model=self.model_label(model))
+            self._observe_generation_speed(result, model)
+            self._annotate_span(llm_span, result)
+            return result
+            
+    async def stream_response(self,
+                              prompt: str,
+                              system_prompt: str = "",
+                              model: Optional[str] = None,
+                              temperature: float = 0.7,
+                              max_tokens: int = 500,
+                              history: Optional[Sequence[Message]] = None) -> AsyncIterator[str]:
+        """
+        Stream a response from the LLM as it is generated.
+        
+        Args:
+            prompt: The user's message
+            system_prompt: Optional system prompt to guide the model's behavior
+            model: Which Ollama model to use
+            temperature: Creativity parameter (0.0-1.0)
+            max_tokens: Maximum tokens to generate
+            history: Earlier messages of the conversation, oldest first
+            
+        Yields:
+            Text fragments in generation order
+        """
+        if not model:
+            model = self.default_model
+            
+        full_prompt = self._build_prompt(prompt, system_prompt, history)
+        
+        payload = {
+            "model": model,
+            "prompt": full_prompt,
+            "stream": True,
+            "options": {
+                "temperature": temperature,
+                "num_predict": max_tokens,
+            }
+        }
+        
+        started = time.perf_counter()
+        timeout = stage_timeout("llm", 60.0)
+        stage_end = time.monotonic() + timeout
+        first_token = True
+        # Not made current: the consumer runs between our yields
+        llm_span = start_span("llm.stream", model=model, prompt_chars=len(prompt))
+        try:
+            # The slot is held until the stream ends; waiting for it counts against the deadline
+            async with scheduler.slot("llm", timeout=timeout) as waited, \
+                    httpx.AsyncClient(timeout=timeout) as client:
+                if waited:
+                    llm_span.set(queue_wait_ms=round(waited * 1000, 1))
+                async with client.stream("POST", f"{self.ollama_url}/api/generate", json=payload) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        logger.error("LLM Error: Status %s, Response: %s",
+                                     response.status_code, body.decode(errors='replace'))
+                        llm_span.set(status_code=response.status_code)
+                        yield "Sorry, I'm having trouble thinking right now."
+                        return
+                    
+                    # Ollama streams one JSON object per line
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        fragment = chunk.get("response", "")
+                        if fragment:
+                            if first_token:
+                                time_to_first_token = time.perf_counter() - started
+                                LLM_TIME_TO_FIRST_TOKEN.observe(time_to_first_token, model=self.model_label(model))
+                                llm_span.set(time_to_first_token_ms=round(time_to_first_token * 1000, 1))
+                                first_token = False
+                            yield fragment
+                        if chunk.get("done"):
+                            LLM_DURATION.observe(time.perf_counter() - started, model=self.model_label(model))
+                            self._observe_generation_speed(chunk, model)
+                            self._annotate_span(llm_span, chunk)
+                            break
+                        if time.monotonic() >= stage_end:
+                            # Out of budget: end the reply with what has been said so far
+                            record_exceeded("llm")
+                            llm_span.set(truncated=True)
+                            if first_token:
+                                yield "Sorry, I'm taking too long to think right now."
+                            break
+        except (asyncio.TimeoutError, httpx.TimeoutException) as e:
+            # No slot, or no token, within the budget
+            record_exceeded("llm")
+            llm_span.set(truncated=True)
+            if first_token:
+                llm_span.end(e)
+                yield "Sorry, I'm taking too long to think right now."
+        except Exception as e:
+            logger.error("Error streaming from LLM service: %s", e)
+            llm_span.end(e)
+            yield "Sorry, I encountered an error while processing your request."
+        finally:
+            llm_span.end()
+            
+    async def embed(self, text: str, model: str) -> List[float]:
+        """
+        Embed text with an Ollama embedding model, waiting for an LLM slot at the caller's priority.
+        
+        Args:
+            text: Text to embed
+            model: Embedding model, e.g. nomic-embed-text
+            
+        Returns:
+            The embedding vector
+            
+        Raises:
+            httpx.HTTPError: If Ollama can't be reached or answers with an error status
+        """
+        with span("llm.embed", model=model, chars=len(text)):
+            async with scheduler.slot("llm"), httpx.AsyncClient(timeout=30.0) as client:
                 response = await client.post(
-                    f"{self.ollama_url}/api/generate",
-                    json=payload
+                    f"{self.ollama_url}/api/embeddings",
+                    json={"model": model, "prompt": text}
                 )
-                print(f"Received response with status code {response.status_code}")
-                
-                if response.status_code != 200:
-                    print(f"LLM Error: Status {response.status_code}, Response: {response.text}")
-                    return "Sorry, I'm having trouble thinking right now."
-                
-                print("Parsing JSON response...")
-                result = response.json()
-                # generate endpoint returns 'response' field directly
-                content = result.get("response", "")
-                print(f"Got content of length: {len(content)}")
-                return content
-                
-        except Exception as e:
-            print(f"Error in LLM service: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return "Sorry, I encountered an error while processing your request."
+            response.raise_for_status()
+            return response.json()["embedding"]
+            
+    @staticmethod
+    def _build_prompt(prompt: str, system_prompt: str, history: Optional[Sequence[Message]]) -> str:
+        full_prompt = ""
+        if system_prompt:
+            full_prompt = f"{system_prompt}\n\n"
+        if not history:
+            return full_prompt + prompt
+        # Earlier turns as a transcript, ending where the model should reply
+        for message in history:
+            speaker = "User" if message.role == USER else "Assistant"
+            full_prompt += f"{speaker}: {message.text}\n"
+        return full_prompt + f"User: {prompt}\nAssistant:"
+        
+    async def warm_up(self, model: Optional[str] = None) -> float:
+        """
+        Load a model into Ollama's memory, so the first turn doesn't pay the load time.
+        
+        Args:
+            model: Model to load (defaults to the current model)
+            
+        Returns:
+            Seconds Ollama spent loading the model (0 if it was already loaded)
+        """
+        # A generate request without a prompt only loads the model
+        async with httpx.AsyncClient(timeout=300.0) as client:
+            response = await client.post(
+                f"{self.ollama_url}/api/generate",
+                json={"model": model or self.current_model, "prompt": "", "stream": False}
+            )
+            response.raise_for_status()
+            return response.json().get("load_duration", 0) / 1e9
+            
+    def model_label(self, model: Optional[str]) -> str:
+        """Metric label for a model: its name if installed or configured, else "other"."""
+        if model and (model in self.known_models or model in (self.current_model, self.default_model)):
+            return model
+        return "other"
+
+    def _observe_generation_speed(self, result: Dict[str, Any], model: str) -> None:
+        """Record tokens per second from Ollama's final response statistics."""
+        eval_count = result.get("eval_count")
+        eval_duration = result.get("eval_duration")
+        if eval_count and eval_duration:
+            LLM_TOKENS_PER_SECOND.observe(eval_count / (eval_duration / 1e9), model=self.model_label(model))
+            
+    @staticmethod
+    def _annotate_span(llm_span: Span, result: Dict[str, Any]) -> None:
+        """Split the LLM span into load, prefill and generation time from Ollama's statistics."""
+        for field, attribute in (("load_duration", "load_ms"),
+                                 ("prompt_eval_duration", "prefill_ms"),
+                                 ("eval_duration", "generation_ms")):
+            if result.get(field):
+                llm_span.set(**{attribute: round(result[field] / 1e6, 1)})
+        llm_span.set(prompt_tokens=result.get("prompt_eval_count"), output_tokens=result.get("eval_count"))
             
     async def get_available_models(self) -> List[str]:
         """
@@ -90,17 +337,33 @@ class LLMService:
             List of model names
         """
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(f"{self.ollama_url}/api/tags")
-                print(f"{self.ollama_url}/api/tags")
-                if response.status_code != 200:
-                    return [self.default_model]
-                    
-                result = response.json()
-                print(f"Available modelssss: {result.get('models', [])}")
-                models = [model.get("name") for model in result.get("models", [])]
-                return models if models else [self.default_model]
+            models = [model.get("name") for model in await self.list_models()]
+            return models if models else [self.default_model]
                 
         except Exception as e:
-            print(f"Error getting available models: {str(e)}")
+            logger.error("Error getting available models: %s", e)
             return [self.default_model]
+            
+    async def list_models(self) -> List[Dict[str, Any]]:
+        """
+        Get details of the models installed in Ollama (/api/tags).
+        
+        Returns:
+            List of model entries with name, size and details
+        """
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.get(f"{self.ollama_url}/api/tags")
+            response.raise_for_status()
+            return response.json().get("models", [])
+            
+    async def list_running_models(self) -> List[Dict[str, Any]]:
+        """
+        Get the models currently loaded in Ollama's memory (/api/ps).
+        
+        Returns:
+            List of loaded model entries with size_vram and expires_at
+        """
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.get(f"{self.ollama_url}/api/ps")
+            response.raise_for_status()
+            return response.json().get("models", [])
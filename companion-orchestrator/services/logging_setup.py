@@ -0,0 +1,171 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from typing import Dict, Optional
+
+from services.metrics import REGISTRY
+
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "companion_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# httpx logs every request at INFO, which is noise on the LLM/TTS hot path
+DEFAULT_LOGGER_LEVELS = {"httpx": "WARNING"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including any fields passed via `extra`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records from high-volume loggers.
+
+    Sampling is deterministic (every Nth record per logger), so a rate of 0.1
+    keeps exactly one record in ten. Records at INFO and above always pass.
+    """
+
+    def __init__(self, rates: Dict[str, float], default_rate: float = 1.0):
+        super().__init__()
+        self.rates = rates
+        self.default_rate = default_rate
+        self._counts: Dict[str, int] = {}
+
+    def _rate_for(self, name: str) -> float:
+        # Most specific configured logger wins, e.g. "services.stt_service" over "services"
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return self.default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        count = self._counts.get(record.name, 0)
+        self._counts[record.name] = count + 1
+        return count % round(1 / rate) == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hand records to the writer thread without blocking the caller.
+
+    Only the message is interpolated here (so mutable arguments are captured
+    as they were); JSON encoding and the stream write happen on the writer
+    thread. When the queue is full the record is dropped and counted.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks reference frames, so render them before they go away
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+def _parse_mapping(value: str) -> Dict[str, str]:
+    """Parse "name=value,name=value" into a dict."""
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, _, setting = item.partition("=")
+            mapping[name.strip()] = setting.strip()
+    return mapping
+
+
+def configure_logging() -> None:
+    """
+    Route all logging through a queue to a background writer thread.
+
+    Configured from the environment:
+        LOG_LEVEL: Root level (default INFO)
+        LOG_LEVELS: Per-logger levels, e.g. "services.stt_service=DEBUG,httpx=WARNING"
+        LOG_FORMAT: "json" (default) or "text"
+        LOG_SAMPLE_RATES: Fraction of DEBUG records kept per logger, e.g. "services.llm_service=0.1"
+        LOG_QUEUE_SIZE: Records buffered before new ones are dropped (default 10000)
+
+    Safe to call more than once; later calls are ignored.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    root = logging.getLogger()
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # Levels are set on the loggers themselves, so disabled calls return
+    # before a record is even created
+    levels = dict(DEFAULT_LOGGER_LEVELS, **_parse_mapping(os.getenv("LOG_LEVELS", "")))
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        stream_handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    else:
+        stream_handler.setFormatter(JSONFormatter())
+
+    rates = {name: float(rate) for name, rate in
+             _parse_mapping(os.getenv("LOG_SAMPLE_RATES", "")).items()}
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(rates))
+
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    # Uvicorn installs its own synchronous stdout handlers; send its records
+    # (including the access log) through the queue as well
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        listener.stop()
+
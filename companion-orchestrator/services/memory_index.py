@@ -0,0 +1,368 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single worker, nothing to lock against
+    fcntl = None
+
+from services.metrics import REGISTRY
+from services.scheduler import BATCH, priority
+
+logger = logging.getLogger(__name__)
+
+MEMORY_SEARCH_SECONDS = REGISTRY.histogram(
+    "companion_memory_search_seconds", "Time to score a user's memories against a prompt",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+MEMORY_SEARCH_VECTORS = REGISTRY.histogram(
+    "companion_memory_search_vectors", "Memories scored per search",
+    buckets=(10, 100, 1000, 5000, 10000, 25000, 50000, 100000))
+MEMORY_VECTORS = REGISTRY.gauge(
+    "companion_memory_index_vectors", "Memories stored for all users")
+MEMORY_INDEX_BYTES = REGISTRY.gauge(
+    "companion_memory_index_bytes", "Size of the memory index files on disk")
+
+EmbedFunction = Callable[[str], Awaitable[List[float]]]
+
+
+class Memory:
+    """A remembered message and how well it matches the prompt it was retrieved for."""
+
+    __slots__ = ("text", "mode", "created_at", "score")
+
+    def __init__(self, text: str, mode: str, created_at: float, score: float):
+        self.text = text
+        self.mode = mode
+        self.created_at = created_at
+        self.score = score
+
+
+class _UserIndex:
+    __slots__ = ("directory", "vectors", "ids", "count", "sizes")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # Memory-mapped on first search, and again once the files have grown,
+        # whichever worker appended to them
+        self.vectors: Optional[np.ndarray] = None
+        self.ids: Optional[np.ndarray] = None
+        self.count = 0
+        self.sizes: Optional[Tuple[int, int]] = None
+
+
+class MemoryIndex:
+    """
+    Long-term memory: what each user said in past sessions, found by meaning.
+
+    Messages are embedded through Ollama in the background and appended to a
+    per-user matrix of unit-length float32 vectors on disk, next to a matching
+    array of row IDs; the texts live in SQLite under those IDs. A search
+    memory-maps the user's matrix and scores every row with one matrix-vector
+    product, so only the pages actually read stay resident and the index can
+    grow well beyond memory.
+
+    All file and database access runs on a single thread, in order.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 embed: EmbedFunction,
+                 model: str,
+                 top_k: int = 3,
+                 min_score: float = 0.5,
+                 min_chars: int = 20,
+                 max_open: int = 256,
+                 queue_size: int = 256):
+        """
+        Args:
+            directory: Where the index files and the text database live
+            embed: Coroutine function returning the embedding of a text
+            model: Name of the embedding model; each model gets its own index
+            top_k: Memories returned per search
+            min_score: Lowest cosine similarity of a returned memory
+            min_chars: Shorter messages ("ok", "thanks") are not remembered
+            max_open: User indexes kept memory-mapped at once
+            queue_size: Messages waiting to be embedded before new ones are dropped
+        """
+        self.directory = os.path.join(directory, re.sub(r"[^A-Za-z0-9_.-]", "_", model))
+        self.embed = embed
+        self.model = model
+        self.top_k = top_k
+        self.min_score = min_score
+        self.min_chars = min_chars
+        self.max_open = max_open
+        self.queue_size = queue_size
+        self.dimensions: Optional[int] = None
+
+        self._indexes: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-index")
+        self._connection: Optional[sqlite3.Connection] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._vectors = 0
+        self._bytes = 0
+
+    async def start(self) -> None:
+        await self._run(self._open)
+        MEMORY_VECTORS.set(self._vectors)
+        MEMORY_INDEX_BYTES.set(self._bytes)
+        if self._worker is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker = asyncio.create_task(self._embed_loop())
+
+    async def stop(self) -> None:
+        """Stop embedding (messages still queued are not remembered) and close the index."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+    def remember(self, user_id: str, mode: str, text: str, created_at: Optional[float] = None) -> None:
+        """
+        Queue a user's message to be embedded and stored in the background.
+
+        Args:
+            created_at: When the message was sent (default now); pass the time it
+                was recorded in the conversation history with, so the two match
+        """
+        text = text.strip()
+        if len(text) < self.min_chars or self._queue is None:
+            return
+        try:
+            self._queue.put_nowait((user_id, mode, text, time.time() if created_at is None else created_at))
+        except asyncio.QueueFull:
+            logger.warning("Memory queue is full, not remembering a message from %s", user_id)
+
+    async def search(self, user_id: str, text: str, limit: Optional[int] = None,
+                     before: Optional[float] = None) -> List[Memory]:
+        """
+        Find a user's memories most similar to a text.
+
+        Args:
+            user_id: Identifier for the user
+            text: Usually the user's new message
+            limit: Maximum memories returned (default top_k)
+            before: Only return memories stored before this time, e.g. to skip
+                messages already in the prompt's recent history
+
+        Returns:
+            Memories with a similarity of at least min_score, best first
+
+        Raises:
+            httpx.HTTPError: If the prompt can't be embedded
+        """
+        directory = self._user_directory(user_id)
+        if not os.path.exists(os.path.join(directory, "ids.i64")):
+            # Nothing remembered yet; don't pay for an embedding
+            return []
+        query = self._normalize(await self.embed(text))
+        memories, duration, scored = await self._run(self._search, user_id, query, limit or self.top_k, before)
+        if scored:
+            MEMORY_SEARCH_SECONDS.observe(duration)
+            MEMORY_SEARCH_VECTORS.observe(scored)
+        return memories
+
+    async def forget(self, user_id: str) -> None:
+        """Delete everything remembered about a user."""
+        await self._run(self._delete, user_id)
+        MEMORY_VECTORS.set(self._vectors)
+        MEMORY_INDEX_BYTES.set(self._bytes)
+
+    async def _embed_loop(self) -> None:
+        # Remembering is background work; conversations get the LLM slots first
+        with priority(BATCH):
+            while True:
+                user_id, mode, text, created_at = await self._queue.get()
+                try:
+                    vector = self._normalize(await self.embed(text))
+                    await self._run(self._append, user_id, mode, text, created_at, vector)
+                    MEMORY_VECTORS.set(self._vectors)
+                    MEMORY_INDEX_BYTES.set(self._bytes)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Could not remember a message from %s: %s", user_id, e)
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm else array
+
+    def _run(self, function, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    def _user_directory(self, user_id: str) -> str:
+        # Hashed, so any user_id is a safe directory name
+        return os.path.join(self.directory, hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32])
+
+    # The methods below run on the index's thread
+
+    def _open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_meta()
+        self._connection = sqlite3.connect(os.path.join(self.directory, "memories.sqlite3"),
+                                           check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS memories ("
+            " id INTEGER PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " mode TEXT NOT NULL,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._connection.commit()
+        self._vectors = self._connection.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+        self._bytes = sum(entry.stat().st_size
+                          for user in os.scandir(self.directory) if user.is_dir()
+                          for entry in os.scandir(user.path) if entry.is_file())
+
+    def _load_meta(self) -> None:
+        meta_path = os.path.join(self.directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.dimensions = json.load(f)["dimensions"]
+
+    def _close(self) -> None:
+        self._indexes.clear()
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _index(self, user_id: str) -> _UserIndex:
+        index = self._indexes.get(user_id)
+        if index is None:
+            index = _UserIndex(self._user_directory(user_id))
+            self._indexes[user_id] = index
+            while len(self._indexes) > self.max_open:
+                self._indexes.popitem(last=False)
+        else:
+            self._indexes.move_to_end(user_id)
+        return index
+
+    @staticmethod
+    def _file_sizes(index: _UserIndex) -> Optional[Tuple[int, int]]:
+        try:
+            return (os.path.getsize(os.path.join(index.directory, "vectors.f32")),
+                    os.path.getsize(os.path.join(index.directory, "ids.i64")))
+        except FileNotFoundError:
+            # Forgotten, possibly by another worker
+            return None
+
+    def _map(self, index: _UserIndex, sizes: Optional[Tuple[int, int]]) -> None:
+        vectors_path = os.path.join(index.directory, "vectors.f32")
+        ids_path = os.path.join(index.directory, "ids.i64")
+        index.sizes = sizes
+        index.vectors = index.ids = None
+        # An append in progress, or a crash between the two writes, can leave
+        # one file longer; rows before that are complete, and the next append
+        # cuts the files back to them
+        count = min(sizes[0] // (4 * self.dimensions), sizes[1] // 8) if sizes else 0
+        index.count = count
+        if count:
+            index.vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(count, self.dimensions))
+            index.ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(count,))
+
+    def _search(self, user_id: str, query: np.ndarray, limit: int,
+                before: Optional[float]) -> Tuple[List[Memory], float, int]:
+        if self.dimensions is None:
+            # The first memory may have been stored by another worker
+            self._load_meta()
+        if self.dimensions is None or query.shape[0] != self.dimensions:
+            return [], 0.0, 0
+        index = self._index(user_id)
+        sizes = self._file_sizes(index)
+        if sizes != index.sizes:
+            self._map(index, sizes)
+        if not index.count:
+            return [], 0.0, 0
+
+        started = time.perf_counter()
+        scores = index.vectors @ query
+        # Extra candidates make up for the ones filtered out by time
+        candidates = min(index.count, limit * 4)
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top])]
+        top = top[scores[top] >= self.min_score]
+        duration = time.perf_counter() - started
+        if not len(top):
+            return [], duration, index.count
+
+        ids = [int(memory_id) for memory_id in index.ids[top]]
+        rows = {row[0]: row[1:] for row in self._connection.execute(
+            f"SELECT id, text, mode, created_at FROM memories WHERE id IN ({','.join('?' * len(ids))})", ids)}
+        memories = []
+        for memory_id, score in zip(ids, scores[top]):
+            row = rows.get(memory_id)
+            if row is None or (before is not None and row[2] >= before):
+                continue
+            memories.append(Memory(row[0], row[1], row[2], float(score)))
+            if len(memories) == limit:
+                break
+        return memories, duration, index.count
+
+    def _append(self, user_id: str, mode: str, text: str, created_at: float, vector: np.ndarray) -> None:
+        if self.dimensions is None:
+            self.dimensions = int(vector.shape[0])
+            with open(os.path.join(self.directory, "meta.json"), "w") as f:
+                json.dump({"model": self.model, "dimensions": self.dimensions}, f)
+        elif vector.shape[0] != self.dimensions:
+            raise ValueError(f"Embedding has {vector.shape[0]} dimensions, the index {self.dimensions}")
+
+        with self._connection:
+            memory_id = self._connection.execute(
+                "INSERT INTO memories (user_id, mode, text, created_at) VALUES (?, ?, ?, ?)",
+                (user_id, mode, text, created_at)).lastrowid
+        index = self._index(user_id)
+        os.makedirs(index.directory, exist_ok=True)
+        # Workers sharing the directory take turns, so rows and ids stay aligned
+        with open(os.path.join(index.directory, "append.lock"), "ab") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self._repair(index)
+            with open(os.path.join(index.directory, "vectors.f32"), "ab") as f:
+                f.write(vector.astype(np.float32).tobytes())
+            with open(os.path.join(index.directory, "ids.i64"), "ab") as f:
+                f.write(np.int64(memory_id).tobytes())
+        self._vectors += 1
+        self._bytes += vector.shape[0] * 4 + 8
+
+    def _repair(self, index: _UserIndex) -> None:
+        """
+        Cut both files back to their last complete row, so a torn write left
+        by a crash doesn't shift every later row against its id.
+        """
+        sizes = self._file_sizes(index)
+        if sizes is None:
+            return
+        count = min(sizes[0] // (4 * self.dimensions), sizes[1] // 8)
+        for name, size in (("vectors.f32", count * 4 * self.dimensions), ("ids.i64", count * 8)):
+            path = os.path.join(index.directory, name)
+            if os.path.getsize(path) != size:
+                logger.warning("Truncating %s of a memory index to %d complete rows", name, count)
+                os.truncate(path, size)
+
+    def _delete(self, user_id: str) -> None:
+        with self._connection:
+            deleted = self._connection.execute("DELETE FROM memories WHERE user_id = ?", (user_id,)).rowcount
+        self._indexes.pop(user_id, None)
+        directory = self._user_directory(user_id)
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                self._bytes -= entry.stat().st_size
+                os.unlink(entry.path)
+            os.rmdir(directory)
+        self._vectors -= deleted
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from services.llm_service import LLMService
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRecord:
+    """Cached metadata for one Ollama model."""
+
+    __slots__ = ("name", "display_name", "size", "parameter_size", "quantization",
+                 "family", "loaded", "size_vram", "expires_at")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.display_name = display_name_for(name)
+        self.size: Optional[int] = None
+        self.parameter_size: Optional[str] = None
+        self.quantization: Optional[str] = None
+        self.family: Optional[str] = None
+        self.loaded = False
+        self.size_vram: Optional[int] = None
+        self.expires_at: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+def display_name_for(model_id: str) -> str:
+    """Format a model ID for display, e.g. "tiny_llama:1b" -> "Tiny Llama (1b)"."""
+    # Format display name (capitalize and remove special chars)
+    display_name = model_id.split(":")[0].replace("_", " ").title()
+    if ":" in model_id:
+        # Add version info if present
+        display_name += f" ({model_id.split(':')[1]})"
+    return display_name
+
+
+class ModelRegistry:
+    """
+    Cached view of Ollama's installed and loaded models.
+
+    /api/tags and /api/ps are refreshed in the background every `ttl` seconds,
+    so request handlers can look up model metadata and residency without
+    calling Ollama.
+    """
+
+    def __init__(self, llm_service: LLMService, ttl: float = 30.0,
+                 fallback_models: Optional[List[str]] = None):
+        """
+        Args:
+            llm_service: Service used to query Ollama
+            ttl: Seconds between background refreshes
+            fallback_models: Models to list if Ollama can't be reached at startup
+        """
+        self.llm_service = llm_service
+        self.ttl = ttl
+        self.fallback_models = fallback_models or []
+        self.refreshed_at: Optional[float] = None
+        self._records: Dict[str, ModelRecord] = {}
+        self._refresher: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Load the model list and start refreshing it in the background."""
+        if not await self.refresh() and not self._records:
+            logger.warning("Using fallback model list: %s", self.fallback_models)
+            self._records = {name: ModelRecord(name) for name in self.fallback_models}
+            self.llm_service.known_models = set(self._records)
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    async def refresh(self) -> bool:
+        """
+        Reload model metadata and residency from Ollama.
+
+        Returns:
+            True if the installed model list was refreshed
+        """
+        tags, running = await asyncio.gather(
+            self.llm_service.list_models(),
+            self.llm_service.list_running_models(),
+            return_exceptions=True
+        )
+        if isinstance(tags, Exception):
+            logger.warning("Could not refresh model list: %s", tags)
+            return False
+
+        records = {}
+        for entry in tags:
+            name = entry.get("name")
+            if not name:
+                continue
+            record = ModelRecord(name)
+            details = entry.get("details") or {}
+            record.size = entry.get("size")
+            record.parameter_size = details.get("parameter_size")
+            record.quantization = details.get("quantization_level")
+            record.family = details.get("family")
+            records[name] = record
+
+        if isinstance(running, Exception):
+            logger.warning("Could not refresh loaded models: %s", running)
+            # Keep the last known residency rather than reporting nothing loaded
+            for name, record in records.items():
+                previous = self._records.get(name)
+                if previous is not None:
+                    record.loaded = previous.loaded
+                    record.size_vram = previous.size_vram
+                    record.expires_at = previous.expires_at
+        else:
+            for entry in running:
+                record = records.get(entry.get("name") or entry.get("model"))
+                if record is not None:
+                    record.loaded = True
+                    record.size_vram = entry.get("size_vram")
+                    record.expires_at = entry.get("expires_at")
+
+        self._records = records
+        self.llm_service.known_models = set(records)
+        self.refreshed_at = time.time()
+        return True
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Error refreshing model registry: %s", e)
+
+    def names(self) -> List[str]:
+        return list(self._records)
+
+    def records(self) -> List[ModelRecord]:
+        return list(self._records.values())
+
+    def get(self, name: str) -> Optional[ModelRecord]:
+        return self._records.get(name)
+
+    def is_loaded(self, name: str) -> bool:
+        record = self._records.get(name)
+        return record is not None and record.loaded
+
+    def smallest(self) -> Optional[str]:
+        """
+        The installed model with the smallest size on disk, favouring loaded ones on ties.
+
+        Returns:
+            Model name, or None if no model sizes are known
+        """
+        sized = [record for record in self._records.values() if record.size]
+        if not sized:
+            return None
+        return min(sized, key=lambda record: (record.size, not record.loaded)).name
+
+    def prefer_loaded(self, candidates: List[str]) -> Optional[str]:
+        """
+        Pick a model from candidates, favouring ones already resident in Ollama.
+
+        Args:
+            candidates: Model names in order of preference
+
+        Returns:
+            The first loaded candidate, else the first installed one, else None
+        """
+        installed = [name for name in candidates if name in self._records]
+        for name in installed:
+            if self._records[name].loaded:
+                return name
+        return installed[0] if installed else None
+
+    def resolve(self, *candidates: Optional[str]) -> Optional[str]:
+        """
+        The model to use for a turn: the first candidate that is installed.
+
+        When none of them is (e.g. a session still names a deleted model), an
+        installed model already loaded in Ollama is used rather than one that
+        would have to be loaded first.
+
+        Args:
+            candidates: Model names in order of preference; None entries are skipped
+
+        Returns:
+            Model name; the first candidate if no model list is known yet
+        """
+        named = [name for name in candidates if name]
+        if not self._records:
+            return named[0] if named else None
+        for name in named:
+            if name in self._records:
+                return name
+        choice = self.prefer_loaded(self.names())
+        logger.warning("Models %s are not installed, using %s", named, choice)
+        return choice
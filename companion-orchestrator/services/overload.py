@@ -0,0 +1,219 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Sequence
+
+from services.metrics import REGISTRY, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Degradation levels
+NORMAL = 0
+REDUCED_TOKENS = 1
+ESSENTIAL = 2
+SHEDDING = 3
+LEVEL_NAMES = ("normal", "reduced_tokens", "essential", "shedding")
+
+OVERLOAD_LEVEL = REGISTRY.gauge(
+    "companion_overload_level", "Current degradation level (0 normal, 1 fewer tokens, 2 essential, 3 shedding)")
+OVERLOAD_PRESSURE = REGISTRY.gauge(
+    "companion_overload_pressure", "Load relative to capacity; 1.0 means at the configured limits")
+SHED_REQUESTS = REGISTRY.counter(
+    "companion_shed_requests_total", "Requests rejected with 503 because of overload", ["endpoint"])
+DEGRADED_TURNS = REGISTRY.counter(
+    "companion_degraded_turns_total", "Turns served with reduced tokens, a smaller model or no audio", ["endpoint"])
+
+
+class Overloaded(Exception):
+    """Raised when a low-priority request is shed."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is overloaded, please retry later")
+        self.retry_after = retry_after
+
+
+class TurnPolicy:
+    """How a single turn should be served at the current load."""
+
+    __slots__ = ("level", "max_tokens", "model", "allow_audio")
+
+    def __init__(self, level: int, max_tokens: int, model: Optional[str] = None, allow_audio: bool = True):
+        self.level = level
+        self.max_tokens = max_tokens
+        # Model to use instead of the session's, if any
+        self.model = model
+        self.allow_audio = allow_audio
+
+    @property
+    def degraded(self) -> bool:
+        return self.level > NORMAL
+
+
+class LatencySignal:
+    """Recent mean of a histogram, relative to a target latency."""
+
+    def __init__(self, histogram: Histogram, target: float, labels: Optional[Dict[str, str]] = None,
+                 smoothing: float = 0.3):
+        """
+        Args:
+            histogram: Histogram whose new observations are averaged
+            target: Mean latency in seconds that counts as full load
+            labels: Label values selecting the series to follow
+            smoothing: Weight of the newest interval in the moving average
+        """
+        self.histogram = histogram
+        self.target = target
+        self.labels = labels or {}
+        self.smoothing = smoothing
+        self.mean = 0.0
+        self._last = histogram.totals(**self.labels)
+
+    def sample(self) -> None:
+        total, count = self.histogram.totals(**self.labels)
+        last_total, last_count = self._last
+        self._last = (total, count)
+        # Without new observations the average decays, so an idle stage recovers
+        recent = (total - last_total) / (count - last_count) if count > last_count else 0.0
+        self.mean += self.smoothing * (recent - self.mean)
+
+    @property
+    def pressure(self) -> float:
+        return self.mean / self.target if self.target > 0 else 0.0
+
+
+class OverloadController:
+    """
+    Degrade service progressively as load rises, instead of slowing down every request.
+
+    Pressure is the highest of: turns in flight relative to max_inflight,
+    the audio job backlog, and recent LLM and TTS latency relative to their
+    targets. As it crosses each threshold:
+
+    1. max_tokens is lowered, in proportion to how far past the threshold load is
+    2. voice turns switch to a smaller model and text turns lose audio
+    3. low-priority (text) turns are shed with 503 and a Retry-After hint
+
+    Levels go back down only once pressure is `hysteresis` below a threshold,
+    so the service doesn't flap between levels.
+    """
+
+    def __init__(self,
+                 max_inflight: int = 32,
+                 latency_signals: Sequence[LatencySignal] = (),
+                 backlog: Optional[Callable[[], float]] = None,
+                 thresholds: Sequence[float] = (0.7, 1.0, 1.5),
+                 hysteresis: float = 0.1,
+                 max_tokens: int = 500,
+                 min_tokens: int = 96,
+                 fallback_model: Optional[Callable[[], Optional[str]]] = None,
+                 retry_after: int = 5,
+                 interval: float = 1.0):
+        """
+        Args:
+            max_inflight: Concurrent turns that count as full load
+            latency_signals: Stage latencies contributing to pressure
+            backlog: Returns the fill level (0-1) of a background work queue
+            thresholds: Pressure at which levels 1, 2 and 3 start
+            hysteresis: How far below a threshold pressure must fall to leave its level
+            max_tokens: Tokens per reply at normal load
+            min_tokens: Tokens per reply at level 2 and above
+            fallback_model: Returns the smaller model for voice turns at level 2
+            retry_after: Seconds clients are told to wait when shed
+            interval: Seconds between latency samples
+        """
+        self.max_inflight = max_inflight
+        self.latency_signals = list(latency_signals)
+        self.backlog = backlog
+        self.thresholds = tuple(thresholds)
+        self.hysteresis = hysteresis
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.fallback_model = fallback_model
+        self.retry_after = retry_after
+        self.interval = interval
+        self.inflight = 0
+        self.level = NORMAL
+        self._sampler: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._sampler is None:
+            self._sampler = asyncio.create_task(self._sample_loop())
+
+    async def stop(self) -> None:
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+
+    async def _sample_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for signal in self.latency_signals:
+                signal.sample()
+            self._update_level()
+
+    def pressure(self) -> float:
+        pressures = [self.inflight / self.max_inflight if self.max_inflight else 0.0]
+        pressures.extend(signal.pressure for signal in self.latency_signals)
+        if self.backlog is not None:
+            pressures.append(self.backlog())
+        return max(pressures)
+
+    def _update_level(self) -> float:
+        pressure = self.pressure()
+        level = sum(1 for threshold in self.thresholds if pressure >= threshold)
+        while level < self.level and pressure >= self.thresholds[level] - self.hysteresis:
+            level += 1
+        if level != self.level:
+            logger.warning("Overload level %s -> %s (pressure %.2f)",
+                           LEVEL_NAMES[self.level], LEVEL_NAMES[level], pressure)
+            self.level = level
+        OVERLOAD_LEVEL.set(level)
+        OVERLOAD_PRESSURE.set(round(pressure, 3))
+        return pressure
+
+    def policy(self, voice: bool = False) -> TurnPolicy:
+        """
+        Decide how to serve a turn at the current load.
+
+        Args:
+            voice: Whether this is a voice turn, which is never shed and keeps its audio
+
+        Returns:
+            The turn's policy
+
+        Raises:
+            Overloaded: If the turn should be shed
+        """
+        pressure = self._update_level()
+        if self.level >= SHEDDING and not voice:
+            raise Overloaded(self.retry_after)
+        if self.level == NORMAL:
+            return TurnPolicy(NORMAL, self.max_tokens)
+        if self.level == REDUCED_TOKENS:
+            low, high = self.thresholds[0], self.thresholds[1]
+            fraction = min(max((pressure - low) / (high - low), 0.0), 1.0)
+            tokens = int(self.max_tokens - fraction * (self.max_tokens - self.min_tokens))
+            return TurnPolicy(REDUCED_TOKENS, tokens)
+        model = self.fallback_model() if voice and self.fallback_model is not None else None
+        return TurnPolicy(self.level, self.min_tokens, model=model, allow_audio=voice)
+
+    @contextmanager
+    def turn(self, endpoint: str, voice: bool = False) -> Iterator[TurnPolicy]:
+        """
+        Admit a turn and count it as in flight while the block runs.
+
+        Raises:
+            Overloaded: If the turn should be shed
+        """
+        try:
+            policy = self.policy(voice)
+        except Overloaded:
+            SHED_REQUESTS.inc(endpoint=endpoint)
+            raise
+        if policy.degraded:
+            DEGRADED_TURNS.inc(endpoint=endpoint)
+        self.inflight += 1
+        try:
+            yield policy
+        finally:
+            self.inflight -= 1
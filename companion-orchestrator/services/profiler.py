@@ -0,0 +1,177 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List
+
+# Leaf functions of a thread that is waiting rather than running Python code
+IDLE_FUNCTIONS = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the live process.
+
+    A background thread periodically reads the stack of every other thread
+    via sys._current_frames() and counts identical stacks. The profiled code
+    is not instrumented, so overhead is limited to the sampling itself.
+    Output is in the collapsed-stack format read by flamegraph.pl and
+    speedscope: one "frame;frame;frame count" line per distinct stack.
+    """
+
+    def __init__(self):
+        self.running = False
+
+    async def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> Dict[str, Any]:
+        """
+        Sample all threads for a while.
+
+        Args:
+            seconds: How long to sample
+            interval: Seconds between samples
+            include_idle: Keep samples of threads waiting in select(), locks or queues
+
+        Returns:
+            Dict with "collapsed" (the stacks as text), "samples" and "duration"
+
+        Raises:
+            RuntimeError: If a profile is already running
+        """
+        if self.running:
+            raise RuntimeError("A profile is already running")
+        self.running = True
+        try:
+            stacks: Counter = Counter()
+            stop = threading.Event()
+            sampler = threading.Thread(target=self._sample, args=(stacks, stop, interval, include_idle),
+                                       name="sampling-profiler", daemon=True)
+            started = time.perf_counter()
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                stop.set()
+                await asyncio.to_thread(sampler.join)
+            collapsed = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+            return {
+                "collapsed": collapsed + "\n" if collapsed else "",
+                "samples": sum(stacks.values()),
+                "duration": time.perf_counter() - started,
+            }
+        finally:
+            self.running = False
+
+    @staticmethod
+    def _sample(stacks: Counter, stop: threading.Event, interval: float, include_idle: bool) -> None:
+        own_id = threading.get_ident()
+        names = {}
+        while not stop.wait(interval):
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if not include_idle and (os.path.basename(frame.f_code.co_filename),
+                                         frame.f_code.co_name) in IDLE_FUNCTIONS:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, f"thread-{thread_id}"))
+                labels.reverse()
+                stacks[";".join(labels)] += 1
+
+
+class AllocationTracker:
+    """Report which code allocated the memory still alive after a tracing window, using tracemalloc."""
+
+    def __init__(self):
+        self.running = False
+
+    async def snapshot(self, seconds: float, limit: int = 20, frames: int = 1) -> Dict[str, Any]:
+        """
+        Trace allocations for a while and summarize them.
+
+        If tracemalloc is already tracing (e.g. PYTHONTRACEMALLOC is set),
+        the snapshot covers everything traced so far; otherwise tracing runs
+        only for the window, which slows allocation-heavy code while it lasts.
+
+        Args:
+            seconds: How long to trace when tracing isn't already on
+            limit: Number of top allocation sites to return
+            frames: Stack depth per allocation site; 1 groups by line
+
+        Returns:
+            Dict with "top_by_size", "top_by_count" and tracemalloc's current/peak totals
+
+        Raises:
+            RuntimeError: If a snapshot is already running
+        """
+        if self.running:
+            raise RuntimeError("An allocation snapshot is already running")
+        self.running = True
+        try:
+            started_here = not tracemalloc.is_tracing()
+            if started_here:
+                tracemalloc.start(frames)
+            try:
+                if started_here:
+                    await asyncio.sleep(seconds)
+                snapshot = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+            finally:
+                if started_here:
+                    tracemalloc.stop()
+        finally:
+            self.running = False
+
+        def summarize() -> Dict[str, Any]:
+            filtered = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            ))
+            key_type = "traceback" if frames > 1 else "lineno"
+            statistics = filtered.statistics(key_type)
+            return {
+                "top_by_size": [self._stat_dict(stat) for stat in statistics[:limit]],
+                "top_by_count": [self._stat_dict(stat) for stat in
+                                 sorted(statistics, key=lambda stat: stat.count, reverse=True)[:limit]],
+            }
+
+        # Grouping a large snapshot takes a while; keep it off the event loop
+        result = await asyncio.to_thread(summarize)
+        result.update({
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "window_seconds": seconds if started_here else None,
+        })
+        return result
+
+    @staticmethod
+    def _stat_dict(stat: tracemalloc.Statistic) -> Dict[str, Any]:
+        # Oldest call first; the allocating line is last
+        frames: List[str] = [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback]
+        return {
+            "site": frames[-1] if frames else None,
+            "traceback": frames if len(frames) > 1 else None,
+            "size_bytes": stat.size,
+            "count": stat.count,
+            "average_bytes": stat.size // stat.count if stat.count else 0,
+        }
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+OK = "ok"
+FAILED = "failed"
+
+CheckFunction = Callable[[], Awaitable[Any]]
+
+
+class DependencyCheck:
+    """Startup probe or warm-up for one downstream dependency."""
+
+    __slots__ = ("name", "check", "required", "status", "detail", "error", "duration", "attempts")
+
+    def __init__(self, name: str, check: CheckFunction, required: bool = True):
+        self.name = name
+        self.check = check
+        self.required = required
+        self.status = PENDING
+        self.detail: Any = None
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+        self.attempts = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {"status": self.status, "required": self.required, "attempts": self.attempts}
+        if self.duration is not None:
+            result["duration_ms"] = round(self.duration * 1000, 1)
+        if self.detail is not None:
+            result["detail"] = self.detail
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+class ReadinessTracker:
+    """
+    Run dependency checks concurrently at startup and report readiness.
+
+    Startup waits for the checks up to a deadline and then carries on, so a
+    slow dependency can't hold the server hostage; unfinished checks keep
+    running and failed ones are retried in the background until they pass.
+    The instance is ready once every required check has passed.
+    """
+
+    def __init__(self, retry_interval: float = 5.0):
+        """
+        Args:
+            retry_interval: Seconds between retries of a failed check
+        """
+        self.retry_interval = retry_interval
+        self.checks: Dict[str, DependencyCheck] = {}
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, name: str, check: CheckFunction, required: bool = True) -> None:
+        """
+        Register a check.
+
+        Args:
+            name: Dependency name shown by /ready
+            check: Coroutine function that raises if the dependency isn't usable;
+                its return value is reported as the check's detail
+            required: Whether readiness waits for this check
+        """
+        self.checks[name] = DependencyCheck(name, check, required)
+
+    @property
+    def ready(self) -> bool:
+        return all(check.status == OK for check in self.checks.values() if check.required)
+
+    async def start(self, deadline: float) -> bool:
+        """
+        Run all checks concurrently, waiting at most `deadline` seconds.
+
+        Returns:
+            True if the instance was ready by the deadline
+        """
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._run(check)) for check in self.checks.values()]
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=deadline)
+        if not self.ready:
+            waiting = [name for name, check in self.checks.items() if check.required and check.status != OK]
+            logger.warning("Startup deadline of %.0fs passed; still waiting for: %s", deadline, ", ".join(waiting))
+        return self.ready
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _run(self, check: DependencyCheck) -> None:
+        while True:
+            check.attempts += 1
+            started = time.monotonic()
+            try:
+                check.detail = await check.check()
+                check.status = OK
+                check.error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                check.status = FAILED
+                check.error = f"{type(e).__name__}: {e}"
+            check.duration = time.monotonic() - started
+
+            if check.status == OK:
+                if self.ready and self.ready_at is None:
+                    self.ready_at = time.monotonic()
+                    logger.info("Ready after %.2fs", self.ready_at - self.started_at)
+                return
+            if check.attempts == 1:
+                logger.warning("Startup check %s failed, retrying: %s", check.name, check.error)
+            await asyncio.sleep(self.retry_interval)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "startup_seconds": round(self.ready_at - self.started_at, 3)
+            if self.ready_at is not None and self.started_at is not None else None,
+            "dependencies": {name: check.to_dict() for name, check in self.checks.items()},
+        }
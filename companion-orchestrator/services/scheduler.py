@@ -0,0 +1,247 @@
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+
+from services.metrics import REGISTRY
+from services.tracing import current_span
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, highest first
+VOICE = 0
+TEXT = 1
+BATCH = 2
+PRIORITY_NAMES = ("voice", "text", "batch")
+
+SCHEDULER_WAIT = REGISTRY.histogram(
+    "companion_scheduler_wait_seconds", "Time calls waited for a backend slot",
+    ["resource", "priority"], buckets=(0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+SCHEDULER_QUEUED = REGISTRY.gauge(
+    "companion_scheduler_queued", "Calls waiting for a backend slot", ["resource", "priority"])
+SCHEDULER_ACTIVE = REGISTRY.gauge(
+    "companion_scheduler_active", "Backend calls in progress", ["resource"])
+
+_current_priority: "contextvars.ContextVar[int]" = contextvars.ContextVar("priority", default=TEXT)
+
+
+def current_priority() -> int:
+    return _current_priority.get()
+
+
+@contextmanager
+def priority(level: int) -> Iterator[None]:
+    """Tag the LLM, TTS and STT calls made inside the block with a priority class."""
+    token = _current_priority.set(level)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def parse_priority(name: str) -> int:
+    """
+    Look up a priority class by name.
+
+    Raises:
+        ValueError: If the name is not "voice", "text" or "batch"
+    """
+    try:
+        return PRIORITY_NAMES.index(name.strip().lower())
+    except ValueError:
+        raise ValueError(f"Unknown priority '{name}', expected one of: {', '.join(PRIORITY_NAMES)}") from None
+
+
+class ResourceScheduler:
+    """
+    Concurrency limit for one backend, granting free slots by priority class.
+
+    Waiting calls of a higher class always go first, except that batch calls
+    get at least `batch_share` of the slots handed out while they wait, so a
+    steady stream of interactive traffic can't starve them entirely. Batch
+    calls never hold more than `batch_max` slots, so the rest stay free for
+    voice and text turns even while a long batch job keeps the backend busy.
+    """
+
+    def __init__(self, name: str, limit: int, batch_share: float = 0.1, batch_max: Optional[int] = None):
+        """
+        Args:
+            name: Backend name used in metrics
+            limit: Calls allowed in progress at once; 0 or less disables the limit
+            batch_share: Minimum fraction of slots given to waiting batch calls
+            batch_max: Slots batch calls may hold at once (default all but one)
+        """
+        self.name = name
+        self.limit = limit
+        # A waiting batch call goes first after this many grants to other classes
+        self.batch_every = math.ceil(1 / batch_share) - 1 if batch_share > 0 else None
+        self.batch_max = max(1, min(limit - 1 if batch_max is None else batch_max, limit))
+        self.active = 0
+        self.batch_active = 0
+        self._queues: Dict[int, Deque[asyncio.Future]] = {level: deque() for level in range(len(PRIORITY_NAMES))}
+        self._batch_passed_over = 0
+
+    async def acquire(self, level: int) -> float:
+        """
+        Wait for a slot.
+
+        Returns:
+            Seconds spent waiting
+        """
+        if self.limit <= 0:
+            return 0.0
+        if self.active < self.limit and not self.waiting() and self._allowed(level):
+            self._grant(level)
+            return 0.0
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._queues[level].append(future)
+        # Slots may be free while only capped batch calls wait
+        self._dispatch()
+        if future.done():
+            return 0.0
+        SCHEDULER_QUEUED.inc(resource=self.name, priority=PRIORITY_NAMES[level])
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just as the caller was cancelled; hand the slot on
+                self.release(level)
+            else:
+                try:
+                    self._queues[level].remove(future)
+                except ValueError:
+                    pass
+            raise
+        finally:
+            SCHEDULER_QUEUED.dec(resource=self.name, priority=PRIORITY_NAMES[level])
+        waited = time.perf_counter() - started
+        SCHEDULER_WAIT.observe(waited, resource=self.name, priority=PRIORITY_NAMES[level])
+        return waited
+
+    def release(self, level: int) -> None:
+        if self.limit <= 0:
+            return
+        self.active -= 1
+        if level == BATCH:
+            self.batch_active -= 1
+        SCHEDULER_ACTIVE.set(self.active, resource=self.name)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting calls."""
+        while self.active < self.limit:
+            level = self._next_level()
+            if level is None:
+                return
+            future = self._queues[level].popleft()
+            if future.done():
+                continue
+            self._grant(level)
+            future.set_result(None)
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _allowed(self, level: int) -> bool:
+        return level != BATCH or self.batch_active < self.batch_max
+
+    def _next_level(self) -> Optional[int]:
+        levels = [level for level, queue in self._queues.items() if queue and self._allowed(level)]
+        if not levels:
+            return None
+        if (BATCH in levels and self.batch_every is not None
+                and self._batch_passed_over >= self.batch_every):
+            return BATCH
+        return min(levels)
+
+    def _grant(self, level: int) -> None:
+        self.active += 1
+        SCHEDULER_ACTIVE.set(self.active, resource=self.name)
+        if level == BATCH:
+            self.batch_active += 1
+            self._batch_passed_over = 0
+        elif self._queues[BATCH]:
+            self._batch_passed_over += 1
+
+
+class PriorityScheduler:
+    """Per-backend slot schedulers for the LLM, TTS and STT services."""
+
+    def __init__(self, limits: Optional[Dict[str, int]] = None, batch_share: float = 0.1,
+                 batch_max: Optional[int] = None):
+        self.resources: Dict[str, ResourceScheduler] = {}
+        self.configure(limits or {"llm": 4, "tts": 4, "stt": 2}, batch_share, batch_max)
+
+    def configure(self, limits: Dict[str, int], batch_share: float, batch_max: Optional[int] = None) -> None:
+        self.resources = {name: ResourceScheduler(name, limit, batch_share, batch_max)
+                          for name, limit in limits.items()}
+
+    @asynccontextmanager
+    async def slot(self, resource: str, level: Optional[int] = None,
+                   timeout: Optional[float] = None) -> AsyncIterator[float]:
+        """
+        Hold a slot of a backend while the block runs.
+
+        Args:
+            resource: "llm", "tts" or "stt"
+            level: Priority class; defaults to the caller's current priority
+            timeout: Longest wait for the slot in seconds (default no limit)
+
+        Yields:
+            Seconds spent waiting for the slot
+
+        Raises:
+            asyncio.TimeoutError: If no slot became free within the timeout
+        """
+        scheduler = self.resources.get(resource)
+        if scheduler is None:
+            yield 0.0
+            return
+        level = current_priority() if level is None else level
+        acquired = scheduler.acquire(level)
+        waited = await (acquired if timeout is None else asyncio.wait_for(acquired, timeout))
+        if waited:
+            caller_span = current_span()
+            if caller_span is not None:
+                caller_span.set(queue_wait_ms=round(waited * 1000, 1))
+        try:
+            yield waited
+        finally:
+            scheduler.release(level)
+
+
+scheduler = PriorityScheduler()
+
+
+def configure_scheduler() -> PriorityScheduler:
+    """
+    Set backend concurrency limits from the environment.
+
+    Configured from:
+        SCHEDULER_LLM_SLOTS / SCHEDULER_TTS_SLOTS / SCHEDULER_STT_SLOTS: Calls in
+            progress per backend (default 4 / 4 / 2; 0 disables scheduling)
+        SCHEDULER_BATCH_SHARE: Minimum fraction of slots given to waiting batch calls (default 0.1)
+        SCHEDULER_BATCH_MAX: Slots per backend batch calls may hold at once (default all but one)
+
+    Returns:
+        The module scheduler
+    """
+    scheduler.configure(
+        {
+            "llm": int(os.getenv("SCHEDULER_LLM_SLOTS", "4")),
+            "tts": int(os.getenv("SCHEDULER_TTS_SLOTS", "4")),
+            "stt": int(os.getenv("SCHEDULER_STT_SLOTS", "2")),
+        },
+        batch_share=float(os.getenv("SCHEDULER_BATCH_SHARE", "0.1")),
+        batch_max=int(os.environ["SCHEDULER_BATCH_MAX"]) if os.getenv("SCHEDULER_BATCH_MAX") else None
+    )
+    logger.info("Backend slots: %s", {name: f"{resource.limit} ({resource.batch_max} batch)"
+                                      for name, resource in scheduler.resources.items()})
+    return scheduler
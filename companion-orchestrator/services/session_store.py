@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+class SessionState:
+    """Per-user configuration: mode, model, language and free-form settings."""
+
+    __slots__ = ("user_id", "mode", "model", "language", "settings", "last_seen", "synced_at")
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        # None means "follow the orchestrator default"
+        self.mode: Optional[str] = None
+        self.model: Optional[str] = None
+        self.language: Optional[str] = None
+        self.settings: Dict[str, Any] = {}
+        self.last_seen = time.monotonic()
+        # When the backend record's expiry was last pushed back
+        self.synced_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "mode": self.mode,
+            "model": self.model,
+            "language": self.language,
+            "settings": dict(self.settings),
+        }
+
+    def update_from(self, data: Dict[str, Any]) -> None:
+        self.mode = data.get("mode")
+        self.model = data.get("model")
+        self.language = data.get("language")
+        self.settings = dict(data.get("settings") or {})
+
+
+class SessionStore:
+    """
+    In-memory session records keyed by user_id.
+
+    Sessions are kept in least-recently-used order, so lookups, idle eviction
+    and the size cap are all O(1) per operation. Each request works on its own
+    user's record, so concurrent users never see each other's settings.
+
+    With a shared backend, records are loaded from it on a local miss and
+    written through on change, so every worker sees the same session. The
+    backend record's expiry is pushed back while the user stays active, even
+    if their settings never change.
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_timeout: float = 3600.0,
+                 backend: Optional[StateStore] = None):
+        """
+        Args:
+            max_sessions: Maximum number of sessions kept in memory
+            idle_timeout: Seconds of inactivity after which a session is dropped
+            backend: Optional state store shared with other workers
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        # Backend reads in progress, shared by concurrent loads of the same user
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    def get(self, user_id: str) -> SessionState:
+        """
+        Get the session for a user, creating it on first use.
+
+        Args:
+            user_id: Identifier for the user
+
+        Returns:
+            The user's session record
+        """
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = SessionState(user_id)
+            self._sessions[user_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(user_id)
+
+        session.last_seen = now
+        return session
+
+    async def load(self, user_id: str) -> SessionState:
+        """
+        Get the session for a user, loading it from the backend on a local miss.
+
+        Args:
+            user_id: Identifier for the user
+
+        Returns:
+            The user's session record
+        """
+        if self.backend is None:
+            return self.get(user_id)
+
+        if user_id not in self._sessions:
+            # Not cached until the record has arrived, so a concurrent request
+            # can't pick up an empty default session in the meantime
+            loading = self._loading.get(user_id)
+            if loading is None:
+                loading = asyncio.ensure_future(self.backend.get_json(f"session:{user_id}"))
+                self._loading[user_id] = loading
+                loading.add_done_callback(lambda _: self._loading.pop(user_id, None))
+            data = await asyncio.shield(loading)
+            if user_id not in self._sessions:
+                session = self.get(user_id)
+                if data:
+                    session.update_from(data)
+                    session.synced_at = time.monotonic()
+                return session
+
+        session = self.get(user_id)
+        if session.synced_at is not None and session.last_seen - session.synced_at >= self.idle_timeout / 2:
+            try:
+                await self.backend.expire(f"session:{user_id}", self.idle_timeout)
+                session.synced_at = session.last_seen
+            except Exception as e:
+                # The session itself is fine; the refresh is retried on a later load
+                logger.warning("Could not refresh the expiry of %s's session: %r", user_id, e)
+        return session
+
+    async def save(self, session: SessionState) -> None:
+        """Write a changed session through to the backend."""
+        if self.backend is not None:
+            session.synced_at = time.monotonic()
+            await self.backend.set_json(f"session:{session.user_id}", session.to_dict(),
+                                        ttl=self.idle_timeout)
+
+    def peek(self, user_id: str) -> Optional[SessionState]:
+        """Get a session without creating it or refreshing its idle timer."""
+        return self._sessions.get(user_id)
+
+    def remove(self, user_id: str) -> None:
+        self._sessions.pop(user_id, None)
+
+    def _evict_idle(self, now: float) -> None:
+        # The oldest sessions are at the front; stop at the first active one
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
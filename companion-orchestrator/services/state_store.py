@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import time
+import urllib.parse
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str], Awaitable[None]]
+
+
+class StateStore:
+    """
+    Key/value and pub/sub interface for state shared between orchestrator workers.
+
+    Values are strings; get_json/set_json handle JSON encoding for callers.
+    """
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    async def expire(self, key: str, ttl: float) -> None:
+        """Let an existing key live another ttl seconds."""
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: str) -> None:
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """Call handler for every message published on channel, in any worker."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    async def get_json(self, key: str) -> Any:
+        value = await self.get(key)
+        return json.loads(value) if value is not None else None
+
+    async def set_json(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self.set(key, json.dumps(value), ttl)
+
+
+class InMemoryStateStore(StateStore):
+    """State store for a single worker process."""
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        expires_at = time.monotonic() + ttl if ttl else None
+        self._values[key] = (value, expires_at)
+
+    async def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    async def expire(self, key: str, ttl: float) -> None:
+        value = await self.get(key)
+        if value is not None:
+            self._values[key] = (value, time.monotonic() + ttl)
+
+    async def publish(self, channel: str, message: str) -> None:
+        for handler in list(self._handlers.get(channel, [])):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error("Error handling message on %s: %s", channel, e)
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        self._handlers.setdefault(channel, []).append(handler)
+
+
+class RESPError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+def encode_command(*args) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """Read one RESP reply; bulk strings are decoded as UTF-8."""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by state store")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        raise RESPError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode()
+    if prefix == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise RESPError(f"Unexpected reply: {line!r}")
+
+
+class RedisStateStore(StateStore):
+    """
+    State store backed by a Redis-protocol server, shared by all workers.
+
+    Speaks RESP directly over asyncio streams, so it needs no client library.
+    Commands share one connection; subscriptions use a dedicated connection.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self._connection: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        # Created on first use so it binds to the running event loop
+        self._lock: Optional[asyncio.Lock] = None
+        self._subscriber: Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = None
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def _connect(self, select_db: bool = True):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            writer.write(encode_command("AUTH", self.password))
+            await writer.drain()
+            await read_reply(reader)
+        if select_db and self.db:
+            writer.write(encode_command("SELECT", self.db))
+            await writer.drain()
+            await read_reply(reader)
+        return reader, writer
+
+    async def execute(self, *args) -> Any:
+        """Send one command and return its reply, reconnecting once on a dropped connection."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._connection is None:
+                        self._connection = await self._connect()
+                    reader, writer = self._connection
+                    writer.write(encode_command(*args))
+                    await writer.drain()
+                    return await read_reply(reader)
+                except RESPError:
+                    # An error reply; the connection is still in step
+                    raise
+                except (ConnectionError, asyncio.IncompleteReadError, OSError):
+                    self._drop_connection()
+                    if attempt:
+                        raise
+                except BaseException:
+                    # Cancelled (or failed) between sending the command and reading
+                    # its reply: that reply would be read by the next caller instead
+                    self._drop_connection()
+                    raise
+
+    def _drop_connection(self) -> None:
+        if self._connection is not None:
+            self._connection[1].close()
+            self._connection = None
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.execute("GET", key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if ttl:
+            await self.execute("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            await self.execute("SET", key, value)
+
+    async def delete(self, key: str) -> None:
+        await self.execute("DEL", key)
+
+    async def expire(self, key: str, ttl: float) -> None:
+        await self.execute("PEXPIRE", key, int(ttl * 1000))
+
+    async def publish(self, channel: str, message: str) -> None:
+        await self.execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        new_channel = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if self._subscriber is None:
+            # Pub/sub channels are global, so no SELECT on this connection
+            self._subscriber = await self._connect(select_db=False)
+            self._listener = asyncio.create_task(self._listen())
+        if new_channel:
+            writer = self._subscriber[1]
+            writer.write(encode_command("SUBSCRIBE", channel))
+            await writer.drain()
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                reader = self._subscriber[0]
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == "message":
+                        await self._dispatch(reply[1], reply[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("State store subscription lost, reconnecting: %s", e)
+                await asyncio.sleep(1.0)
+                try:
+                    self._subscriber[1].close()
+                    self._subscriber = await self._connect(select_db=False)
+                    writer = self._subscriber[1]
+                    for channel in self._handlers:
+                        writer.write(encode_command("SUBSCRIBE", channel))
+                    await writer.drain()
+                except Exception as reconnect_error:
+                    logger.error("Could not resubscribe to state store: %s", reconnect_error)
+
+    async def _dispatch(self, channel: str, message: str) -> None:
+        for handler in list(self._handlers.get(channel, [])):
+            try:
+                await handler(message)
+            except Exception as e:
+                logger.error("Error handling message on %s: %s", channel, e)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._subscriber is not None:
+            self._subscriber[1].close()
+            self._subscriber = None
+        self._drop_connection()
+
+
+def create_state_store(url: Optional[str]) -> StateStore:
+    """
+    Create a state store from a URL.
+
+    Args:
+        url: "redis://[:password@]host[:port][/db]" for a shared store,
+            or empty / "memory://" for a single-process store
+
+    Returns:
+        The configured state store
+    """
+    if not url or url.startswith("memory://"):
+        return InMemoryStateStore()
+
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme != "redis":
+        raise ValueError(f"Unsupported state store URL: {url}")
+    db = int(parsed.path.lstrip("/") or 0)
+    return RedisStateStore(
+        host=parsed.hostname or "localhost",
+        port=parsed.port or 6379,
+        db=db,
+        password=parsed.password
+    )
@@ -1,18 +1,150 @@
+import asyncio
 import httpx
 import base64
 import os
 import wave
 import io
+import logging
 import struct
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, List, Tuple
 import subprocess
 import tempfile
 
+from services.deadline import DeadlineExceeded, record_exceeded, stage_timeout
+from services.scheduler import scheduler
+from services.tracing import stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FILTERS = "highpass=f=50, lowpass=f=8000, volume=1.5"
+
+# Leading and trailing silence below -45 dB; reversing the audio trims the end with the same filter
+TRIM_SILENCE_FILTER = ("silenceremove=start_periods=1:start_threshold=-45dB:start_silence=0.1,areverse,"
+                       "silenceremove=start_periods=1:start_threshold=-45dB:start_silence=0.1,areverse")
+
+# FFmpeg codec -> (file extension, content type) of the upload
+CODECS = {
+    "pcm_s16le": ("wav", "audio/wav"),
+    "flac": ("flac", "audio/flac"),
+    "libopus": ("ogg", "audio/ogg"),
+}
+
+class AudioPreprocessing:
+    """How recorded audio is converted before it is sent to Whisper."""
+    
+    __slots__ = ("name", "sample_rate", "filters", "trim_silence", "codec", "convert_wav")
+    
+    def __init__(self, name: str = "default", sample_rate: int = 16000, filters: Optional[str] = DEFAULT_FILTERS,
+                 trim_silence: bool = False, codec: str = "pcm_s16le", convert_wav: bool = False):
+        """
+        Args:
+            name: Label used in logs and benchmark reports
+            sample_rate: Output sample rate in Hz
+            filters: FFmpeg audio filter chain, or None for no filtering
+            trim_silence: Cut leading and trailing silence
+            codec: Output codec, one of CODECS
+            convert_wav: Also convert input that is already WAV; by default it is sent as is
+        """
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}', expected one of: {', '.join(CODECS)}")
+        self.name = name
+        self.sample_rate = sample_rate
+        self.filters = filters or None
+        self.trim_silence = trim_silence
+        self.codec = codec
+        self.convert_wav = convert_wav
+        
+    @classmethod
+    def from_env(cls) -> "AudioPreprocessing":
+        """
+        Read the preprocessing pipeline from the environment.
+        
+        Configured from:
+            STT_SAMPLE_RATE: Output sample rate (default 16000)
+            STT_FILTERS: FFmpeg filter chain (default DEFAULT_FILTERS; "off" disables filtering)
+            STT_TRIM_SILENCE: "true" to cut leading and trailing silence (default false)
+            STT_CODEC: pcm_s16le, flac or libopus (default pcm_s16le)
+        """
+        filters = os.getenv("STT_FILTERS", DEFAULT_FILTERS)
+        return cls(
+            sample_rate=int(os.getenv("STT_SAMPLE_RATE", "16000")),
+            filters=None if filters.strip().lower() in ("", "off", "none") else filters,
+            trim_silence=os.getenv("STT_TRIM_SILENCE", "false").lower() in ("1", "true", "yes"),
+            codec=os.getenv("STT_CODEC", "pcm_s16le")
+        )
+        
+    @property
+    def filename(self) -> str:
+        return f"audio.{CODECS[self.codec][0]}"
+        
+    @property
+    def content_type(self) -> str:
+        return CODECS[self.codec][1]
+        
+    def filter_chain(self) -> Optional[str]:
+        chain = [f for f in (TRIM_SILENCE_FILTER if self.trim_silence else None, self.filters) if f]
+        return ",".join(chain) or None
+        
+    def ffmpeg_arguments(self) -> List[str]:
+        """Output options of the FFmpeg command, after the input."""
+        arguments = [
+            "-acodec", self.codec,
+            "-ar", str(self.sample_rate),
+            "-ac", "1",             # Mono (Whisper works best with mono)
+        ]
+        chain = self.filter_chain()
+        if chain:
+            arguments += ["-af", chain]
+        return arguments
+
 class STTService:
     """Service for speech-to-text conversion using Whisper."""
     
-    def __init__(self, whisper_url: str):
+    def __init__(self, whisper_url: str, preprocessing: Optional[AudioPreprocessing] = None):
         self.whisper_url = whisper_url
+        self.preprocessing = preprocessing or AudioPreprocessing()
+        
+    async def check_connection(self) -> str:
+        """
+        Check that the Whisper service answers HTTP requests.
+        
+        Returns:
+            The Whisper URL
+            
+        Raises:
+            httpx.HTTPError: If the service can't be reached or returns a server error
+        """
+        async with httpx.AsyncClient(timeout=5.0) as client:
+            response = await client.get(f"{self.whisper_url}/")
+            if response.status_code >= 500:
+                response.raise_for_status()
+        return self.whisper_url
+        
+    async def warm_up(self) -> str:
+        """
+        Transcribe a short silent clip, so the first voice turn doesn't pay for model loading.
+        
+        Returns:
+            The Whisper URL
+            
+        Raises:
+            httpx.HTTPError: If the transcription request fails
+        """
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(16000)
+            wav.writeframes(b"\x00\x00" * 8000)  # Half a second of silence
+        silence = buffer.getvalue()
+        async with httpx.AsyncClient(timeout=120.0) as client:
+            response = await client.post(
+                f"{self.whisper_url}/asr",
+                files={'audio_file': ("warmup.wav", silence, 'audio/wav')},
+                data={'task': 'transcribe', 'language': 'en'}
+            )
+            response.raise_for_status()
+        return self.whisper_url
         
     def _check_wav_header(self, audio_data: bytes) -> Tuple[bool, str]:
         """
@@ -40,70 +172,50 @@ class STTService:
         except Exception as e:
             return False, f"Error checking WAV header: {str(e)}"
             
-    def _convert_audio_to_wav(self, audio_data: bytes) -> bytes:
+    def preprocess(self, audio_data: bytes, preprocessing: Optional[AudioPreprocessing] = None) -> bytes:
         """
-        Convert audio data to WAV format using FFmpeg
-        This handles various input formats including webm/opus from browsers
+        Convert audio with FFmpeg, handling browser formats such as webm/opus.
         
         Args:
-            audio_data: The audio data in any format
+            audio_data: The audio data in any format FFmpeg reads
+            preprocessing: Pipeline to apply; defaults to the service's
             
         Returns:
-            Audio data in WAV format
-        """
-        # First, check if it's already a valid WAV file
-        if len(audio_data) >= 44 and audio_data[:4] == b'RIFF' and audio_data[8:12] == b'WAVE':
-            print("Audio validation: Already a valid WAV file")
-            return audio_data
+            The converted audio, encoded with the pipeline's codec
             
-        print("Audio format needs conversion: Not a valid WAV file")
+        Raises:
+            RuntimeError: If FFmpeg fails
+            OSError: If FFmpeg is missing or the temporary files can't be written
+        """
+        preprocessing = preprocessing or self.preprocessing
         
         # Create temporary files for input and output
         with tempfile.NamedTemporaryFile(delete=False, suffix=".audio") as temp_in_file:
             temp_in_path = temp_in_file.name
             temp_in_file.write(audio_data)
             
-        temp_out_path = temp_in_path + ".wav"
+        temp_out_path = f"{temp_in_path}.{CODECS[preprocessing.codec][0]}"
         
         try:
-            # Use FFmpeg to convert the audio to WAV format with enhanced parameters
-            print(f"Converting audio to WAV format using FFmpeg: {temp_in_path} -> {temp_out_path}")
-            cmd = [
-                "ffmpeg",
-                "-y",                    # Overwrite output without asking
-                "-i", temp_in_path,     # Input file
-                "-acodec", "pcm_s16le", # Convert to 16-bit PCM
-                "-ar", "16000",         # 16kHz sample rate (ideal for Whisper)
-                "-ac", "1",             # Mono (Whisper works best with mono)
-                "-af", "highpass=f=50, lowpass=f=8000, volume=1.5",  # Audio filtering to enhance speech
-                "-q:a", "0",            # Best audio quality
-                temp_out_path           # Output file
-            ]
+            logger.debug("Converting audio with FFmpeg (%s): %s -> %s", preprocessing.name, temp_in_path, temp_out_path)
+            cmd = ["ffmpeg", "-y", "-i", temp_in_path] + preprocessing.ffmpeg_arguments() + [temp_out_path]
             
-            # Run FFmpeg command
-            process = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=False  # Don't raise exception on non-zero exit
-            )
+            with stage("ffmpeg_convert", input_bytes=len(audio_data)):
+                process = subprocess.run(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    check=False  # Don't raise exception on non-zero exit
+                )
             
             if process.returncode != 0:
-                print(f"FFmpeg error: {process.stderr.decode()}")
-                # If conversion fails, fall back to adding a basic WAV header
-                return self._add_wav_header(audio_data)
+                raise RuntimeError(f"FFmpeg error: {process.stderr.decode(errors='replace')}")
                 
-            # Read the converted WAV file
             with open(temp_out_path, 'rb') as f:
-                wav_data = f.read()
+                converted = f.read()
                 
-            print(f"Conversion successful. WAV size: {len(wav_data)} bytes")
-            return wav_data
-            
-        except Exception as e:
-            print(f"Error during audio conversion: {str(e)}")
-            # Fall back to adding a basic WAV header
-            return self._add_wav_header(audio_data)
+            logger.debug("Conversion successful. Output size: %d bytes", len(converted))
+            return converted
             
         finally:
             # Clean up temporary files
@@ -113,8 +225,38 @@ class STTService:
                 if os.path.exists(temp_out_path):
                     os.unlink(temp_out_path)
             except Exception as e:
-                print(f"Error cleaning up temp files: {str(e)}")
+                logger.warning("Error cleaning up temp files: %s", e)
                 
+    def _convert_audio_to_wav(self, audio_data: bytes, preprocessing: Optional[AudioPreprocessing] = None) -> bytes:
+        """
+        Prepare audio for Whisper with the preprocessing pipeline.
+        
+        Input that is already WAV is sent as is unless the pipeline sets
+        convert_wav. If conversion fails, a basic WAV header is added instead.
+        
+        Args:
+            audio_data: The audio data in any format
+            preprocessing: Pipeline to apply; defaults to the service's
+            
+        Returns:
+            Audio data ready for upload
+        """
+        preprocessing = preprocessing or self.preprocessing
+        
+        # First, check if it's already a valid WAV file
+        if (not preprocessing.convert_wav and len(audio_data) >= 44
+                and audio_data[:4] == b'RIFF' and audio_data[8:12] == b'WAVE'):
+            logger.debug("Audio validation: Already a valid WAV file")
+            return audio_data
+            
+        logger.debug("Audio format needs conversion: Not a valid WAV file")
+        try:
+            return self.preprocess(audio_data, preprocessing)
+        except Exception as e:
+            logger.error("Error during audio conversion: %s", e)
+            # Fall back to adding a basic WAV header
+            return self._add_wav_header(audio_data)
+            
     async def speech_to_text(self, audio_data: bytes, language: Optional[str] = None) -> str:
         """
         Convert speech to text using Whisper.
@@ -125,34 +267,39 @@ class STTService:
             
         Returns:
             Transcribed text
+            
+        Raises:
+            DeadlineExceeded: If the request's deadline ran out before Whisper answered
         """
         try:
             # Log initial audio size and info
-            print(f"Received audio data: {len(audio_data)} bytes")
+            logger.debug("Received audio data: %d bytes", len(audio_data))
             
-            # Convert audio to WAV format (handles webm/opus from browsers)
+            # Convert audio for Whisper (handles webm/opus from browsers)
             wav_audio_data = self._convert_audio_to_wav(audio_data)
+            if wav_audio_data[:4] == b'RIFF':
+                filename, content_type = "audio.wav", "audio/wav"
+            else:
+                filename, content_type = self.preprocessing.filename, self.preprocessing.content_type
             
-            # Print binary header data for debugging (first 16 bytes)
-            if len(wav_audio_data) >= 16:
-                header_hex = ' '.join(f'{b:02x}' for b in wav_audio_data[:16])
-                print(f"Audio header (hex): {header_hex}")
-                try:
-                    header_ascii = ''.join(chr(b) if 32 <= b < 127 else '.' for b in wav_audio_data[:16])
-                    print(f"Audio header (ascii): {header_ascii}")
-                except:
-                    pass
+            # Log binary header data for debugging (first 16 bytes); only
+            # rendered when debug logging is enabled for this module
+            if len(wav_audio_data) >= 16 and logger.isEnabledFor(logging.DEBUG):
+                header = wav_audio_data[:16]
+                logger.debug("Audio header (hex): %s", header.hex(' '))
+                logger.debug("Audio header (ascii): %s",
+                             ''.join(chr(b) if 32 <= b < 127 else '.' for b in header))
             
-            # Create a temporary wav file from the converted audio data
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
+            # Create a temporary file from the converted audio data
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1], delete=False) as temp_file:
                 temp_file.write(wav_audio_data)
                 temp_file_path = temp_file.name
                 
-            print(f"Created temporary file: {temp_file_path}")
+            logger.debug("Created temporary file: %s", temp_file_path)
             
             # Prepare the multipart form-data request
             files = {
-                'audio_file': ("audio.wav", open(temp_file_path, 'rb'), 'audio/wav')
+                'audio_file': (filename, open(temp_file_path, 'rb'), content_type)
             }
             
             # Add other parameters
@@ -164,41 +311,56 @@ class STTService:
             if language:
                 data['language'] = language
                 
-            print(f"Sending request to Whisper STT at {self.whisper_url}/asr")
-            async with httpx.AsyncClient(timeout=60.0) as client:  # Increased timeout
-                response = await client.post(
-                    f"{self.whisper_url}/asr",
-                    files=files,
-                    data=data
-                )
+            logger.debug("Sending request to Whisper STT at %s/asr", self.whisper_url)
+            # Waiting for a slot counts against the timeout
+            timeout = stage_timeout("stt", 60.0)
+            async with httpx.AsyncClient(timeout=timeout + 1.0) as client:
+                
+                async def transcribe() -> httpx.Response:
+                    async with scheduler.slot("stt"):
+                        with stage("whisper", language=language):
+                            return await client.post(
+                                f"{self.whisper_url}/asr",
+                                files=files,
+                                data=data
+                            )
                 
-                # Clean up the temporary file
                 try:
-                    os.unlink(temp_file_path)
-                    print(f"Deleted temporary file: {temp_file_path}")
-                except Exception as e:
-                    print(f"Error deleting temporary file: {str(e)}")
+                    response = await asyncio.wait_for(transcribe(), timeout)
+                except asyncio.TimeoutError:
+                    record_exceeded("stt")
+                    raise DeadlineExceeded("stt")
+                finally:
+                    # Clean up the temporary file
+                    files['audio_file'][1].close()
+                    try:
+                        os.unlink(temp_file_path)
+                        logger.debug("Deleted temporary file: %s", temp_file_path)
+                    except Exception as e:
+                        logger.warning("Error deleting temporary file: %s", e)
                 
                 if response.status_code != 200:
-                    print(f"STT Error: {response.status_code} - {response.text}")
+                    logger.error("STT Error: %s - %s", response.status_code, response.text)
                     return ""
                 
                 # Try to parse as JSON first
                 try:
                     result = response.json()
                     text = result.get("text", "")
-                    print(f"Successfully transcribed audio: '{text[:50]}...' ({len(text)} chars)")
+                    logger.debug("Successfully transcribed audio: '%.50s...' (%d chars)", text, len(text))
                     return text
                 except Exception as json_error:
                     # If not JSON, treat the response as plain text
-                    print(f"Response is not JSON, treating as plain text. Error: {str(json_error)}")
+                    logger.warning("Response is not JSON, treating as plain text. Error: %s", json_error)
                     response_text = response.text.strip()
                     if response_text:
-                        print(f"Plain text response: {response_text[:50]}...")
+                        logger.debug("Plain text response: %.50s...", response_text)
                         return response_text
                     return ""
+        except DeadlineExceeded:
+            raise
         except Exception as e:
-            print(f"Error in speech_to_text: {str(e)}")
+            logger.error("Error in speech_to_text: %s", e)
             return ""
                 
     def _add_wav_header(self, audio_data: bytes) -> bytes:
@@ -212,7 +374,7 @@ class STTService:
         Returns:
             Audio data with WAV header
         """
-        print("Falling back to adding basic WAV header")
+        logger.warning("Falling back to adding basic WAV header")
         
         # Create a minimal WAV header for 16-bit PCM mono at 16kHz
         # RIFF header
@@ -237,7 +399,7 @@ class STTService:
         
         # Combine header with audio data
         wav_data = wav_header + audio_data
-        print(f"Created WAV file with basic header, size: {len(wav_data)} bytes")
+        logger.debug("Created WAV file with basic header, size: %d bytes", len(wav_data))
         
         return wav_data
             
@@ -260,19 +422,19 @@ class STTService:
                 "task": "language_detection"
             }
                 
-            async with httpx.AsyncClient(timeout=30.0) as client:
+            async with scheduler.slot("stt"), httpx.AsyncClient(timeout=30.0) as client:
                 response = await client.post(
                     f"{self.whisper_url}/detect-language",
                     json=payload
                 )
                 
                 if response.status_code != 200:
-                    print(f"Language detection error: {response.text}")
+                    logger.error("Language detection error: %s", response.text)
                     return "en"  # Default to English
                     
                 result = response.json()
                 return result.get("detected_language", "en")
                 
         except Exception as e:
-            print(f"Error in language detection: {str(e)}")
+            logger.error("Error in language detection: %s", e)
             return "en"  # Default to English
@@ -0,0 +1,385 @@
+import asyncio
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import tempfile
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+import httpx
+
+from services.metrics import STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_time",
+                 "end_time", "attributes", "error", "_started")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    @property
+    def duration(self) -> float:
+        """Seconds the span has been running, or ran for once ended."""
+        if self.end_time is not None:
+            return self.end_time - self.start_time
+        return time.perf_counter() - self._started
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        """Finish the span and hand it to the exporters."""
+        if self.end_time is not None:
+            return
+        # Wall-clock start plus a monotonic duration, so spans nest correctly
+        self.end_time = self.start_time + (time.perf_counter() - self._started)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        tracer.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start_time, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def start_span(name: str, trace_id: Optional[str] = None, **attributes) -> Span:
+    """
+    Start a span without making it current.
+
+    Use this where a `with` block can't enclose the work, e.g. across the
+    yields of an async generator; call `end()` on the span when done.
+
+    Args:
+        name: Operation name
+        trace_id: Trace to join; defaults to the current trace, or a new one
+        **attributes: Initial span attributes
+
+    Returns:
+        The started span, a child of the current span if there is one
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+    parent_id = parent.span_id if parent is not None and parent.trace_id == trace_id else None
+    return Span(name, trace_id, parent_id, attributes)
+
+
+@contextmanager
+def span(name: str, trace_id: Optional[str] = None, **attributes) -> Iterator[Span]:
+    """Record the enclosed block as a span, current for everything it calls."""
+    active = start_span(name, trace_id, **attributes)
+    token = _current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        active.end()
+
+
+@contextmanager
+def stage(name: str, **attributes) -> Iterator[Span]:
+    """A span that is also observed in the pipeline stage latency histogram."""
+    with span(name, **attributes) as active:
+        try:
+            yield active
+        finally:
+            STAGE_LATENCY.observe(active.duration, stage=name)
+
+
+@contextmanager
+def attach(parent: Optional[Span]) -> Iterator[None]:
+    """Make `parent` the current span, e.g. in a background task working on behalf of a request."""
+    token = _current_span.set(parent)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+class SpanExporter:
+    """Destination for finished spans. `export` is called on the event loop and must not block."""
+
+    def export(self, span: Span) -> None:
+        raise NotImplementedError
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class _SpanFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, default=str)
+
+
+class JSONLSpanExporter(SpanExporter):
+    """
+    Append spans as JSON lines to a size-rotated local file.
+
+    Encoding and file writes happen on a background thread; spans are
+    dropped if that thread falls behind by more than `queue_size`.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 3,
+                 queue_size: int = 10000):
+        """
+        Args:
+            path: File to write; rotated copies get .1, .2, ... suffixes
+            max_bytes: Size at which the file is rotated
+            backups: Number of rotated files kept
+            queue_size: Spans buffered for the writer thread
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.dropped = 0
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(_SpanFormatter())
+        self._queue: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+        self._listener = logging.handlers.QueueListener(self._queue, handler)
+        self._listener.start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(logging.makeLogRecord({"msg": span.to_dict()}))
+        except queue.Full:
+            self.dropped += 1
+
+    async def stop(self) -> None:
+        await asyncio.to_thread(self._listener.stop)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPSpanExporter(SpanExporter):
+    """
+    Send spans to an OpenTelemetry collector using OTLP/HTTP with JSON encoding.
+
+    Spans are buffered and posted in batches from a background task; when the
+    collector is unreachable the oldest buffered spans are dropped.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "companion-orchestrator",
+                 interval: float = 5.0, max_buffered: int = 5000):
+        """
+        Args:
+            endpoint: Collector base URL, e.g. http://otel-collector:4318
+            service_name: Value of the service.name resource attribute
+            interval: Seconds between batch uploads
+            max_buffered: Spans kept while waiting for the next upload
+        """
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.interval = interval
+        self._buffer: Deque[Span] = deque(maxlen=max_buffered)
+        self._task: Optional[asyncio.Task] = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def export(self, span: Span) -> None:
+        self._buffer.append(span)
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(timeout=10.0)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer or self._client is None:
+            return
+        spans = list(self._buffer)
+        self._buffer.clear()
+        try:
+            response = await self._client.post(self.url, json=self._encode(spans))
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning("Could not export %d spans to %s: %s", len(spans), self.url, e)
+
+    def _encode(self, spans: List[Span]) -> Dict[str, Any]:
+        return {"resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "companion"},
+                "spans": [self._encode_span(span) for span in spans],
+            }],
+        }]}
+
+    @staticmethod
+    def _encode_span(span: Span) -> Dict[str, Any]:
+        encoded = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int(span.start_time * 1e9)),
+            "endTimeUnixNano": str(int(span.end_time * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)}
+                           for key, value in span.attributes.items() if value is not None],
+            # STATUS_CODE_ERROR / STATUS_CODE_OK
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+
+class Tracer:
+    """Fans finished spans out to the configured exporters."""
+
+    def __init__(self):
+        self.exporters: List[SpanExporter] = []
+
+    def export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.warning("Span exporter %s failed: %s", type(exporter).__name__, e)
+
+    async def start(self) -> None:
+        for exporter in self.exporters:
+            await exporter.start()
+
+    async def stop(self) -> None:
+        for exporter in self.exporters:
+            await exporter.stop()
+
+
+tracer = Tracer()
+
+
+def configure_tracing() -> Tracer:
+    """
+    Set up span exporters from the environment.
+
+    Configured from:
+        TRACE_FILE: JSONL span file (default <tempdir>/companion-traces-{pid}.jsonl; "off"
+            disables it). "{pid}" in the path is replaced by the process ID, so several
+            workers don't append to and rotate the same file
+        TRACE_FILE_MAX_MB / TRACE_FILE_BACKUPS: Rotation size and kept files (default 50 / 3)
+        OTEL_EXPORTER_OTLP_ENDPOINT: Optional OTLP/HTTP collector URL
+
+    Returns:
+        The module tracer
+    """
+    if tracer.exporters:
+        return tracer
+    path = os.getenv("TRACE_FILE", os.path.join(tempfile.gettempdir(), "companion-traces-{pid}.jsonl"))
+    if path and path.lower() != "off":
+        tracer.exporters.append(JSONLSpanExporter(
+            path.replace("{pid}", str(os.getpid())),
+            max_bytes=int(float(os.getenv("TRACE_FILE_MAX_MB", "50")) * 1024 * 1024),
+            backups=int(os.getenv("TRACE_FILE_BACKUPS", "3"))
+        ))
+    endpoint = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if endpoint:
+        tracer.exporters.append(OTLPSpanExporter(
+            endpoint, service_name=os.getenv("OTEL_SERVICE_NAME", "companion-orchestrator")))
+    return tracer
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware opening a root span per HTTP request.
+
+    A valid incoming X-Trace-Id header is reused so clients can correlate
+    their own logs; the trace ID is always returned in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        for name, value in scope.get("headers", []):
+            if name == b"x-trace-id":
+                candidate = value.decode("latin-1").strip().lower()
+                if TRACE_ID_PATTERN.match(candidate):
+                    trace_id = candidate
+                break
+
+        with span(f"{scope['method']} {scope['path']}", trace_id=trace_id) as root:
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start":
+                    root.set(status_code=message["status"])
+                    headers = list(message.get("headers", []))
+                    headers.append((TRACE_HEADER.lower().encode(), root.trace_id.encode()))
+                    message = dict(message, headers=headers)
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import httpx
 import logging
@@ -9,7 +10,13 @@ import struct
 import io
 import tempfile
 import subprocess
-from typing import Optional
+import time
+from typing import Dict, Optional
+
+from services.deadline import record_exceeded, stage_timeout
+from services.metrics import TTS_CHUNKS
+from services.scheduler import scheduler
+from services.tracing import current_span, stage
 
 logger = logging.getLogger(__name__)
 
@@ -32,7 +39,7 @@ class TTSService:
         self.tts_url = primary_url
         self.fallback_urls = [url for url in fallback_urls if url != primary_url]
         
-        logger.info(f"Initializing TTS service with URL: {self.tts_url} (fallbacks: {self.fallback_urls})")
+        logger.info("Initializing TTS service with URL: %s (fallbacks: %s)", self.tts_url, self.fallback_urls)
         
         # Define default voices for each supported language
         self.default_voices = {
@@ -40,32 +47,73 @@ class TTSService:
             "fr": "upmc-pierre-hsmm"  # French male voice
         }
         
-        # Connection will be verified on first request
+        # Connection is verified at startup or on first request, then reused
+        # for TTS_VERIFY_TTL seconds instead of probing /voices on every reply
+        self.verify_ttl = float(os.getenv("TTS_VERIFY_TTL", "300"))
+        self._verified_at: Optional[float] = None
 
-    async def _verify_connection(self):
+    async def check_connection(self, force: bool = False) -> bool:
+        """
+        Make sure a working TTS URL is selected, reusing a recent successful check.
+        
+        Args:
+            force: Probe the service even if it was verified recently
+            
+        Returns:
+            True if a TTS service URL is reachable
+        """
+        if (not force and self._verified_at is not None
+                and time.monotonic() - self._verified_at < self.verify_ttl):
+            return True
+        # Probing mustn't use up more than the request has left for speech
+        connection_ok = await self._verify_connection(min(5.0, stage_timeout("tts", 5.0)))
+        self._verified_at = time.monotonic() if connection_ok else None
+        return connection_ok
+    
+    async def warm_up(self) -> Dict[str, str]:
+        """
+        Synthesize a short phrase with each default voice, so the first reply
+        doesn't pay for loading the voice models.
+        
+        Returns:
+            The TTS URL in use and the voices warmed up
+            
+        Raises:
+            ConnectionError: If no TTS service URL is reachable
+            RuntimeError: If a voice produced no audio
+        """
+        if not await self.check_connection(force=True):
+            raise ConnectionError("Could not connect to any TTS service URL")
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            for voice in self.default_voices.values():
+                if not await self._process_tts_chunk("Hello.", voice, client):
+                    raise RuntimeError(f"TTS voice {voice} produced no audio")
+        return {"url": self.tts_url, "voices": ", ".join(self.default_voices.values())}
+    
+    async def _verify_connection(self, timeout: float = 5.0):
         """Try to verify connection to the TTS service and switch URLs if needed."""
-        async with httpx.AsyncClient(timeout=5.0) as client:
+        async with httpx.AsyncClient(timeout=timeout) as client:
             # Try primary URL first
             try:
-                logger.info(f"Testing connection to primary TTS URL: {self.tts_url}")
+                logger.info("Testing connection to primary TTS URL: %s", self.tts_url)
                 response = await client.get(f"{self.tts_url}/voices")
                 if response.status_code == 200:
-                    logger.info(f"Successfully connected to TTS service at {self.tts_url}")
+                    logger.info("Successfully connected to TTS service at %s", self.tts_url)
                     return True
             except Exception as e:
-                logger.warning(f"Could not connect to primary TTS URL {self.tts_url}: {str(e)}")
+                logger.warning("Could not connect to primary TTS URL %s: %s", self.tts_url, e)
             
             # Try fallback URLs if primary failed
             for url in self.fallback_urls:
                 try:
-                    logger.info(f"Testing connection to fallback TTS URL: {url}")
+                    logger.info("Testing connection to fallback TTS URL: %s", url)
                     response = await client.get(f"{url}/voices")
                     if response.status_code == 200:
-                        logger.info(f"Switching to working TTS service URL: {url}")
+                        logger.info("Switching to working TTS service URL: %s", url)
                         self.tts_url = url
                         return True
                 except Exception as e:
-                    logger.warning(f"Could not connect to fallback TTS URL {url}: {str(e)}")
+                    logger.warning("Could not connect to fallback TTS URL %s: %s", url, e)
             
             logger.error("Could not connect to any TTS service URL")
             return False
@@ -78,31 +126,30 @@ class TTSService:
             language: Optional language code to use (e.g., "en" or "fr")
             
         Returns:
-            Binary audio data or fallback audio if conversion failed
+            Binary audio data or fallback audio if conversion failed; None if
+            the request's deadline ran out first, so the reply goes without audio
         """
         if not text:
             logger.warning("Empty text provided to TTS service")
             return self._generate_fallback_audio()
             
+        # Outside of a request with a deadline, only each chunk's request is bounded
+        budget = stage_timeout("tts", None)
+        stage_end = time.monotonic() + budget if budget is not None else None
+        if budget is not None and budget <= 0:
+            record_exceeded("tts")
+            return None
         try:
             # First verify connection to TTS service
-            connection_ok = await self._verify_connection()
+            connection_ok = await self.check_connection()
+            if not connection_ok and stage_end is not None and time.monotonic() >= stage_end:
+                record_exceeded("tts")
+                return None
             if not connection_ok:
                 logger.error("Failed to connect to any TTS service URL")
                 return self._generate_fallback_audio()
                 
-            # Auto-detect language based on text content if voice not specified
-            voice = None
-            if language and language.lower().startswith("fr"):
-                voice = self.default_voices["fr"]
-                logger.info(f"Using French voice: {voice}")
-            else:
-                if self._is_mostly_french(text):
-                    voice = self.default_voices["fr"]
-                    logger.info(f"Detected French text, using voice: {voice}")
-                else:
-                    voice = self.default_voices["en"]
-                    logger.info(f"Using default English voice: {voice}")
+            voice = self.select_voice(text, language)
             
             # Split long text into smaller chunks that the TTS model can handle
             # This helps avoid the "kernel size can't be greater than actual input size" error
@@ -110,25 +157,42 @@ class TTSService:
             sentences = self._split_into_sentences(text)
             chunks = self._create_chunks(sentences, max_chunk_length)
             
-            logger.info(f"Processing {len(chunks)} TTS chunks")
+            logger.info("Processing %d TTS chunks", len(chunks))
+            TTS_CHUNKS.observe(len(chunks))
+            tts_span = current_span()
+            if tts_span is not None:
+                tts_span.set(chunks=len(chunks), voice=voice)
             
             # Process chunks and get audio files for each
             temp_files = []
             async with httpx.AsyncClient(timeout=60.0) as client:
                 for i, chunk in enumerate(chunks):
                     try:
-                        chunk_audio = await self._process_tts_chunk(chunk, voice, client)
+                        with stage("tts_chunk", index=i, chars=len(chunk)):
+                            if stage_end is None:
+                                chunk_audio = await self._process_tts_chunk(chunk, voice, client)
+                            else:
+                                chunk_audio = await asyncio.wait_for(
+                                    self._process_tts_chunk(chunk, voice, client),
+                                    max(stage_end - time.monotonic(), 0.0))
                         if chunk_audio:
                             # Save each chunk to a temporary file
                             fd, temp_path = tempfile.mkstemp(suffix=f".{i}.wav")
                             os.write(fd, chunk_audio)
                             os.close(fd)
                             temp_files.append(temp_path)
-                            logger.info(f"Generated audio for chunk {i+1}, saved to {temp_path}")
+                            logger.debug("Generated audio for chunk %d, saved to %s", i + 1, temp_path)
                         else:
-                            logger.warning(f"Failed to generate audio for chunk {i+1}")
+                            logger.warning("Failed to generate audio for chunk %d", i + 1)
+                    except asyncio.TimeoutError:
+                        # A reply missing its end is worse than no audio at all
+                        record_exceeded("tts")
+                        logger.warning("Out of time for speech at chunk %d of %d, skipping audio", i + 1, len(chunks))
+                        for temp_file in temp_files:
+                            os.remove(temp_file)
+                        return None
                     except Exception as e:
-                        logger.error(f"Error processing chunk {i+1}: {str(e)}")
+                        logger.error("Error processing chunk %d: %s", i + 1, e)
             
             # If we couldn't generate any audio, return fallback
             if not temp_files:
@@ -150,8 +214,9 @@ class TTSService:
                         "ffmpeg", "-f", "concat", "-safe", "0", 
                         "-i", list_file, "-c", "copy", output_file
                     ]
-                    logger.info(f"Running FFmpeg command: {' '.join(cmd)}")
-                    subprocess.run(cmd, check=True, capture_output=True)
+                    logger.debug("Running FFmpeg command: %s", " ".join(cmd))
+                    with stage("wav_concat", chunks=len(temp_files)):
+                        subprocess.run(cmd, check=True, capture_output=True)
                     
                     # Read the combined file
                     with open(output_file, "rb") as f:
@@ -165,7 +230,7 @@ class TTSService:
                     
                     return combined_audio
                 except Exception as e:
-                    logger.error(f"Error combining audio chunks: {str(e)}")
+                    logger.error("Error combining audio chunks: %s", e)
                     # If concatenation fails, try to return the first chunk at least
                     if temp_files:
                         with open(temp_files[0], "rb") as f:
@@ -188,9 +253,38 @@ class TTSService:
                 return self._generate_fallback_audio()
             
         except Exception as e:
-            logger.error(f"Error in TTS service: {str(e)}")
+            logger.error("Error in TTS service: %s", e)
             return self._generate_fallback_audio()
     
+    def select_voice(self, text: str, language: Optional[str] = None) -> str:
+        """Pick the voice for a language, auto-detecting French text if no language is given."""
+        if language and language.lower().startswith("fr"):
+            voice = self.default_voices["fr"]
+            logger.debug("Using French voice: %s", voice)
+        elif self._is_mostly_french(text):
+            voice = self.default_voices["fr"]
+            logger.debug("Detected French text, using voice: %s", voice)
+        else:
+            voice = self.default_voices["en"]
+            logger.debug("Using default English voice: %s", voice)
+        return voice
+    
+    async def synthesize_clip(self, text: str, voice: str) -> Optional[bytes]:
+        """
+        Synthesize a short phrase in one request, without chunking or fallback audio.
+        
+        Args:
+            text: Phrase short enough for a single TTS request
+            voice: Voice to speak it with
+            
+        Returns:
+            WAV audio, or None if the TTS service failed
+        """
+        if not await self.check_connection():
+            return None
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            return await self._process_tts_chunk(text, voice, client)
+    
     async def _process_tts_chunk(self, text: str, voice: str, client):
         """Process a single chunk of text through TTS service"""
         try:
@@ -201,17 +295,20 @@ class TTSService:
             }
             
             # Use MozillaTTS API to generate speech
-            logger.info(f"Requesting TTS for text: '{text[:30]}...' with voice {voice}")
-            response = await client.get(f"{self.tts_url}/api/tts", params=params)
+            logger.debug("Requesting TTS for text: '%s...' with voice %s", text[:30], voice)
+            async with scheduler.slot("tts"):
+                response = await client.get(f"{self.tts_url}/api/tts", params=params)
             
             if response.status_code == 200:
                 return response.content
             else:
-                logger.error(f"TTS API error: {response.status_code} - {response.text}")
+                logger.error("TTS API error: %s - %s", response.status_code, response.text)
                 return None
                 
         except Exception as e:
-            logger.error(f"Error processing TTS chunk: {str(e)}")
+            logger.error("Error processing TTS chunk: %s", e)
+            # The service may have moved or gone down; probe again on the next reply
+            self._verified_at = None
             return None
             
     def _split_into_sentences(self, text: str):
@@ -0,0 +1,123 @@
+import asyncio
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from services.ws_protocol import JSONProtocol
+
+Message = Dict[str, Any]
+
+
+def merge_tokens(queued: Message, message: Message) -> Optional[Message]:
+    """Coalesce two token events of the same request into one."""
+    if queued.get("type") == "token" and queued.get("request_id") == message.get("request_id"):
+        return dict(queued, text=queued.get("text", "") + message.get("text", ""))
+    return None
+
+
+def replace_same_type(queued: Message, message: Message) -> Optional[Message]:
+    """Replace a queued event of the same type and request with the newer one."""
+    if queued.get("type") == message.get("type") and queued.get("request_id") == message.get("request_id"):
+        return message
+    return None
+
+
+class WebSocketOutbox:
+    """
+    Bounded outbound message queue for one websocket connection.
+
+    A dedicated sender task drains the outbox, so a slow client only slows
+    down its own producers. Control messages go to a separate lane that is
+    always sent first and never counts against the limit. Other messages
+    either wait for room (backpressure), are dropped when the queue is full,
+    or are coalesced with the last queued message.
+    """
+
+    def __init__(self, websocket, max_messages: int = 256, protocol: Optional[JSONProtocol] = None):
+        """
+        Args:
+            websocket: The connection messages are sent on
+            max_messages: Maximum number of queued non-control messages
+            protocol: How messages are framed on the connection (default JSON text)
+        """
+        self.websocket = websocket
+        self.max_messages = max_messages
+        self.protocol = protocol or JSONProtocol()
+        self.dropped = 0
+        self._control: deque = deque()
+        self._messages: deque = deque()
+        self._changed = asyncio.Condition()
+        self._closed = False
+
+    async def put(self,
+                  message: Message,
+                  control: bool = False,
+                  drop_if_full: bool = False,
+                  coalesce: Optional[Callable[[Message, Message], Optional[Message]]] = None) -> bool:
+        """
+        Queue a message for sending.
+
+        Args:
+            message: JSON-serializable message
+            control: Send ahead of all other queued messages
+            drop_if_full: Drop the message instead of waiting when the queue is full
+            coalesce: Function merging the last queued message with this one;
+                returns the merged message, or None if they can't be merged
+
+        Returns:
+            True if the message was queued or merged, False if it was dropped
+        """
+        async with self._changed:
+            if self._closed:
+                return False
+
+            if control:
+                self._control.append(message)
+                self._changed.notify_all()
+                return True
+
+            if coalesce is not None and self._messages:
+                merged = coalesce(self._messages[-1], message)
+                if merged is not None:
+                    self._messages[-1] = merged
+                    return True
+
+            if len(self._messages) >= self.max_messages:
+                if drop_if_full:
+                    self.dropped += 1
+                    return False
+                await self._changed.wait_for(
+                    lambda: self._closed or len(self._messages) < self.max_messages
+                )
+                if self._closed:
+                    return False
+
+            self._messages.append(message)
+            self._changed.notify_all()
+            return True
+
+    async def get(self) -> Optional[Message]:
+        """Wait for the next message to send; returns None once closed."""
+        async with self._changed:
+            await self._changed.wait_for(lambda: self._closed or self._control or self._messages)
+            if self._control:
+                message = self._control.popleft()
+            elif self._messages:
+                message = self._messages.popleft()
+            else:
+                return None
+            # Wake producers waiting for room
+            self._changed.notify_all()
+            return message
+
+    async def run_sender(self) -> None:
+        """Send queued messages until the outbox is closed or the client goes away."""
+        while True:
+            message = await self.get()
+            if message is None:
+                return
+            await self.protocol.send(self.websocket, message)
+
+    async def close(self) -> None:
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
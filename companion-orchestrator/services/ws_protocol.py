@@ -0,0 +1,231 @@
+import io
+import json
+import struct
+import wave
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.websockets import WebSocketDisconnect
+
+Message = Dict[str, Any]
+
+BINARY_SUBPROTOCOL = "companion.binary.v1"
+
+# Every binary frame starts with: version, kind, codec, flags, stream (big-endian)
+HEADER = struct.Struct(">BBBBI")
+VERSION = 1
+
+# Frame kinds
+MESSAGE = 1  # Payload is a UTF-8 JSON object, as sent by text-protocol clients
+AUDIO = 2    # Payload is a piece of an audio stream
+
+# Frame flags
+END = 0x01   # Last frame of its audio stream
+
+# Audio codecs by their id in the frame header; the names are used in JSON messages.
+# "opus" is Opus in an Ogg container, and "webm" Opus or Vorbis in WebM, as
+# browsers record them; raw Opus packets have no container FFmpeg could read.
+CODECS = {1: "pcm_s16le", 2: "wav", 3: "opus", 4: "webm"}
+CODEC_IDS = {name: codec_id for codec_id, name in CODECS.items()}
+
+# Container each codec's streams come in, and how a complete stream starts
+CONTAINERS = {"wav": ("WAV", b"RIFF"), "opus": ("Ogg", b"OggS"), "webm": ("WebM", b"\x1a\x45\xdf\xa3")}
+
+# Internal type of queued outgoing audio frames; never sent as JSON
+AUDIO_FRAME = "audio_frame"
+
+
+class ProtocolError(ValueError):
+    """A websocket frame or message that doesn't follow the protocol."""
+
+
+class Frame:
+    """One decoded binary frame."""
+
+    __slots__ = ("kind", "codec", "flags", "stream", "payload")
+
+    def __init__(self, kind: int, codec: int, flags: int, stream: int, payload: bytes):
+        self.kind = kind
+        self.codec = codec
+        self.flags = flags
+        self.stream = stream
+        self.payload = payload
+
+    @property
+    def end(self) -> bool:
+        return bool(self.flags & END)
+
+
+def encode_frame(kind: int, payload: bytes, codec: int = 0, flags: int = 0, stream: int = 0) -> bytes:
+    return HEADER.pack(VERSION, kind, codec, flags, stream) + payload
+
+
+def decode_frame(data: bytes) -> Frame:
+    """
+    Split a binary frame into its header fields and payload.
+
+    Raises:
+        ProtocolError: If the frame is too short or of an unknown version, kind or codec
+    """
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Binary frames need a header of {HEADER.size} bytes")
+    version, kind, codec, flags, stream = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ProtocolError(f"Unsupported frame version {version}")
+    if kind not in (MESSAGE, AUDIO):
+        raise ProtocolError(f"Unknown frame kind {kind}")
+    if kind == AUDIO and codec not in CODECS:
+        raise ProtocolError(f"Unknown audio codec {codec}")
+    return Frame(kind, codec, flags, stream, data[HEADER.size:])
+
+
+def audio_frames(stream: int, audio: bytes, codec: str = "wav", frame_bytes: int = 32768) -> Iterator[Message]:
+    """Split audio into outgoing frames for the outbox, the last one flagged END."""
+    codec_id = CODEC_IDS[codec]
+    for offset in range(0, max(len(audio), 1), frame_bytes):
+        last = offset + frame_bytes >= len(audio)
+        yield {"type": AUDIO_FRAME, "stream": stream, "codec": codec_id,
+               "flags": END if last else 0, "data": audio[offset:offset + frame_bytes]}
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = 16000, channels: int = 1) -> bytes:
+    """Wrap raw 16-bit little-endian PCM in a WAV header."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return buffer.getvalue()
+
+
+class JSONProtocol:
+    """The original protocol: every message is a JSON text frame. Audio travels by URL."""
+
+    name: Optional[str] = None
+    binary = False
+
+    async def receive(self, websocket) -> Tuple[Optional[Message], Optional[Frame]]:
+        """
+        Wait for the client's next message.
+
+        Returns:
+            (message, None)
+
+        Raises:
+            ProtocolError: If the message isn't valid JSON
+            WebSocketDisconnect: If the client went away
+        """
+        data = await websocket.receive_text()
+        return self._parse(data), None
+
+    async def send(self, websocket, message: Message) -> None:
+        await websocket.send_json(message)
+
+    @staticmethod
+    def _parse(data) -> Message:
+        try:
+            message = json.loads(data)
+        except ValueError:
+            raise ProtocolError("Invalid JSON") from None
+        if not isinstance(message, dict):
+            raise ProtocolError("Messages must be JSON objects")
+        return message
+
+
+class BinaryProtocol(JSONProtocol):
+    """
+    Binary frames with a fixed 8-byte header, negotiated with the
+    companion.binary.v1 subprotocol.
+
+    Messages are the same JSON objects as in the text protocol, in MESSAGE
+    frames; audio travels raw in AUDIO frames in both directions, grouped
+    into numbered streams that JSON messages refer to. Text frames from the
+    client are still accepted as JSON messages.
+    """
+
+    name = BINARY_SUBPROTOCOL
+    binary = True
+
+    def __init__(self):
+        self._next_stream = 0
+
+    def open_stream(self) -> int:
+        """Number a new outgoing audio stream."""
+        self._next_stream = self._next_stream % 0xFFFFFFFF + 1
+        return self._next_stream
+
+    async def receive(self, websocket) -> Tuple[Optional[Message], Optional[Frame]]:
+        """
+        Wait for the client's next message or audio frame.
+
+        Returns:
+            (message, None) or (None, audio frame)
+
+        Raises:
+            ProtocolError: If the frame or message is malformed
+            WebSocketDisconnect: If the client went away
+        """
+        event = await websocket.receive()
+        if event["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(event.get("code", 1000))
+        if event.get("text") is not None:
+            return self._parse(event["text"]), None
+        frame = decode_frame(event.get("bytes") or b"")
+        if frame.kind == AUDIO:
+            return None, frame
+        return self._parse(frame.payload.decode("utf-8", errors="replace")), None
+
+    async def send(self, websocket, message: Message) -> None:
+        if message.get("type") == AUDIO_FRAME:
+            data = encode_frame(AUDIO, message["data"], message["codec"], message["flags"], message["stream"])
+        else:
+            data = encode_frame(MESSAGE, json.dumps(message, separators=(",", ":")).encode("utf-8"))
+        await websocket.send_bytes(data)
+
+
+def negotiate(subprotocols: Sequence[str]) -> JSONProtocol:
+    """Pick the protocol for a connection from the subprotocols the client offered."""
+    return BinaryProtocol() if BINARY_SUBPROTOCOL in subprotocols else JSONProtocol()
+
+
+class AudioUpload:
+    """An incoming audio stream, collected until its END frame."""
+
+    __slots__ = ("message", "codec", "chunks", "size")
+
+    def __init__(self, message: Message, codec: str):
+        # The "voice" message that opened the stream
+        self.message = message
+        self.codec = codec
+        self.chunks: List[bytes] = []
+        self.size = 0
+
+    def add(self, frame: Frame, max_bytes: int) -> None:
+        """
+        Raises:
+            ProtocolError: If the frame's codec differs from the stream's, or
+                the stream grew beyond max_bytes
+        """
+        if CODECS[frame.codec] != self.codec:
+            raise ProtocolError(f"Stream {frame.stream} was opened as {self.codec}, not {CODECS[frame.codec]}")
+        self.size += len(frame.payload)
+        if self.size > max_bytes:
+            raise ProtocolError(f"Audio stream {frame.stream} is larger than {max_bytes} bytes")
+        self.chunks.append(frame.payload)
+
+    def audio(self) -> bytes:
+        """
+        The stream's audio, raw PCM wrapped as WAV, ready for STT.
+
+        Raises:
+            ProtocolError: If the audio isn't in its codec's container, e.g.
+                raw Opus packets sent as "opus"
+        """
+        audio = b"".join(self.chunks)
+        if self.codec == "pcm_s16le":
+            return pcm_to_wav(audio, int(self.message.get("sample_rate", 16000)),
+                              int(self.message.get("channels", 1)))
+        container, magic = CONTAINERS[self.codec]
+        if not audio.startswith(magic):
+            raise ProtocolError(f"Audio sent as {self.codec} must be a complete {container} stream")
+        return audio
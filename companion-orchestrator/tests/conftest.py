@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Tests import the orchestrator's modules the way main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing main must not open stores or trace files outside the test's temp dirs
+for name in ("TRACE_FILE", "CONVERSATION_DB", "MEMORY_DIR", "FILLER_CLIPS"):
+    os.environ.setdefault(name, "off")
@@ -0,0 +1,189 @@
+"""Tests for the audio store and how stored audio is served."""
+import asyncio
+import os
+import time
+
+import pytest
+from starlette.requests import Request
+
+from services.audio_store import AudioStore
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def make_store(directory, **kwargs):
+    kwargs.setdefault("memory_bytes", 1024 * 1024)
+    kwargs.setdefault("disk_bytes", 1024 * 1024)
+    return AudioStore(directory=str(directory), **kwargs)
+
+
+def age(directory, key, seconds):
+    then = time.time() - seconds
+    os.utime(os.path.join(str(directory), key), (then, then))
+
+
+def test_put_is_content_addressed(tmp_path):
+    store = make_store(tmp_path)
+    key = run(store.put(b"RIFF audio"))
+    assert key == AudioStore.key_for(b"RIFF audio")
+    assert run(store.put(b"RIFF audio")) == key
+    assert run(store.put(b"RIFF audio", "mp3")) == key.replace(".wav", ".mp3")
+    assert AudioStore.is_valid_key(key)
+    assert sorted(os.listdir(str(tmp_path))) == [key.replace(".wav", ".mp3"), key]
+
+
+@pytest.mark.parametrize("key", ["../etc/passwd", "abc.wav", "", AudioStore.key_for(b"x") + ".tmp"])
+def test_invalid_keys_are_rejected(tmp_path, key):
+    assert not AudioStore.is_valid_key(key)
+    assert run(make_store(tmp_path).get(key)) is None
+
+
+def test_clips_larger_than_the_hot_tier_are_read_from_disk(tmp_path):
+    store = make_store(tmp_path, memory_bytes=10)
+    data = b"x" * 100
+    key = run(store.put(data))
+    assert key not in store._hot
+    assert run(store.get(key)) == data
+
+
+def test_another_worker_sees_clips_in_a_shared_directory(tmp_path):
+    writer, reader = make_store(tmp_path), make_store(tmp_path)
+    key = run(writer.put(b"shared clip"))
+    assert run(reader.get(key)) == b"shared clip"
+    assert reader.contains(key)
+
+
+def test_concurrent_writers_of_the_same_clip_leave_no_temp_files(tmp_path):
+    stores = [make_store(tmp_path) for _ in range(4)]
+    data = b"y" * 50000
+
+    async def put_all():
+        return await asyncio.gather(*(store.put(data) for store in stores))
+
+    keys = run(put_all())
+    assert len(set(keys)) == 1
+    assert os.listdir(str(tmp_path)) == [keys[0]]
+
+
+def test_sweep_removes_clips_older_than_the_ttl(tmp_path):
+    store = make_store(tmp_path, ttl=60)
+    old = run(store.put(b"old clip"))
+    new = run(store.put(b"new clip"))
+    age(tmp_path, old, 120)
+    run(store.sweep())
+    assert not store.contains(old)
+    assert run(store.get(old)) is None
+    assert run(store.get(new)) == b"new clip"
+    assert os.listdir(str(tmp_path)) == [new]
+
+
+def test_storing_again_refreshes_the_ttl(tmp_path):
+    store = make_store(tmp_path, ttl=60)
+    key = run(store.put(b"clip"))
+    age(tmp_path, key, 120)
+    run(store.put(b"clip"))
+    run(store.sweep())
+    assert run(store.get(key)) == b"clip"
+
+
+def test_sweep_expires_clips_written_by_another_worker(tmp_path):
+    writer, sweeper = make_store(tmp_path, ttl=60), make_store(tmp_path, ttl=60)
+    key = run(writer.put(b"clip"))
+    age(tmp_path, key, 120)
+    run(sweeper.sweep())
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_disk_cap_evicts_oldest_first(tmp_path):
+    store = make_store(tmp_path, memory_bytes=0, disk_bytes=250)
+    keys = [run(store.put(bytes([i]) * 100)) for i in range(3)]
+    assert not store.contains(keys[0])
+    assert run(store.get(keys[0])) is None
+    assert run(store.get(keys[2])) == bytes([2]) * 100
+
+
+def test_sweep_caps_a_directory_shared_by_workers(tmp_path):
+    first, second = make_store(tmp_path, disk_bytes=1000), make_store(tmp_path, disk_bytes=1000)
+    keys = []
+    for i in range(3):
+        keys.append(run(first.put(bytes([i]) * 300)))
+        keys.append(run(second.put(bytes([i + 10]) * 300)))
+        for j, key in enumerate(keys):
+            age(tmp_path, key, 100 - j)
+    run(first.sweep())
+    assert sorted(os.listdir(str(tmp_path))) == sorted(keys[-3:])
+    run(second.sweep())
+    # Of the clips left, the second worker wrote keys[3] and keys[5]
+    assert set(second._disk) == {keys[3], keys[5]}
+    assert second._disk_size == 600
+
+
+@pytest.fixture(scope="module")
+def main():
+    import main
+    return main
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-3", (0, 3)),
+    ("bytes=4-", (4, 9)),
+    ("bytes=-3", (7, 9)),
+    ("bytes=-30", (0, 9)),
+    ("bytes=5-100", (5, 9)),
+    ("bytes=9-9", (9, 9)),
+    ("bytes=10-", None),
+    ("bytes=5-4", None),
+    ("bytes=-0", None),
+    ("bytes=0-1,4-5", None),
+    ("items=0-3", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range_header(main, header, expected):
+    assert main.parse_range_header(header, 10) == expected
+
+
+def request_with(headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/audio/clip",
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_audio_response_serves_whole_clip_with_validators(main):
+    data = b"0123456789"
+    key = AudioStore.key_for(data)
+    response = main.audio_response(request_with({}), key, data)
+    assert response.status_code == 200
+    assert response.body == data
+    assert response.headers["etag"] == f'"{key.split(".")[0]}"'
+    assert response.headers["accept-ranges"] == "bytes"
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_audio_response_not_modified_for_matching_etag(main):
+    data = b"0123456789"
+    key = AudioStore.key_for(data)
+    etag = f'"{key.split(".")[0]}"'
+    response = main.audio_response(request_with({"If-None-Match": etag}), key, data)
+    assert response.status_code == 304
+    assert response.body == b""
+    response = main.audio_response(request_with({"If-None-Match": '"other"'}), key, data)
+    assert response.status_code == 200
+
+
+def test_audio_response_serves_ranges(main):
+    data = b"0123456789"
+    key = AudioStore.key_for(data)
+    response = main.audio_response(request_with({"Range": "bytes=2-5"}), key, data)
+    assert response.status_code == 206
+    assert response.body == b"2345"
+    assert response.headers["content-range"] == "bytes 2-5/10"
+    response = main.audio_response(request_with({"Range": "bytes=-2"}), key, data)
+    assert response.body == b"89"
+    response = main.audio_response(request_with({"Range": "bytes=20-"}), key, data)
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10"
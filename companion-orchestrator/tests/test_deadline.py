@@ -0,0 +1,134 @@
+"""Tests for request deadlines and stage budgets."""
+import importlib
+
+import pytest
+
+from services.deadline import (
+    DEFAULT_BUDGETS,
+    DEFAULT_TIMEOUTS,
+    configure_deadlines,
+    current_deadline,
+    deadline,
+    record_exceeded,
+    stage_timeout,
+)
+
+# The package exports the deadline() helper under the module's own name
+deadlines = importlib.import_module("services.deadline")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(deadlines, "time", fake)
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def budgets(monkeypatch):
+    monkeypatch.setattr(deadlines, "_budgets", dict(DEFAULT_BUDGETS))
+    for endpoint in DEFAULT_TIMEOUTS:
+        monkeypatch.delenv(f"DEADLINE_{endpoint.upper()}", raising=False)
+    monkeypatch.delenv("DEADLINE_BUDGETS", raising=False)
+
+
+def test_stage_gets_its_budget_while_time_is_left(clock):
+    with deadline("chat", 10.0) as active:
+        assert active.stage_timeout("llm") == pytest.approx(6.0)
+        assert active.stage_timeout("tts") == pytest.approx(4.0)
+        assert active.stage_timeout("stt") == pytest.approx(6.7)
+
+
+def test_stage_gets_what_is_left_when_that_is_less(clock):
+    with deadline("chat", 10.0) as active:
+        clock.now += 7.0
+        assert active.remaining() == pytest.approx(3.0)
+        assert active.stage_timeout("llm") == pytest.approx(3.0)
+        clock.now += 5.0
+        assert active.remaining() == 0.0
+        assert active.stage_timeout("tts") == 0.0
+
+
+def test_stage_without_a_budget_gets_the_rest(clock):
+    with deadline("chat", 10.0) as active:
+        clock.now += 1.0
+        assert active.stage_timeout("embed") == pytest.approx(9.0)
+
+
+def test_stage_timeout_applies_only_inside_a_deadline(clock):
+    assert stage_timeout("llm", 120.0) == 120.0
+    with deadline("voice", 20.0):
+        assert stage_timeout("llm", 120.0) == pytest.approx(12.0)
+        with deadline("ws_turn", 5.0):
+            assert stage_timeout("llm", 120.0) == pytest.approx(3.0)
+        assert stage_timeout("llm", 120.0) == pytest.approx(12.0)
+    assert stage_timeout("llm", None) is None
+    assert current_deadline() is None
+
+
+def test_no_deadline_keeps_the_backend_timeouts():
+    with deadline("chat", None) as active:
+        assert active is None
+        assert current_deadline() is None
+        assert stage_timeout("tts", 60.0) == 60.0
+
+
+def test_exceeded_stages_are_recorded_once():
+    with deadline("chat", 10.0) as active:
+        record_exceeded("llm")
+        record_exceeded("llm")
+        record_exceeded("tts")
+        assert active.exceeded == ["llm", "tts"]
+    # Outside a deadline it is only counted
+    record_exceeded("llm")
+
+
+def test_turns_have_no_deadline_by_default():
+    timeouts = configure_deadlines()
+    assert timeouts == DEFAULT_TIMEOUTS
+    assert timeouts["chat"] is None and timeouts["ws_voice"] is None
+    assert deadlines._budgets == DEFAULT_BUDGETS
+
+
+def test_configure_from_environment(monkeypatch):
+    monkeypatch.setenv("DEADLINE_CHAT", "30")
+    monkeypatch.setenv("DEADLINE_LLM_GENERATE", "off")
+    monkeypatch.setenv("DEADLINE_TEXT_TO_SPEECH", "0")
+    monkeypatch.setenv("DEADLINE_BUDGETS", "llm=0.5, tts=0.25,")
+    timeouts = configure_deadlines()
+    assert timeouts["chat"] == 30.0
+    assert timeouts["voice"] is None
+    assert timeouts["llm_generate"] is None
+    assert timeouts["text_to_speech"] is None
+    assert deadlines._budgets == {"llm": 0.5, "tts": 0.25}
+    with deadline("chat", timeouts["chat"]) as active:
+        assert active.stage_timeout("llm") == pytest.approx(15.0)
+
+
+@pytest.fixture(scope="module")
+def main():
+    import main
+    return main
+
+
+def test_request_timeout(main, monkeypatch):
+    from fastapi import HTTPException
+    monkeypatch.setitem(main.request_timeouts, "chat", None)
+    monkeypatch.setitem(main.request_timeouts, "llm_generate", 600.0)
+    assert main.request_timeout("chat") is None
+    assert main.request_timeout("chat", "") is None
+    assert main.request_timeout("llm_generate") == 600.0
+    assert main.request_timeout("chat", "2.5") == 2.5
+    assert main.request_timeout("chat", 4) == 4.0
+    for bad in ("0", "-1", "soon", "inf", "nan", [1]):
+        with pytest.raises(HTTPException) as error:
+            main.request_timeout("chat", bad)
+        assert error.value.status_code == 400
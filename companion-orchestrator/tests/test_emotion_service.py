@@ -0,0 +1,62 @@
+"""Tests for incremental emotion scoring."""
+import pytest
+
+from services.emotion_service import EmotionService
+
+TEXTS = [
+    "",
+    "The weather report is out.",
+    "I'm so happy and glad you came, what a wonderful day!",
+    "I'm sorry, that is sad and unfortunate.",
+    "Hmm, I don't understand, I'm confused and unsure.",
+    "Wow, that's amazing and incredible!",
+    "Happy happy happy, but also sad.",
+    "I am angry and upset, and also a little sad and disappointed.",
+    "Tell me more, this is interesting. Let me think about it.",
+    "So boring. WHAT? I don't understand.",
+]
+
+
+def chunks(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_stream_matches_one_shot_analysis(text, size):
+    service = EmotionService()
+    stream = service.create_stream()
+    for fragment in chunks(text, size):
+        stream.feed(fragment)
+    assert stream.emotion == service.analyze_emotion(text)
+
+
+def test_keyword_split_across_fragments_is_matched():
+    stream = EmotionService().create_stream()
+    assert stream.feed("I don't und") is None
+    assert stream.feed("erstand") == "confused"
+
+
+def test_feed_reports_only_changes():
+    stream = EmotionService().create_stream()
+    assert stream.feed("") is None
+    assert stream.feed("Nothing to see. ") is None
+    assert stream.feed("I'm happy") == "happy"
+    assert stream.feed(" and glad") is None
+    assert stream.emotion == "happy"
+
+
+def test_repeated_keyword_counts_once():
+    service = EmotionService()
+    stream = service.create_stream()
+    for fragment in ["sad ", "sad ", "sad ", "happy ", "glad"]:
+        stream.feed(fragment)
+    assert stream.emotion == "happy"
+    assert service.analyze_emotion("sad sad sad happy glad") == "happy"
+
+
+def test_first_emotion_wins_ties():
+    stream = EmotionService().create_stream()
+    stream.feed("sad")
+    assert stream.emotion == "sad"
+    assert stream.feed(" and happy") == "happy"
@@ -0,0 +1,172 @@
+"""Tests for priority scheduling of backend slots."""
+import asyncio
+
+import pytest
+
+from services.scheduler import (
+    BATCH,
+    TEXT,
+    VOICE,
+    PriorityScheduler,
+    ResourceScheduler,
+    parse_priority,
+    priority,
+)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def queue_calls(scheduler, levels):
+    """Start one acquire per level, in order; returns the list levels are appended to once granted."""
+    granted = []
+
+    async def call(level):
+        await scheduler.acquire(level)
+        granted.append(level)
+
+    tasks = []
+    for level in levels:
+        tasks.append(asyncio.ensure_future(call(level)))
+        await settle()
+    return granted, tasks
+
+
+async def drain(scheduler, granted, tasks, first_level):
+    """Release the running call each time one is granted, until all have run."""
+    scheduler.release(first_level)
+    for released in range(len(tasks)):
+        await settle()
+        scheduler.release(granted[released])
+    return granted
+
+
+def test_waiting_calls_are_granted_by_priority():
+    async def main():
+        scheduler = ResourceScheduler("llm", 1, batch_share=0)
+        await scheduler.acquire(TEXT)
+        granted, tasks = await queue_calls(scheduler, [BATCH, TEXT, VOICE, TEXT, VOICE])
+        assert granted == []
+        assert scheduler.waiting() == 5
+        return await drain(scheduler, granted, tasks, TEXT)
+    assert asyncio.run(main()) == [VOICE, VOICE, TEXT, TEXT, BATCH]
+
+
+@pytest.mark.parametrize("share, expected", [
+    (0.25, [VOICE, VOICE, VOICE, BATCH, VOICE, VOICE, BATCH]),
+    (0.5, [VOICE, BATCH, VOICE, BATCH, VOICE, VOICE, VOICE]),
+    (1.0, [BATCH, BATCH, VOICE, VOICE, VOICE, VOICE, VOICE]),
+    (0, [VOICE, VOICE, VOICE, VOICE, VOICE, BATCH, BATCH]),
+])
+def test_batch_share_guarantees_batch_a_fraction_of_grants(share, expected):
+    async def main():
+        scheduler = ResourceScheduler("llm", 1, batch_share=share, batch_max=1)
+        await scheduler.acquire(VOICE)
+        granted, tasks = await queue_calls(scheduler, [BATCH, BATCH] + [VOICE] * 5)
+        return await drain(scheduler, granted, tasks, VOICE)
+    assert asyncio.run(main()) == expected
+
+
+@pytest.mark.parametrize("limit, batch_max, expected", [
+    (4, None, 3),
+    (4, 2, 2),
+    (4, 10, 4),
+    (1, None, 1),
+    (2, 0, 1),
+])
+def test_batch_max_is_clamped(limit, batch_max, expected):
+    assert ResourceScheduler("llm", limit, batch_max=batch_max).batch_max == expected
+
+
+def test_batch_calls_never_hold_more_than_batch_max_slots():
+    async def main():
+        scheduler = ResourceScheduler("llm", 3)
+        assert scheduler.batch_max == 2
+        granted, _ = await queue_calls(scheduler, [BATCH, BATCH, BATCH])
+        assert granted == [BATCH, BATCH]
+        assert scheduler.active == 2
+        # The free slot still goes to interactive calls straight away
+        assert await scheduler.acquire(VOICE) == 0.0
+        assert scheduler.active == 3
+        scheduler.release(VOICE)
+        assert len(granted) == 2
+        scheduler.release(BATCH)
+        await settle()
+        assert granted == [BATCH, BATCH, BATCH]
+        assert scheduler.batch_active == 2
+    asyncio.run(main())
+
+
+def test_capped_batch_call_does_not_block_later_interactive_calls():
+    async def main():
+        scheduler = ResourceScheduler("llm", 2, batch_max=1)
+        granted, _ = await queue_calls(scheduler, [BATCH, BATCH, TEXT])
+        assert granted == [BATCH, TEXT]
+        assert scheduler.waiting() == 1
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        scheduler = ResourceScheduler("llm", 1)
+        await scheduler.acquire(TEXT)
+        granted, tasks = await queue_calls(scheduler, [VOICE, TEXT])
+        tasks[0].cancel()
+        await settle()
+        assert scheduler.waiting() == 1
+        scheduler.release(TEXT)
+        await settle()
+        assert granted == [TEXT]
+        assert scheduler.active == 1
+    asyncio.run(main())
+
+
+def test_slot_granted_to_a_cancelled_waiter_is_handed_on():
+    async def main():
+        scheduler = ResourceScheduler("llm", 1)
+        await scheduler.acquire(TEXT)
+        granted, tasks = await queue_calls(scheduler, [VOICE, TEXT])
+        # Grant the slot and cancel the waiter before it resumes
+        scheduler.release(TEXT)
+        tasks[0].cancel()
+        await settle()
+        assert granted == [TEXT]
+        assert scheduler.active == 1
+    asyncio.run(main())
+
+
+def test_no_limit_when_disabled():
+    async def main():
+        scheduler = ResourceScheduler("llm", 0)
+        for _ in range(10):
+            assert await scheduler.acquire(BATCH) == 0.0
+        scheduler.release(BATCH)
+        assert scheduler.active == 0
+    asyncio.run(main())
+
+
+def test_slot_uses_the_callers_priority_and_times_out():
+    async def main():
+        scheduler = PriorityScheduler({"llm": 1})
+        with priority(BATCH):
+            async with scheduler.slot("llm") as waited:
+                assert waited == 0.0
+                assert scheduler.resources["llm"].batch_active == 1
+                with pytest.raises(asyncio.TimeoutError):
+                    async with scheduler.slot("llm", VOICE, timeout=0.01):
+                        pass
+                assert scheduler.resources["llm"].waiting() == 0
+        assert scheduler.resources["llm"].active == 0
+        # Backends without a limit are not scheduled
+        async with scheduler.slot("tts") as waited:
+            assert waited == 0.0
+    asyncio.run(main())
+
+
+def test_parse_priority():
+    assert parse_priority(" Voice ") == VOICE
+    assert parse_priority("batch") == BATCH
+    with pytest.raises(ValueError, match="expected one of"):
+        parse_priority("urgent")
@@ -0,0 +1,202 @@
+"""Tests for the shared state store and its RESP client."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+from services.state_store import (
+    InMemoryStateStore,
+    RedisStateStore,
+    RESPError,
+    create_state_store,
+    encode_command,
+    read_reply,
+)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "bench"))
+from resp_server import RESPServer  # noqa: E402
+
+
+class GatedServer(RESPServer):
+    """RESP stand-in that holds the reply to GET slow until released."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = asyncio.Event()
+        self.release = asyncio.Event()
+        self.writers = []
+
+    async def handle_client(self, reader, writer):
+        self.writers.append(writer)
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                if command[0].upper() == b"GET" and command[1:] == [b"slow"]:
+                    self.waiting.set()
+                    await self.release.wait()
+                writer.write(self._execute(command[0].upper(), command[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def drop_clients(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+
+
+def with_server(scenario, server_class=RESPServer):
+    """Run scenario(store, server) against a stand-in on a free port."""
+    async def main():
+        server = server_class()
+        listener = await asyncio.start_server(server.handle_client, "127.0.0.1", 0)
+        store = RedisStateStore(port=listener.sockets[0].getsockname()[1])
+        try:
+            await scenario(store, server)
+        finally:
+            await store.close()
+            listener.close()
+            await listener.wait_closed()
+    asyncio.run(main())
+
+
+def parse(data: bytes):
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_reply(reader)
+    return asyncio.run(main())
+
+
+def test_encode_command():
+    assert encode_command("SET", "key", 12) == b"*3\r\n$3\r\nSET\r\n$3\r\nkey\r\n$2\r\n12\r\n"
+    assert encode_command(b"GET", "café") == b"*2\r\n$3\r\nGET\r\n$5\r\ncaf\xc3\xa9\r\n"
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"+OK\r\n", "OK"),
+    (b":42\r\n", 42),
+    (b"$5\r\nhello\r\n", "hello"),
+    (b"$0\r\n\r\n", ""),
+    (b"$-1\r\n", None),
+    (b"*-1\r\n", None),
+    (b"*3\r\n$7\r\nmessage\r\n$4\r\nchan\r\n:1\r\n", ["message", "chan", 1]),
+])
+def test_read_reply(data, expected):
+    assert parse(data) == expected
+
+
+def test_read_reply_errors():
+    with pytest.raises(RESPError, match="ERR wrong"):
+        parse(b"-ERR wrong\r\n")
+    with pytest.raises(ConnectionError):
+        parse(b"")
+
+
+def test_get_set_delete_and_ttl():
+    async def scenario(store, server):
+        assert await store.get("missing") is None
+        await store.set("key", "value")
+        assert await store.get("key") == "value"
+        await store.delete("key")
+        assert await store.get("key") is None
+        await store.set_json("json", {"a": [1, 2]}, ttl=0.05)
+        assert await store.get_json("json") == {"a": [1, 2]}
+        await store.expire("json", 60)
+        await asyncio.sleep(0.1)
+        assert await store.get_json("json") == {"a": [1, 2]}
+        await store.expire("json", 0.01)
+        await asyncio.sleep(0.05)
+        assert await store.get("json") is None
+    with_server(scenario)
+
+
+def test_error_reply_keeps_the_connection_in_step():
+    async def scenario(store, server):
+        await store.set("key", "value")
+        with pytest.raises(RESPError):
+            await store.execute("NOSUCHCOMMAND")
+        assert await store.get("key") == "value"
+    with_server(scenario)
+
+
+def test_cancelled_command_does_not_leak_its_reply():
+    async def scenario(store, server):
+        await store.set("slow", "alice-secret")
+        await store.set("other", "bob")
+        pending = asyncio.ensure_future(store.get("slow"))
+        # The command has been sent and its reply is held by the server
+        await server.waiting.wait()
+        pending.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        server.release.set()
+        assert await store.get("other") == "bob"
+        assert await store.get("slow") == "alice-secret"
+    with_server(scenario, GatedServer)
+
+
+def test_concurrent_commands_get_their_own_replies():
+    async def scenario(store, server):
+        await asyncio.gather(*(store.set(f"key{i}", str(i)) for i in range(20)))
+        values = await asyncio.gather(*(store.get(f"key{i}") for i in range(20)))
+        assert values == [str(i) for i in range(20)]
+    with_server(scenario)
+
+
+def test_reconnects_after_the_server_drops_the_connection():
+    async def scenario(store, server):
+        await store.set("key", "value")
+        server.drop_clients()
+        await asyncio.sleep(0.05)
+        assert await store.get("key") == "value"
+    with_server(scenario, GatedServer)
+
+
+def test_publish_reaches_subscribers():
+    async def scenario(store, server):
+        received = asyncio.Queue()
+        await store.subscribe("events", received.put)
+        # The subscription is on its own connection; wait until it is registered
+        while not server.subscribers.get(b"events"):
+            await asyncio.sleep(0.01)
+        await store.publish("events", "hello")
+        assert await asyncio.wait_for(received.get(), 2) == "hello"
+    with_server(scenario)
+
+
+def test_in_memory_store_ttl_and_publish():
+    async def main():
+        store = InMemoryStateStore()
+        await store.set("key", "value", ttl=0.02)
+        assert await store.get("key") == "value"
+        await asyncio.sleep(0.05)
+        assert await store.get("key") is None
+        await store.set("kept", "value", ttl=0.02)
+        await store.expire("kept", 60)
+        await asyncio.sleep(0.05)
+        assert await store.get("kept") == "value"
+        received = []
+
+        async def handler(message):
+            received.append(message)
+        await store.subscribe("events", handler)
+        await store.publish("events", "hello")
+        assert received == ["hello"]
+    asyncio.run(main())
+
+
+def test_create_state_store():
+    assert isinstance(create_state_store(None), InMemoryStateStore)
+    assert isinstance(create_state_store("memory://"), InMemoryStateStore)
+    store = create_state_store("redis://:secret@cache:6380/2")
+    assert isinstance(store, RedisStateStore)
+    assert (store.host, store.port, store.db, store.password) == ("cache", 6380, 2, "secret")
+    with pytest.raises(ValueError):
+        create_state_store("memcached://cache")
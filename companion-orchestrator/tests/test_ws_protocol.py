@@ -0,0 +1,205 @@
+"""Tests for the websocket protocols and binary frame format."""
+import asyncio
+import io
+import json
+import wave
+
+import pytest
+from starlette.websockets import WebSocketDisconnect
+
+from services.ws_protocol import (
+    AUDIO,
+    AUDIO_FRAME,
+    BINARY_SUBPROTOCOL,
+    CODEC_IDS,
+    END,
+    HEADER,
+    MESSAGE,
+    AudioUpload,
+    BinaryProtocol,
+    Frame,
+    JSONProtocol,
+    ProtocolError,
+    audio_frames,
+    decode_frame,
+    encode_frame,
+    negotiate,
+)
+
+
+class FakeWebSocket:
+    """Replays queued ASGI receive events and records what is sent."""
+
+    def __init__(self, *events):
+        self.events = list(events)
+        self.sent = []
+
+    async def receive(self):
+        return self.events.pop(0)
+
+    async def receive_text(self):
+        return self.events.pop(0)["text"]
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_header_layout():
+    assert HEADER.size == 8
+    data = encode_frame(AUDIO, b"abc", codec=CODEC_IDS["opus"], flags=END, stream=0x01020304)
+    assert data == b"\x01\x02\x03\x01\x01\x02\x03\x04abc"
+
+
+@pytest.mark.parametrize("kind, codec, flags, stream, payload", [
+    (MESSAGE, 0, 0, 0, b'{"type":"ping"}'),
+    (AUDIO, CODEC_IDS["pcm_s16le"], 0, 1, b"\x00\x01" * 100),
+    (AUDIO, CODEC_IDS["wav"], END, 0xFFFFFFFF, b""),
+    (AUDIO, CODEC_IDS["webm"], END, 42, b"\x1a\x45\xdf\xa3"),
+])
+def test_frames_round_trip(kind, codec, flags, stream, payload):
+    frame = decode_frame(encode_frame(kind, payload, codec, flags, stream))
+    assert (frame.kind, frame.codec, frame.flags, frame.stream, frame.payload) == (kind, codec, flags, stream, payload)
+    assert frame.end == bool(flags & END)
+
+
+@pytest.mark.parametrize("data, error", [
+    (b"", "header of 8 bytes"),
+    (b"\x01\x02\x01\x00\x00\x00\x00", "header of 8 bytes"),
+    (b"\x02\x01\x00\x00\x00\x00\x00\x00{}", "version 2"),
+    (b"\x01\x07\x00\x00\x00\x00\x00\x00", "kind 7"),
+    (b"\x01\x02\x09\x00\x00\x00\x00\x01", "codec 9"),
+    (b"\x01\x02\x00\x00\x00\x00\x00\x01", "codec 0"),
+])
+def test_malformed_frames_are_rejected(data, error):
+    with pytest.raises(ProtocolError, match=error):
+        decode_frame(data)
+
+
+def test_message_frames_ignore_the_codec_byte():
+    assert decode_frame(b"\x01\x01\x09\x00\x00\x00\x00\x00{}").kind == MESSAGE
+
+
+def test_audio_is_split_into_frames_ending_with_end():
+    frames = list(audio_frames(7, b"x" * 10, frame_bytes=4))
+    assert [frame["data"] for frame in frames] == [b"xxxx", b"xxxx", b"xx"]
+    assert [frame["flags"] for frame in frames] == [0, 0, END]
+    assert {frame["stream"] for frame in frames} == {7}
+    assert {frame["codec"] for frame in frames} == {CODEC_IDS["wav"]}
+    assert {frame["type"] for frame in frames} == {AUDIO_FRAME}
+    assert [f["flags"] for f in audio_frames(1, b"x" * 8, frame_bytes=4)] == [0, END]
+
+
+def test_empty_audio_is_a_single_end_frame():
+    frames = list(audio_frames(1, b"", "pcm_s16le"))
+    assert len(frames) == 1
+    assert frames[0]["flags"] == END and frames[0]["data"] == b""
+
+
+def test_stream_numbers_wrap_and_skip_zero():
+    protocol = BinaryProtocol()
+    assert [protocol.open_stream() for _ in range(2)] == [1, 2]
+    protocol._next_stream = 0xFFFFFFFF
+    assert protocol.open_stream() == 1
+
+
+def test_negotiate():
+    assert isinstance(negotiate([]), JSONProtocol)
+    assert not negotiate(["other"]).binary
+    protocol = negotiate(["other", BINARY_SUBPROTOCOL])
+    assert isinstance(protocol, BinaryProtocol)
+    assert protocol.name == BINARY_SUBPROTOCOL
+
+
+def test_binary_protocol_receive():
+    audio = encode_frame(AUDIO, b"pcm", CODEC_IDS["pcm_s16le"], END, 3)
+    websocket = FakeWebSocket(
+        {"type": "websocket.receive", "text": '{"type": "chat"}'},
+        {"type": "websocket.receive", "bytes": encode_frame(MESSAGE, b'{"type": "voice", "stream": 3}')},
+        {"type": "websocket.receive", "bytes": audio},
+        {"type": "websocket.disconnect", "code": 1001},
+    )
+    protocol = BinaryProtocol()
+    assert run(protocol.receive(websocket)) == ({"type": "chat"}, None)
+    assert run(protocol.receive(websocket)) == ({"type": "voice", "stream": 3}, None)
+    message, frame = run(protocol.receive(websocket))
+    assert message is None
+    assert (frame.stream, frame.payload, frame.end) == (3, b"pcm", True)
+    with pytest.raises(WebSocketDisconnect) as disconnect:
+        run(protocol.receive(websocket))
+    assert disconnect.value.code == 1001
+
+
+@pytest.mark.parametrize("event", [
+    {"type": "websocket.receive", "text": "not json"},
+    {"type": "websocket.receive", "text": "[1, 2]"},
+    {"type": "websocket.receive", "bytes": encode_frame(MESSAGE, b"\xff\xfe")},
+    {"type": "websocket.receive", "bytes": b"\x01"},
+    {"type": "websocket.receive", "bytes": None},
+])
+def test_binary_protocol_rejects_malformed_input(event):
+    with pytest.raises(ProtocolError):
+        run(BinaryProtocol().receive(FakeWebSocket(event)))
+
+
+def test_binary_protocol_send():
+    websocket = FakeWebSocket()
+    protocol = BinaryProtocol()
+    run(protocol.send(websocket, {"type": "token", "text": "hé"}))
+    for frame in audio_frames(5, b"abcdef", "wav", frame_bytes=4):
+        run(protocol.send(websocket, frame))
+    message = decode_frame(websocket.sent[0])
+    assert message.kind == MESSAGE
+    assert json.loads(message.payload) == {"type": "token", "text": "hé"}
+    assert b" " not in message.payload
+    audio = [decode_frame(data) for data in websocket.sent[1:]]
+    assert [(f.kind, f.stream, f.payload, f.end) for f in audio] == [(AUDIO, 5, b"abcd", False), (AUDIO, 5, b"ef", True)]
+
+
+def test_json_protocol():
+    websocket = FakeWebSocket({"text": '{"type": "chat"}'}, {"text": "oops"})
+    protocol = JSONProtocol()
+    assert run(protocol.receive(websocket)) == ({"type": "chat"}, None)
+    with pytest.raises(ProtocolError, match="Invalid JSON"):
+        run(protocol.receive(websocket))
+    run(protocol.send(websocket, {"type": "done"}))
+    assert websocket.sent == [{"type": "done"}]
+
+
+def audio_frame(codec, payload, stream=1):
+    return Frame(AUDIO, CODEC_IDS[codec], 0, stream, payload)
+
+
+def test_pcm_upload_is_wrapped_as_wav():
+    upload = AudioUpload({"type": "voice", "sample_rate": 8000, "channels": 2}, "pcm_s16le")
+    upload.add(audio_frame("pcm_s16le", b"\x01\x00" * 4), 1000)
+    upload.add(audio_frame("pcm_s16le", b"\x02\x00" * 4), 1000)
+    assert upload.size == 16
+    with wave.open(io.BytesIO(upload.audio())) as wav_file:
+        assert (wav_file.getframerate(), wav_file.getnchannels(), wav_file.getsampwidth()) == (8000, 2, 2)
+        assert wav_file.readframes(4) == b"\x01\x00" * 4 + b"\x02\x00" * 4
+
+
+def test_container_uploads_must_be_complete_streams():
+    upload = AudioUpload({"type": "voice"}, "opus")
+    upload.add(audio_frame("opus", b"OggS rest of the stream"), 1000)
+    assert upload.audio() == b"OggS rest of the stream"
+    raw = AudioUpload({"type": "voice"}, "opus")
+    raw.add(audio_frame("opus", b"\x78\x01raw packet"), 1000)
+    with pytest.raises(ProtocolError, match="complete Ogg stream"):
+        raw.audio()
+
+
+def test_upload_rejects_mixed_codecs_and_oversized_streams():
+    upload = AudioUpload({"type": "voice"}, "wav")
+    with pytest.raises(ProtocolError, match="opened as wav"):
+        upload.add(audio_frame("webm", b"data"), 1000)
+    upload.add(audio_frame("wav", b"x" * 6), 10)
+    with pytest.raises(ProtocolError, match="larger than 10 bytes"):
+        upload.add(audio_frame("wav", b"x" * 5), 10)
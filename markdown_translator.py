@@ -4,105 +4,728 @@ Markdown Translator Script
 
 This script translates markdown files using a local Ollama API.
 Usage: python markdown_translator.py <input_file> <target_language> [--model MODEL_NAME]
+       [--orchestrator URL [--priority batch|text]] [--parallel N] [--batch-chars N]
+   or: python markdown_translator.py <file|dir|glob>... --languages French,Spanish [--jobs N]
+
+The document is split into segments (headings, paragraphs, list items, table
+rows). Fenced code blocks are never sent to the model, and inline code, links,
+images and URLs are replaced by placeholders before translation and restored
+afterwards. Segments are packed into batches of about --batch-chars characters
+that are translated concurrently, --parallel at a time, so long documents fit
+the model context and can use several Ollama slots.
+
+Replies are streamed from Ollama and the translation is written to a
+temporary file as each batch completes, in document order; the file is renamed
+over the output only when the document is done, so an interrupted run never
+leaves a truncated translation. Only the batches in flight are held in memory,
+whatever the document size, and progress is reported as tokens per second with
+an ETA.
+
+Translations are kept in a SQLite translation memory (--memory), keyed by the
+source segment, target language and model. Re-running on an edited document
+only sends new or changed segments to the model.
+
+Batch mode (--languages) translates every markdown file under the given
+paths into every language. Progress is checkpointed per file and language
+(--checkpoint), so an interrupted run resumes where it stopped; failed requests
+are retried with backoff, and jobs that still fail are reported and retried on
+the next run instead of aborting the batch.
+
+With --orchestrator (or COMPANION_ORCHESTRATOR_URL), requests go through the
+companion orchestrator's /llm/generate endpoint, which runs them at batch
+priority so they don't hold up voice and chat turns sharing the same Ollama
+host. Without it, Ollama is called directly and the orchestrator's scheduler
+never sees the requests.
 """
 
 import argparse
+import glob
+import hashlib
+import io
 import json
 import os
+import re
+import sqlite3
 import sys
+import threading
+import time
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from requests.adapters import HTTPAdapter
 
 OLLAMA_API_URL = "http://localhost:11434/api/generate"
 
-def read_markdown_file(file_path):
-    """Read content from a markdown file."""
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
-    except FileNotFoundError:
-        print(f"Error: File '{file_path}' not found.")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error reading file: {e}")
-        sys.exit(1)
+FENCE_RE = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+HEADING_RE = re.compile(r'^(\s{0,3}#{1,6}\s+)(.*)$')
+LIST_ITEM_RE = re.compile(r'^(\s*(?:[-*+]|\d+[.)])\s+(?:\[[ xX]\]\s+)?)(.*)$')
+QUOTE_RE = re.compile(r'^(\s*>\s?)(.*)$')
+TABLE_SEPARATOR_RE = re.compile(r'^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$')
+RULE_RE = re.compile(r'^\s{0,3}([-*_])(\s*\1){2,}\s*$')
+HTML_BLOCK_RE = re.compile(r'^\s{0,3}<(!--|/?[a-zA-Z][\w-]*[\s/>]|/?[a-zA-Z][\w-]*$)')
+
+# Spans the model must not see: inline code, images, links, autolinks and HTML tags, bare URLs
+PROTECTED_RE = re.compile(
+    r'(`+)[^`]+?\1'
+    r'|!?\[[^\]]*\]\([^)]*\)'
+    r'|!?\[[^\]]*\]\[[^\]]*\]'
+    r'|<[^>\s][^>]*>'
+    r'|https?://[^\s)>\]]+'
+)
+PLACEHOLDER = "⟦{}⟧"
+MARKER_RE = re.compile(r'^\s*<<<(\d+)>>>\s*$', re.MULTILINE)
 
-def write_translated_file(content, original_path, target_language):
-    """Write translated content to a new file with language suffix."""
+class TranslationError(Exception):
+    """A document could not be read, translated or written."""
+
+def translated_path(original_path, target_language):
+    """Path of the translation of a file: the original name with a language suffix."""
     original_path = Path(original_path)
-    new_filename = f"{original_path.stem}_{target_language}{original_path.suffix}"
-    new_path = original_path.parent / new_filename
-    
-    try:
-        with open(new_path, 'w', encoding='utf-8') as file:
-            file.write(content)
-        return new_path
-    except Exception as e:
-        print(f"Error writing translated file: {e}")
-        sys.exit(1)
+    return original_path.parent / f"{original_path.stem}_{target_language}{original_path.suffix}"
+
+def file_sha256(path):
+    """Hash of a file's content, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class TranslationMemory:
+    """Segment translations stored in SQLite, keyed by (source hash, target language, model)."""
+
+    def __init__(self, path):
+        # Shared by the batch mode's job threads, one statement at a time
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        # Lets several runs (e.g. one per language in CI) share the file
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " source_hash TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " translation TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (source_hash, language, model))"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def segment_hash(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def lookup(self, hashes, language, model):
+        """Return {source hash: translation} for the hashes that have one."""
+        found = {}
+        unique = list(set(hashes))
+        # Stay below SQLite's limit on query parameters
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            with self.lock:
+                rows = self.connection.execute(
+                    f"SELECT source_hash, translation FROM translations WHERE language = ? AND model = ?"
+                    f" AND source_hash IN ({','.join('?' * len(chunk))})",
+                    [language.lower(), model, *chunk]
+                ).fetchall()
+            found.update(rows)
+        return found
+
+    def store(self, entries, language, model):
+        """Save (source hash, translation) pairs."""
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (source_hash, language, model, translation, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(source_hash, language.lower(), model, translation, now) for source_hash, translation in entries]
+            )
+            self.connection.commit()
 
-def translate_text(text, target_language, model="phi3-optimized"):
-    """Translate text using Ollama API."""
-    prompt = f"""
-    You are a professional translator specializing in technical Markdown documentation.
-
-    Translate the following markdown text into {target_language} only Do not use or mix in other languages.
-    
-        Ensure that:
-        - Don't make literal translations.
-        - All headings, code blocks, links, and formatting are preserved exactly.
-        - Technical and domain-specific terms are translated with care, not literally.
-        - Sentences and paragraphs remain semantically equivalent to the original English.
-        - Do NOT translate or modify Markdown links or images. This means the entire expression [link text](URL) or ![alt text](URL) must be preserved exactly 
-        - Do NOT translate text inside backticks (`...`), single quotes ('...'), or angle brackets (<...>) — they may represent code, UI labels, or placeholders, and must be left as-is.
-        - Do NOT translate anything inside fenced code blocks (those surrounded by triple backticks like ```bash ... ``` or ```python ... ```).
-    Text to translate:
-    
-    {text}
+    def close(self):
+        self.connection.close()
+
+def iter_markdown(lines):
     """
-    
-    headers = {
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "model": model,
-        "prompt": prompt,
-        "stream": False
-    }
-    
-    try:
-        response = requests.post(OLLAMA_API_URL, headers=headers, json=data)
-        if response.status_code == 200:
+    Split markdown into literal text and translatable segments, line by line.
+
+    Yields (is_segment, text) pairs in document order. Literal text (blank
+    lines, code blocks, list markers, line endings) is copied as-is; segments
+    are headings, paragraphs, list items and table rows to translate. Only the
+    paragraph being read is held, so any document size streams through.
+    """
+    # (text, line ending) of the paragraph or list item the next plain line may continue
+    open_segment = None
+    fence = None
+
+    for line in lines:
+        text = line.rstrip('\r\n')
+        ending = line[len(text):]
+
+        if fence:
+            yield False, line
+            match = FENCE_RE.match(text)
+            if match and match.group(1)[0] == fence[0] and len(match.group(1)) >= len(fence) \
+                    and not text.strip()[len(match.group(1)):].strip():
+                fence = None
+            continue
+
+        match = FENCE_RE.match(text)
+        literal = bool(match) or not text.strip() or RULE_RE.match(text) \
+            or TABLE_SEPARATOR_RE.match(text) or HTML_BLOCK_RE.match(text)
+        if literal:
+            if open_segment is not None:
+                yield True, open_segment[0]
+                yield False, open_segment[1]
+                open_segment = None
+            if match:
+                fence = match.group(1)
+            yield False, line
+            continue
+
+        for pattern in (HEADING_RE, LIST_ITEM_RE, QUOTE_RE):
+            match = pattern.match(text)
+            if match:
+                prefix, body = match.groups()
+                break
+        else:
+            prefix, body = None, text
+
+        if prefix is None and open_segment is not None:
+            # Continuation of the paragraph or list item above
+            open_segment = (open_segment[0] + "\n" + body, ending)
+            continue
+
+        if open_segment is not None:
+            yield True, open_segment[0]
+            yield False, open_segment[1]
+            open_segment = None
+        if prefix:
+            yield False, prefix
+        # Headings and table rows are single lines; paragraphs and list items may continue
+        if pattern is HEADING_RE or body.lstrip().startswith('|'):
+            yield True, body
+            yield False, ending
+        else:
+            open_segment = (body, ending)
+
+    if open_segment is not None:
+        yield True, open_segment[0]
+        yield False, open_segment[1]
+
+def mask_segment(text, masks):
+    """Replace protected spans with numbered placeholders, recording the originals in masks."""
+    def replace(match):
+        masks.append(match.group(0))
+        return PLACEHOLDER.format(len(masks) - 1)
+    return PROTECTED_RE.sub(replace, text)
+
+def unmask_segment(translated, original, masks):
+    """
+    Restore placeholders in a translated segment.
+
+    Falls back to the original text if the model dropped a placeholder, since
+    the code or link it stood for would otherwise be lost.
+    """
+    numbers = [int(n) for n in re.findall(r'⟦(\d+)⟧', original)]
+    if any(PLACEHOLDER.format(n) not in translated for n in numbers):
+        return None
+    for n in numbers:
+        translated = translated.replace(PLACEHOLDER.format(n), masks[n])
+    return translated
+
+def build_prompt(texts, target_language):
+    """Prompt translating one or more masked segments."""
+    rules = f"""You are a professional translator specializing in technical Markdown documentation.
+Translate into {target_language} only. Do not use or mix in other languages.
+
+Ensure that:
+- Don't make literal translations; translate technical and domain-specific terms with care.
+- Sentences remain semantically equivalent to the original.
+- Markdown formatting such as **bold**, *italics* and line breaks is preserved.
+- Tokens like ⟦0⟧ stand for code, links or URLs: copy them unchanged, in the right place.
+- Do NOT translate text inside single quotes ('...'); it may be a UI label.
+- Reply with the translation only, without explanations.
+"""
+    if len(texts) == 1:
+        return f"{rules}\nText to translate:\n\n{texts[0]}"
+    numbered = "\n".join(f"<<<{i + 1}>>>\n{text}" for i, text in enumerate(texts))
+    return (f"{rules}- Each segment starts with a marker line like <<<1>>>. Keep every marker line "
+            f"exactly as it is and in the same order, and translate the text after it.\n"
+            f"\nSegments to translate:\n\n{numbered}")
+
+class ModelClient:
+    """
+    Sends prompts to Ollama, or to the orchestrator's scheduled proxy of it.
+
+    Requests share one pooled HTTP session, and a request that fails with a
+    connection error, 429 or 5xx is retried with exponential backoff. Ollama
+    replies are streamed, so progress can be reported per generated token.
+    """
+
+    def __init__(self, model="phi3-optimized", orchestrator_url=None, priority="batch",
+                 pool_size=4, retries=3, backoff=2.0):
+        self.model = model
+        self.orchestrator_url = orchestrator_url
+        self.priority = priority
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def complete(self, prompt, on_tokens=None):
+        """
+        Send one prompt and return the model's reply.
+
+        on_tokens, if given, is called with the number of tokens generated as
+        they arrive (all at once through the orchestrator, which doesn't stream).
+        """
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        if self.orchestrator_url:
+            api_url = f"{self.orchestrator_url.rstrip('/')}/llm/generate"
+            data = {
+                "model": self.model,
+                "prompt": prompt,
+                "priority": self.priority
+            }
+        else:
+            api_url = OLLAMA_API_URL
+            data = {
+                "model": self.model,
+                "prompt": prompt,
+                "stream": True
+            }
+
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            unreachable = False
+            try:
+                with self.session.post(api_url, headers=headers, json=data, timeout=600,
+                                       stream=data.get("stream", False)) as response:
+                    if response.status_code == 200:
+                        return self._read_reply(response, on_tokens)
+                    error = f"API Error: {response.status_code}\n{response.text}"
+                retryable = response.status_code == 429 or response.status_code >= 500
+                retry_after = response.headers.get("Retry-After")
+            except requests.exceptions.RequestException as e:
+                error = f"Request failed: {e}"
+                retryable = unreachable = True
+            if not retryable or attempt == self.retries:
+                break
+            delay = self.backoff * 2 ** attempt
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            print(f"{error.splitlines()[0]}; retrying in {delay:.0f}s ({attempt + 1}/{self.retries})")
+            time.sleep(delay)
+
+        if unreachable:
+            if self.orchestrator_url:
+                error += f"\nMake sure the orchestrator is running at {self.orchestrator_url}"
+            else:
+                error += "\nMake sure Ollama is running locally at http://localhost:11434"
+        raise TranslationError(error)
+
+    @staticmethod
+    def _read_reply(response, on_tokens):
+        if not response.headers.get("Content-Type", "").startswith("application/x-ndjson"):
             result = response.json()
+            if on_tokens is not None:
+                on_tokens(result.get("eval_count") or 0)
             return result["response"]
+        # Ollama streams one JSON object per generated token
+        fragments = []
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise requests.exceptions.RequestException(chunk["error"])
+            fragment = chunk.get("response", "")
+            if fragment:
+                fragments.append(fragment)
+                if on_tokens is not None:
+                    on_tokens(1)
+            if chunk.get("done"):
+                break
+        return "".join(fragments)
+
+    def close(self):
+        self.session.close()
+
+def parse_numbered_reply(reply, count):
+    """Split a reply into its marked segments, or return None if markers are missing."""
+    pieces = MARKER_RE.split(reply)
+    # pieces: [preamble, "1", text, "2", text, ...]
+    found = {}
+    for number, text in zip(pieces[1::2], pieces[2::2]):
+        found[int(number)] = text.strip()
+    if sorted(found) != list(range(1, count + 1)):
+        return None
+    return [found[i] for i in range(1, count + 1)]
+
+def translate_batch(texts, target_language, client, on_tokens=None):
+    """
+    Translate masked segments with as few requests as possible.
+
+    If the model garbles the segment markers, the batch is split in half and
+    each half retried, down to single segments.
+    """
+    reply = client.complete(build_prompt(texts, target_language), on_tokens)
+    if len(texts) == 1:
+        return [reply.strip()]
+    translated = parse_numbered_reply(reply, len(texts))
+    if translated is not None:
+        return translated
+    middle = len(texts) // 2
+    return (translate_batch(texts[:middle], target_language, client, on_tokens)
+            + translate_batch(texts[middle:], target_language, client, on_tokens))
+
+class Progress:
+    """Generation rate and ETA of one document, printed at most every `interval` seconds."""
+
+    def __init__(self, total_chars, label="", interval=5.0):
+        self.total_chars = total_chars
+        self.label = label
+        self.interval = interval
+        self.done_chars = 0
+        self.tokens = 0
+        self.started = time.monotonic()
+        self.reported = self.started
+        self.lock = threading.Lock()
+
+    def add_tokens(self, count):
+        with self.lock:
+            self.tokens += count
+        self.report()
+
+    def add_source(self, chars):
+        with self.lock:
+            self.done_chars += chars
+        self.report()
+
+    def report(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.reported < self.interval:
+                return
+            self.reported = now
+            elapsed = max(now - self.started, 1e-6)
+            line = f"{self.label}{self.tokens} tokens, {self.tokens / elapsed:.1f} tokens/s"
+            if self.total_chars:
+                fraction = min(self.done_chars / self.total_chars, 1.0)
+                line += f", {fraction:.0%} done"
+                if 0 < fraction < 1:
+                    line += f", ETA {format_duration(elapsed * (1 - fraction) / fraction)}"
+        print(line, flush=True)
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+class Batch:
+    """Consecutive document parts whose segments are translated in one request."""
+
+    __slots__ = ("parts", "segments", "chars", "pending", "masked", "masks", "hashes", "future")
+
+    def __init__(self):
+        # Literal text, or the index of a segment in segments
+        self.parts = []
+        self.segments = []
+        self.chars = 0
+        self.pending = []
+        self.masked = {}
+        self.masks = []
+        self.hashes = []
+        self.future = None
+
+def translate_stream(lines, out, target_language, client, batch_chars=3000, memory=None, executor=None,
+                     label="", progress=None):
+    """
+    Translate markdown read line by line, writing the translation to `out` as it completes.
+
+    Segments are packed into batches of about batch_chars characters and
+    submitted to `executor` as they are read. Finished batches are written in
+    document order, and at most two batches per worker are held at once, so
+    memory use doesn't grow with the document. Batch mode shares one executor
+    between documents to bound the requests in flight; by default a pool of
+    4 threads is used for this document alone.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=4)
+    on_tokens = progress.add_tokens if progress is not None else None
+    window = deque()
+    max_window = 2 * getattr(executor, '_max_workers', 4)
+    stats = {"reused": 0, "translated": 0, "kept": 0}
+
+    def submit(batch):
+        batch.hashes = [TranslationMemory.segment_hash(segment) for segment in batch.segments]
+        batch.pending = list(range(len(batch.segments)))
+        if memory is not None and batch.segments:
+            # Segments already in the translation memory are not sent again
+            remembered = memory.lookup(batch.hashes, target_language, client.model)
+            batch.pending = [i for i, source_hash in enumerate(batch.hashes) if source_hash not in remembered]
+            for i, source_hash in enumerate(batch.hashes):
+                if source_hash in remembered:
+                    batch.segments[i] = remembered[source_hash]
+        batch.masked = {i: mask_segment(batch.segments[i], batch.masks) for i in batch.pending}
+        if batch.pending:
+            batch.future = executor.submit(translate_batch, [batch.masked[i] for i in batch.pending],
+                                           target_language, client, on_tokens)
+        window.append(batch)
+
+    def write_oldest():
+        batch = window.popleft()
+        stats["reused"] += len(batch.segments) - len(batch.pending)
+        if batch.future is not None:
+            learned = []
+            for i, result in zip(batch.pending, batch.future.result()):
+                restored = unmask_segment(result, batch.masked[i], batch.masks)
+                if restored is None:
+                    print(f"{label}Warning: a segment lost a code span or link in translation, keeping the original")
+                    stats["kept"] += 1
+                else:
+                    batch.segments[i] = restored
+                    learned.append((batch.hashes[i], restored))
+                    stats["translated"] += 1
+            if memory is not None and learned:
+                memory.store(learned, target_language, client.model)
+        out.write("".join(batch.segments[part] if isinstance(part, int) else part for part in batch.parts))
+        out.flush()
+        if progress is not None:
+            progress.add_source(batch.chars)
+
+    try:
+        batch = Batch()
+        for is_segment, text in iter_markdown(lines):
+            if not is_segment:
+                batch.parts.append(text)
+                batch.chars += len(text)
+                continue
+            if batch.segments and sum(len(segment) for segment in batch.segments) + len(text) > batch_chars:
+                submit(batch)
+                batch = Batch()
+                while len(window) > max_window:
+                    write_oldest()
+            batch.parts.append(len(batch.segments))
+            batch.segments.append(text)
+            batch.chars += len(text)
+        submit(batch)
+        while window:
+            write_oldest()
+    finally:
+        for pending_batch in window:
+            if pending_batch.future is not None:
+                pending_batch.future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    print(f"{label}Reused {stats['reused']} segments from translation memory, translated {stats['translated']}"
+          + (f", kept {stats['kept']} in the original" if stats['kept'] else ""))
+    if progress is not None:
+        progress.report(force=True)
+
+def translate_text(text, target_language, client, batch_chars=3000, memory=None, executor=None, label=""):
+    """Translate a markdown document held in memory and return the translation."""
+    out = io.StringIO()
+    translate_stream(io.StringIO(text), out, target_language, client, batch_chars, memory, executor, label)
+    return out.getvalue()
+
+def translate_file(input_path, target_language, client, batch_chars=3000, memory=None, executor=None, label=""):
+    """
+    Translate a markdown file into a new file with a language suffix.
+
+    The translation is written to a temporary file next to the output as it
+    completes and renamed over the output only once the whole document is
+    done, so a failed run never leaves a truncated translation.
+
+    Returns:
+        Path of the translated file
+    """
+    output_path = translated_path(input_path, target_language)
+    try:
+        total_chars = os.path.getsize(input_path)
+        source = open(input_path, 'r', encoding='utf-8')
+    except FileNotFoundError:
+        raise TranslationError(f"Error: File '{input_path}' not found.")
+    except Exception as e:
+        raise TranslationError(f"Error reading file: {e}")
+
+    progress = Progress(total_chars, label)
+    temp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.{threading.get_ident()}.part")
+    with source:
+        try:
+            out = open(temp_path, 'w', encoding='utf-8')
+        except Exception as e:
+            raise TranslationError(f"Error writing translated file: {e}")
+        try:
+            with out:
+                translate_stream(source, out, target_language, client, batch_chars, memory, executor,
+                                 label, progress)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    return output_path
+
+def collect_files(inputs, languages):
+    """Markdown files named by paths, directories (searched recursively) and glob patterns."""
+    files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = sorted(str(path) for path in Path(item).rglob('*.md'))
+        elif any(char in item for char in '*?['):
+            matches = sorted(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
         else:
-            print(f"API Error: {response.status_code}")
-            print(response.text)
-            sys.exit(1)
-    except requests.exceptions.RequestException as e:
-        print(f"Request failed: {e}")
-        print("Make sure Ollama is running locally at http://localhost:11434")
-        sys.exit(1)
+            matches = [item]
+        files.extend(matches)
+    # Skip translations written by earlier runs, e.g. guide_French.md
+    suffixes = tuple(f"_{language}" for language in languages)
+    unique = []
+    for path in files:
+        if Path(path).stem.endswith(suffixes) or path in unique:
+            continue
+        unique.append(path)
+    return unique
+
+def load_checkpoint(path):
+    """Job states saved by an earlier batch run, keyed by "file|language"."""
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file).get("jobs", {})
+    except (OSError, ValueError) as e:
+        print(f"Warning: ignoring unreadable checkpoint {path}: {e}")
+        return {}
+
+def save_checkpoint(path, jobs):
+    """Write job states atomically, so an interrupted run never leaves a truncated file."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump({"version": 1, "jobs": jobs}, file, indent=2, sort_keys=True)
+    os.replace(temp_path, temp_path[:-len(".tmp")])
+
+def run_batch(args, client, memory):
+    """
+    Translate every matching file into every language, resuming from the checkpoint.
+
+    Returns:
+        Number of jobs that failed
+    """
+    languages = [language.strip() for language in args.languages.split(',') if language.strip()]
+    files = collect_files(args.inputs, languages)
+    if not files:
+        print("No markdown files matched")
+        return 0
+
+    jobs = load_checkpoint(args.checkpoint)
+    lock = threading.Lock()
+    manifest = []
+    for path in files:
+        try:
+            source_hash = file_sha256(path)
+        except OSError as e:
+            print(f"Error reading file: {e}")
+            continue
+        for language in languages:
+            key = f"{path}|{language}"
+            state = jobs.get(key, {})
+            if state.get("status") == "done" and state.get("source_sha256") == source_hash \
+                    and os.path.exists(state.get("output", "")):
+                continue
+            jobs[key] = {"status": "pending", "source_sha256": source_hash}
+            manifest.append((key, path, language))
+    skipped = len(files) * len(languages) - len(manifest)
+    print(f"{len(manifest)} jobs to run ({len(files)} files x {len(languages)} languages, "
+          f"{skipped} already done)")
+    save_checkpoint(args.checkpoint, jobs)
+
+    def run_job(job):
+        key, path, language = job
+        label = f"[{Path(path).name} -> {language}] "
+        try:
+            output_path = translate_file(path, language, client, args.batch_chars, memory, batch_executor, label)
+            state = {"status": "done", "output": str(output_path), "finished_at": time.time()}
+            print(f"{label}Saved to: {output_path}")
+        except Exception as e:
+            # One bad document must not abort the batch; it is retried on the next run
+            state = {"status": "failed", "error": str(e), "finished_at": time.time()}
+            print(f"{label}Failed: {e}")
+        with lock:
+            jobs[key].update(state)
+            save_checkpoint(args.checkpoint, jobs)
+        return state["status"]
+
+    # Documents run --jobs at a time, while their batches share one pool of --parallel requests
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as batch_executor, \
+            ThreadPoolExecutor(max_workers=max(1, args.jobs)) as job_executor:
+        statuses = list(job_executor.map(run_job, manifest))
+
+    failed = statuses.count("failed")
+    print(f"Batch complete: {statuses.count('done')} translated, {skipped} skipped, {failed} failed"
+          + (f"; re-run to retry the failed jobs (checkpoint: {args.checkpoint})" if failed else ""))
+    return failed
 
 def parse_arguments():
-    parser = argparse.ArgumentParser(description='Translate markdown files using Ollama API')
-    parser.add_argument('input_file', help='Path to the markdown file to translate')
-    parser.add_argument('target_language', help='Target language for translation (e.g. French, Spanish, German)')
+    parser = argparse.ArgumentParser(
+        description='Translate markdown files using Ollama API',
+        epilog='Batch mode: python markdown_translator.py docs/ "guides/**/*.md" README.md --languages French,Spanish'
+    )
+    parser.add_argument('inputs', nargs='+', metavar='input_file',
+                        help='Markdown file and target language (e.g. French, Spanish, German); '
+                             'with --languages, any number of files, directories and glob patterns')
+    parser.add_argument('--languages', help='Comma-separated target languages; enables batch mode')
     parser.add_argument('--model', default='phi3-optimized', help='Ollama model to use for translation (default: phi3-optimized)')
-    return parser.parse_args()
+    parser.add_argument('--orchestrator', metavar='URL', default=os.getenv('COMPANION_ORCHESTRATOR_URL') or None,
+                        help='Send requests through the companion orchestrator at URL (e.g. http://localhost:8000) '
+                             'instead of calling Ollama directly (default: $COMPANION_ORCHESTRATOR_URL; '
+                             'pass an empty URL to call Ollama directly)')
+    parser.add_argument('--priority', default='batch', choices=['batch', 'text'], help='Priority class for requests sent through the orchestrator (default: batch)')
+    parser.add_argument('--parallel', type=int, default=4, help='Requests in flight at once; match OLLAMA_NUM_PARALLEL (default: 4)')
+    parser.add_argument('--jobs', type=int, default=2, help='Documents translated at once in batch mode (default: 2)')
+    parser.add_argument('--batch-chars', type=int, default=3000, help='Characters of source text per request, to stay within the model context (default: 3000)')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of a failed request, with exponential backoff (default: 3)')
+    parser.add_argument('--checkpoint', default='.translation-checkpoint.json', help='Batch mode progress file; an interrupted run resumes from it (default: .translation-checkpoint.json)')
+    parser.add_argument('--memory', default='.translation-memory.sqlite3', help='Translation memory file reused across runs (default: .translation-memory.sqlite3)')
+    parser.add_argument('--no-memory', action='store_true', help='Translate every segment without reading or updating the translation memory')
+    args = parser.parse_args()
+    if not args.languages:
+        if len(args.inputs) != 2:
+            parser.error('expected <input_file> <target_language>, or --languages for batch mode')
+        args.input_file, args.target_language = args.inputs
+    return args
 
 def main():
     args = parse_arguments()
-    
-    print(f"Reading markdown file: {args.input_file}")
-    content = read_markdown_file(args.input_file)
-    
-    print(f"Translating to {args.target_language} using model {args.model}...")
-    translated_content = translate_text(content, args.target_language, args.model)
-    
-    output_path = write_translated_file(translated_content, args.input_file, args.target_language)
-    print(f"Translation complete! Saved to: {output_path}")
+
+    memory = None if args.no_memory else TranslationMemory(args.memory)
+    client = ModelClient(args.model, args.orchestrator, args.priority, pool_size=args.parallel,
+                         retries=args.retries)
+    try:
+        if args.languages:
+            failed = run_batch(args, client, memory)
+            sys.exit(1 if failed else 0)
+
+        print(f"Translating {args.input_file} to {args.target_language} using model {args.model}...")
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as executor:
+            output_path = translate_file(args.input_file, args.target_language, client, args.batch_chars,
+                                         memory, executor)
+        print(f"Translation complete! Saved to: {output_path}")
+    except TranslationError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        client.close()
+        if memory is not None:
+            memory.close()
 
 if __name__ == "__main__":
     main()
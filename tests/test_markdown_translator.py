@@ -0,0 +1,212 @@
+"""Tests for markdown segmentation, masking and batched translation."""
+import pytest
+
+from markdown_translator import (
+    MARKER_RE,
+    TranslationMemory,
+    build_prompt,
+    iter_markdown,
+    mask_segment,
+    parse_numbered_reply,
+    translate_batch,
+    translate_text,
+    unmask_segment,
+)
+
+DOCUMENT = """# Getting *started*
+
+Install the package with `pip install companion` and
+read the [guide](https://example.com/guide.md).
+
+- First item with ![logo](img/logo.png)
+  continued on the next line
+- [x] Done task
+1. Numbered item
+
+> Quoted text
+
+| Name | Value |
+|------|:-----:|
+| `a`  | one   |
+
+---
+
+```python
+# comment, not a heading
+print("hello")
+```
+
+~~~~
+```
+still code
+~~~~
+
+<div align="center">
+<img src="x.png">
+</div>
+
+See https://example.com/docs for more.
+Line with CRLF\r
+"""
+
+
+class FakeClient:
+    """Translates by upper-casing each segment, keeping markers and placeholders."""
+
+    model = "test-model"
+
+    def __init__(self, garble_above=None, drop_placeholders=False):
+        self.prompts = []
+        self.garble_above = garble_above
+        self.drop_placeholders = drop_placeholders
+
+    def complete(self, prompt, on_tokens=None):
+        self.prompts.append(prompt)
+        texts = MARKER_RE.split(prompt.split("translate:\n\n", 1)[1])
+        if len(texts) == 1:
+            return self._translate(texts[0])
+        if self.garble_above is not None and len(texts) // 2 > self.garble_above:
+            return "Here you go: " + " ".join(self._translate(text) for text in texts[2::2])
+        return "\n".join(f"<<<{number}>>>\n{self._translate(text)}"
+                         for number, text in zip(texts[1::2], texts[2::2]))
+
+    def _translate(self, text):
+        text = text.strip().upper()
+        if self.drop_placeholders:
+            text = text.replace("⟦0⟧", "")
+        return text
+
+
+def segments(text):
+    return [part for is_segment, part in iter_markdown(text.splitlines(keepends=True)) if is_segment]
+
+
+def test_segmentation_reassembles_the_document():
+    parts = iter_markdown(DOCUMENT.splitlines(keepends=True))
+    assert "".join(text for _, text in parts) == DOCUMENT
+
+
+def test_segments_are_headings_paragraphs_list_items_and_table_rows():
+    assert segments(DOCUMENT) == [
+        "Getting *started*",
+        "Install the package with `pip install companion` and\nread the [guide](https://example.com/guide.md).",
+        "First item with ![logo](img/logo.png)\n  continued on the next line",
+        "Done task",
+        "Numbered item",
+        "Quoted text",
+        "| Name | Value |",
+        "| `a`  | one   |",
+        "See https://example.com/docs for more.\nLine with CRLF",
+    ]
+
+
+def test_code_blocks_are_never_segments():
+    text = "```\n# not a heading\n\nplain\n```\nafter\n"
+    assert segments(text) == ["after"]
+    # A fence closes only with the same character and at least its length
+    text = "````\n```\n~~~\ninside\n````\nafter\n"
+    assert segments(text) == ["after"]
+
+
+def test_unclosed_fence_runs_to_the_end():
+    assert segments("text\n```\ncode\n") == ["text"]
+
+
+def test_mask_and_unmask_protected_spans():
+    text = ("Run `make test`, see [docs](https://x.io/a_b) or ![img](a.png), "
+            "[ref][1], <kbd>Ctrl</kbd> and https://example.com/path?q=1.")
+    masks = []
+    masked = mask_segment(text, masks)
+    assert masks == ["`make test`", "[docs](https://x.io/a_b)", "![img](a.png)", "[ref][1]",
+                     "<kbd>", "</kbd>", "https://example.com/path?q=1."]
+    assert masked == "Run ⟦0⟧, see ⟦1⟧ or ⟦2⟧, ⟦3⟧, ⟦4⟧Ctrl⟦5⟧ and ⟦6⟧"
+    translated = "Lancez ⟦0⟧, voir ⟦1⟧ ou ⟦2⟧, ⟦3⟧, ⟦4⟧Ctrl⟦5⟧ et ⟦6⟧"
+    assert unmask_segment(translated, masked, masks) == (
+        "Lancez `make test`, voir [docs](https://x.io/a_b) ou ![img](a.png), "
+        "[ref][1], <kbd>Ctrl</kbd> et https://example.com/path?q=1.")
+
+
+def test_masks_are_numbered_across_a_batch():
+    masks = []
+    first = mask_segment("a `x`", masks)
+    second = mask_segment("b `y` and `z`", masks)
+    assert (first, second) == ("a ⟦0⟧", "b ⟦1⟧ and ⟦2⟧")
+    # Moved placeholders are fine; each segment only needs its own
+    assert unmask_segment("⟦2⟧ et ⟦1⟧ b", second, masks) == "`z` et `y` b"
+
+
+def test_unmask_refuses_a_translation_that_lost_a_placeholder():
+    masks = []
+    masked = mask_segment("Use `pip` and `npm`", masks)
+    assert unmask_segment("Utilisez ⟦0⟧", masked, masks) is None
+
+
+def test_parse_numbered_reply():
+    reply = "Sure!\n<<<1>>>\nBonjour\n\n<<<2>>>\nle monde\n  <<<3>>>  \n"
+    assert parse_numbered_reply(reply, 3) == ["Bonjour", "le monde", ""]
+    assert parse_numbered_reply("<<<1>>>\nBonjour\n<<<3>>>\nx", 3) is None
+    assert parse_numbered_reply("<<<1>>>\na\n<<<2>>>\nb\n<<<3>>>\nc", 2) is None
+    assert parse_numbered_reply("no markers", 1) is None
+
+
+def test_prompt_numbers_segments_only_for_batches():
+    single = build_prompt(["one"], "French")
+    assert single.endswith("Text to translate:\n\none")
+    assert "<<<" not in single.split("translate:")[1]
+    batch = build_prompt(["one", "two"], "French")
+    assert batch.endswith("<<<1>>>\none\n<<<2>>>\ntwo")
+
+
+def test_garbled_batches_are_split_until_they_parse():
+    client = FakeClient(garble_above=2)
+    texts = [f"segment {i}" for i in range(5)]
+    assert translate_batch(texts, "French", client) == [f"SEGMENT {i}" for i in range(5)]
+    # 5 garbled, then halves of 2 and 3, the 3 split again into 1 and 2
+    assert len(client.prompts) == 5
+
+
+def test_translate_text_keeps_code_links_and_layout():
+    client = FakeClient()
+    translated = translate_text(DOCUMENT, "French", client, batch_chars=80)
+    assert len(client.prompts) > 1
+    assert translated.splitlines()[:4] == [
+        "# GETTING *STARTED*",
+        "",
+        "INSTALL THE PACKAGE WITH `pip install companion` AND",
+        "READ THE [guide](https://example.com/guide.md).",
+    ]
+    assert "- FIRST ITEM WITH ![logo](img/logo.png)\n  CONTINUED ON THE NEXT LINE\n" in translated
+    assert "- [x] DONE TASK\n1. NUMBERED ITEM\n\n> QUOTED TEXT\n" in translated
+    assert "|------|:-----:|\n| `a`  | ONE   |\n" in translated
+    code = DOCUMENT[DOCUMENT.index("```python"):DOCUMENT.index("<div")]
+    assert code in translated
+    assert '<div align="center">\n<img src="x.png">\n</div>\n' in translated
+    assert translated.endswith("SEE https://example.com/docs FOR MORE.\nLINE WITH CRLF\r\n")
+
+
+def test_segments_that_lose_a_placeholder_stay_in_the_original():
+    translated = translate_text("Run `make`.\n\nPlain text.\n", "French", FakeClient(drop_placeholders=True))
+    assert translated == "Run `make`.\n\nPLAIN TEXT.\n"
+
+
+def test_translation_memory_skips_known_segments(tmp_path):
+    memory = TranslationMemory(str(tmp_path / "memory.db"))
+    try:
+        first = FakeClient()
+        document = "# Title\n\nFirst paragraph.\n"
+        assert translate_text(document, "French", first, memory=memory) == "# TITLE\n\nFIRST PARAGRAPH.\n"
+        assert len(first.prompts) == 1
+
+        second = FakeClient()
+        edited = document + "\nNew paragraph.\n"
+        translated = translate_text(edited, "french", second, memory=memory)
+        assert translated == "# TITLE\n\nFIRST PARAGRAPH.\n\nNEW PARAGRAPH.\n"
+        assert len(second.prompts) == 1
+        assert "Title" not in second.prompts[0] and "New paragraph." in second.prompts[0]
+
+        # Other languages are translated afresh
+        third = FakeClient()
+        translate_text(document, "Spanish", third, memory=memory)
+        assert len(third.prompts) == 1
+    finally:
+        memory.close()
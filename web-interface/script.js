@@ -26,7 +26,8 @@ const API_ENDPOINTS = {
     modes: '/modes',
     setMode: '/mode',
     models: '/models',     // New endpoint for fetching available models
-    setModel: '/model'     // New endpoint for setting the active model
+    setModel: '/model',    // New endpoint for setting the active model
+    fillers: '/fillers'    // Acknowledgement clips played while the AI is thinking
 };
 
 console.log('Debug - API endpoints:', API_ENDPOINTS);
@@ -54,7 +55,11 @@ const state = {
     currentModel: '',
     availableModes: [],
     availableModels: [],
-    useVoiceResponse: true
+    useVoiceResponse: true,
+    fillers: [],           // Preloaded Audio elements for the current mode
+    fillerIndex: 0,
+    fillerCrossfadeMs: 250,
+    fillerAudio: null      // The filler clip playing right now, if any
 };
 
 // Emotion mapping
@@ -78,6 +83,8 @@ async function initializeApp() {
         loadAvailableModes(),
         loadAvailableModels()
     ]);
+    // Needs the current mode
+    await loadFillers();
     
     // Initialize voice response toggle from state
     elements.voiceResponseToggle.checked = state.useVoiceResponse;
@@ -264,6 +271,7 @@ async function setCompanionMode(modeId) {
         console.log(`Mode switched to ${modeId}`);
         state.currentMode = modeId;
         updateStatusMessage(`Now in ${modeId} mode`);
+        loadFillers();
         
         // Add system message about mode change
         const modeName = state.availableModes.find(m => m.name === modeId)?.display_name || modeId;
@@ -429,6 +437,9 @@ async function sendTextMessage() {
     // Add user message to UI
     addUserMessage(text);
     
+    // Fill the silence until the reply's audio arrives
+    playFiller();
+    
     // Send to API
     try {
         await sendMessage(text);
@@ -452,6 +463,9 @@ async function sendVoiceMessage(audioBlob) {
             return;
         }
         
+        // Fill the silence while the speech is transcribed and answered
+        playFiller();
+        
         // Create AbortController to handle timeouts
         const controller = new AbortController();
         const timeoutId = setTimeout(() => {
@@ -525,10 +539,12 @@ async function sendVoiceMessage(audioBlob) {
         } else {
             console.warn('No text in STT response:', data);
             updateStatusMessage('Could not recognize speech');
+            stopFiller();
             addSystemMessage('I couldn\'t understand what you said. Please try again or use text input.');
         }
     } catch (error) {
         console.error('Error with speech-to-text:', error);
+        stopFiller();
         updateStatusMessage('Error processing speech');
         // Show a user-friendly error message
         addSystemMessage(`Sorry, there was an error processing your voice: ${error.message || 'Unknown error'}`);
@@ -623,11 +639,14 @@ async function sendMessage(text) {
         // Play audio if voice response is enabled and audio_url is available
         if (state.useVoiceResponse && data.audio_url) {
             playResponseAudio(data.audio_url);
+        } else {
+            stopFiller();
         }
         
         updateStatusMessage('Ready');
     } catch (error) {
         hideTypingIndicator();
+        stopFiller();
         console.error('Error in chat:', error);
         
         if (error.name === 'AbortError') {
@@ -798,6 +817,8 @@ async function playResponseAudio(audioUrl) {
         
         console.log('Playing audio from URL:', audioUrl);
         const audio = new Audio(audioUrl);
+        const filler = state.fillerAudio;
+        state.fillerAudio = null;
         
         // Set up event handlers
         audio.onerror = (e) => {
@@ -814,10 +835,90 @@ async function playResponseAudio(audioUrl) {
             }
         };
         
-        await audio.play();
+        if (filler && !filler.paused && !filler.ended) {
+            // Start the reply silently and fade it in over the filler
+            audio.volume = 0;
+            await audio.play();
+            crossfade(filler, audio, state.fillerCrossfadeMs);
+        } else {
+            await audio.play();
+        }
     } catch (error) {
         console.error('Error playing audio:', error);
+        stopFiller();
         updateStatusMessage('Error playing audio');
         addSystemMessage('Sorry, there was an error playing the audio response. This might be due to network issues or an unsupported audio format.');
     }
 }
+
+// Filler clips
+async function loadFillers() {
+    try {
+        const params = new URLSearchParams({ mode: state.currentMode, user_id: state.userId || 'web_user' });
+        const response = await fetch(`${API_BASE_URL}${API_ENDPOINTS.fillers}?${params}`);
+        if (!response.ok) {
+            throw new Error(`Fillers endpoint returned ${response.status}`);
+        }
+        const data = await response.json();
+        state.fillerCrossfadeMs = data.crossfade_ms;
+        // Preloaded, so a clip starts the moment a message is sent
+        state.fillers = data.clips.map(clip => {
+            const audio = new Audio(`${API_BASE_URL}${clip.audio_url}`);
+            audio.preload = 'auto';
+            return audio;
+        });
+        state.fillerIndex = 0;
+        console.log(`Loaded ${state.fillers.length} filler clips for ${state.currentMode} mode`);
+    } catch (error) {
+        // Replies just start after a silence
+        console.warn('Could not load filler clips:', error);
+        state.fillers = [];
+    }
+}
+
+function playFiller() {
+    if (!state.useVoiceResponse || state.fillers.length === 0 || state.fillerAudio) {
+        return;
+    }
+    const filler = state.fillers[state.fillerIndex % state.fillers.length];
+    state.fillerIndex += 1;
+    filler.currentTime = 0;
+    filler.volume = 1;
+    state.fillerAudio = filler;
+    filler.onended = () => {
+        if (state.fillerAudio === filler) {
+            state.fillerAudio = null;
+        }
+    };
+    filler.play().catch(error => {
+        console.warn('Could not play filler clip:', error);
+        state.fillerAudio = null;
+    });
+}
+
+function stopFiller() {
+    const filler = state.fillerAudio;
+    state.fillerAudio = null;
+    if (filler && !filler.paused) {
+        crossfade(filler, null, state.fillerCrossfadeMs);
+    }
+}
+
+function crossfade(from, to, durationMs) {
+    // Fade `from` out and `to` (if any) in, then stop `from`
+    const started = performance.now();
+    const step = (now) => {
+        const progress = durationMs > 0 ? Math.min((now - started) / durationMs, 1) : 1;
+        from.volume = 1 - progress;
+        if (to) {
+            to.volume = progress;
+        }
+        if (progress < 1) {
+            requestAnimationFrame(step);
+        } else {
+            from.pause();
+            from.volume = 1;
+        }
+    };
+    requestAnimationFrame(step);
+}